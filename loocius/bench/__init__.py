@@ -0,0 +1,3 @@
+"""Benchmarks. Run any of them with `python -m loocius.bench.<name>`.
+
+"""
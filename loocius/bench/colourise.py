@@ -0,0 +1,97 @@
+"""Benchmark the colour kernels in `loocius.tools.colourise` against the
+colour-science round trip that `colourise_hsv` used to make for every hue.
+
+Usage:
+    python -m loocius.bench.colourise [stimulus.png] [number of hues]
+
+"""
+import numpy as np
+from PIL import Image
+from sys import argv
+from time import perf_counter
+from loocius.tools import colourise as k
+from loocius.tools.paths import icon_path
+
+
+def colour_science(rgb, hues):
+    """The old path: convert to HSV and back with colour-science, once per
+    hue, in float64.
+
+    """
+    from colour.models.rgb.deprecated import RGB_to_HSV, HSV_to_RGB
+
+    out = []
+
+    for hue in hues:
+
+        hsv = RGB_to_HSV(rgb / 255.)
+        hsv[..., [0]] = hue / 360.
+        out.append((HSV_to_RGB(hsv) * 255).astype('uint8'))
+
+    return np.stack(out)
+
+
+def timed(func, *args, reps=3):
+    """Return the best time (s) of `reps` calls and the last result.
+
+    """
+    best = float('inf')
+
+    for _ in range(reps):
+
+        t0 = perf_counter()
+        result = func(*args)
+        best = min(best, perf_counter() - t0)
+
+    return best, result
+
+
+def main():
+
+    src = argv[1] if len(argv) > 1 else icon_path
+    n = int(argv[2]) if len(argv) > 2 else 36
+    rgb = np.array(Image.open(src).convert('RGB'))
+    hues = np.arange(n) * 360. / n
+    methods = [
+        ('colour-science (float64)', colour_science),
+        ('hsv kernel (float32)', k.set_hue_hsv),
+        ('hsv kernel (uint8 LUT)', k.set_hue_hsv_lut),
+        ('lch kernel (float32)', k.set_hue_lch),
+    ]
+
+    print('%s, %i x %i pixels, %i hues' % (src, rgb.shape[1], rgb.shape[0], n))
+    print('%-26s %12s %10s %14s' % ('method', 'ms per hue', 'speed-up',
+                                     'max diff'))
+
+    base, reference = None, None
+
+    for name, func in methods:
+
+        try:
+
+            t, result = timed(func, rgb, hues)
+
+        except ImportError:
+
+            print('%-26s %12s' % (name, 'not installed'))
+            continue
+
+        if base is None:
+
+            base, reference = t, result
+
+        if 'lch' in name or reference is None:
+
+            diff = '-'
+
+        else:
+
+            diff = '%i' % np.abs(result.astype(int) - reference).max()
+
+        print('%-26s %12.2f %9.1fx %14s' % (name, 1000 * t / n, base / t,
+                                             diff))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark `constrained_shuffle` against rejection sampling (reshuffling a
+control list until no run is too long) on designs of increasing length.
+
+Usage:
+    python -m loocius.bench.control [max run] [time limit per design (s)]
+
+"""
+from itertools import groupby
+from random import Random
+from sys import argv
+from time import perf_counter
+from loocius.tools.control import constrained_shuffle, make_control_list
+
+
+def longest_run(keys):
+    """Length of the longest run of equal keys.
+
+    """
+    return max(len(list(g)) for _, g in groupby(keys))
+
+
+def rejection(items, max_run, key, seed=None, limit=10.):
+    """The old way: shuffle until the order happens to be valid. Gives up
+    after `limit` seconds and returns `None`.
+
+    """
+    rng = Random(seed)
+    items = list(items)
+    t0 = perf_counter()
+
+    while perf_counter() - t0 < limit:
+
+        rng.shuffle(items)
+
+        if longest_run(key(x) for x in items) <= max_run:
+
+            return items
+
+
+def main():
+
+    max_run = int(argv[1]) if len(argv) > 1 else 3
+    limit = float(argv[2]) if len(argv) > 2 else 10.
+    key = lambda t: t['direction']
+
+    print('max_run=%i, two directions x five coherences' % max_run)
+    print('%8s %16s %16s' % ('trials', 'rejection (s)', 'constrained (s)'))
+
+    for reps in (2, 5, 10, 50, 500, 5000):
+
+        items = make_control_list(reps, False, direction=[0, 180],
+                                  coherence=[.05, .1, .2, .4, .8])
+        t0 = perf_counter()
+        result = rejection(items, max_run, key, seed=0, limit=limit)
+        t1 = perf_counter()
+        rejected = '%.3f' % (t1 - t0) if result else '> %g' % limit
+        result = constrained_shuffle(items, max_run, key, seed=0)
+        t2 = perf_counter()
+        assert longest_run(key(x) for x in result) <= max_run
+
+        print('%8i %16s %16.3f' % (len(items), rejected, t2 - t1))
+
+
+if __name__ == '__main__':
+
+    main()
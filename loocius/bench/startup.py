@@ -0,0 +1,85 @@
+"""Benchmark start-up: how long it takes to import the launcher, and how long
+it takes to reject a bad experiment name, using `python -X importtime`.
+
+Usage:
+    python -m loocius.bench.startup [number of slowest imports to list]
+
+"""
+from subprocess import run
+from sys import argv, executable
+from time import perf_counter
+
+
+def import_times(statement):
+    """Run `statement` in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        list: `(module, self, cumulative)` tuples, times in ms, in the order in
+            which the imports finished.
+
+    """
+    p = run([executable, '-X', 'importtime', '-c', statement],
+            capture_output=True, text=True)
+    rows = []
+
+    for line in p.stderr.splitlines():
+
+        if not line.startswith('import time:') or 'self [us]' in line:
+
+            continue
+
+        own, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((module.strip(), int(own) / 1000, int(cumulative) / 1000))
+
+    return rows
+
+
+def wall_time(args, reps=5):
+    """Best wall-clock time (s) of `reps` runs of `python args`.
+
+    """
+    best = float('inf')
+
+    for _ in range(reps):
+
+        t0 = perf_counter()
+        run([executable] + args, capture_output=True)
+        best = min(best, perf_counter() - t0)
+
+    return best
+
+
+def main():
+
+    top = int(argv[1]) if len(argv) > 1 else 10
+    statements = [
+        ('launcher', 'import loocius.run'),
+        ('registry', 'from loocius.tools.paths import get_registry; '
+                     'get_registry()'),
+        ('qt tools', 'import loocius.tools.qt'),
+    ]
+
+    print('%-10s %12s %8s %6s' % ('import', 'total (ms)', 'modules', 'Qt?'))
+
+    for name, statement in statements:
+
+        rows = import_times(statement)
+        total = sum(r[1] for r in rows)
+        qt = any(r[0].startswith('PyQt5') for r in rows)
+        print('%-10s %12.1f %8i %6s' % (name, total, len(rows),
+                                         'yes' if qt else 'no'))
+
+    print('\nslowest imports of the launcher (cumulative ms):')
+
+    for module, _, cumulative in sorted(import_times(statements[0][1]),
+                                        key=lambda r: -r[2])[:top]:
+
+        print('%10.1f  %s' % (cumulative, module))
+
+    t = wall_time(['-m', 'loocius.run', '-e', 'no-such-experiment'])
+    print('\nrejecting a bad experiment name: %.0f ms' % (1000 * t))
+
+
+if __name__ == '__main__':
+
+    main()
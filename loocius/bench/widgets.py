@@ -0,0 +1,219 @@
+"""Benchmark an experiment without a display or a participant.
+
+The experiment runs in a real `MainWindow` on Qt's offscreen platform, so it
+works on a headless Linux machine. A scripted participant clicks through every
+message and presses one of the response keys a fixed time after each trial
+starts. Every call of the experiment's main methods is timed, and the latency
+distribution of each phase is printed at the end. Calls are timed by
+`loocius.tools.profiling`, as with the `--profile` option:
+
+    setup      `ExpWidget.__init__`, including the experiment's `setup`
+    message    `display_message`
+    block      `block`, if the experiment has blocks
+    trial      `trial`
+    prepare    `prepare`, i.e., stimulus generation ahead of a trial
+    frame      `frame`, i.e., drawing an animation frame, if any
+    response   `keyPressEvent`, i.e., scoring and saving a response
+    save       `save`
+    paint      repainting the window after any of the above
+
+Sessions are saved to a temporary directory, never to the data directory.
+
+Usage:
+    python -m loocius.bench.widgets [experiment] [trials] [keys ...]
+
+"""
+import os
+import tempfile
+import numpy as np
+from sys import argv
+from time import perf_counter, perf_counter_ns
+from loocius.tools import profiling
+from loocius.tools.argparser import get_parser
+
+
+# run without a display, unless told otherwise; this must happen before Qt is
+# imported
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication
+from loocius.tools.qt import MainWindow
+
+
+_phases = {
+    '__init__': 'setup', 'display_message': 'message', 'block': 'block',
+    'trial': 'trial', 'prepare': 'prepare', 'frame': 'frame',
+    'keyPressEvent': 'response', 'save': 'save', 'paint': 'paint',
+}
+
+
+class Recorder(profiling.Tracer):
+
+    def __init__(self):
+        """A `Tracer` that also collects the duration (in ms) of every call of
+        every phase, as the spans are recorded.
+
+        """
+        super(Recorder, self).__init__()
+        self.times = {}
+        self.last = {}
+        self.calls = 0
+
+    def record(self, name, t0, t1=None):
+
+        t1 = perf_counter_ns() if t1 is None else t1
+        super(Recorder, self).record(name, t0, t1)
+
+        # spans of experiment methods are named `experiment.method`
+
+        phase = _phases.get(name.rpartition('.')[2])
+
+        if phase is not None:
+
+            self.times.setdefault(phase, []).append((t1 - t0) / 1e6)
+            self.last[phase] = t1
+            self.calls += 1
+
+    def count(self, phase):
+
+        return len(self.times.get(phase, ()))
+
+    def report(self):
+
+        print('%-10s %6s %9s %9s %9s %9s' % ('phase', 'calls', 'mean',
+                                              'median', 'p95', 'max'))
+
+        for phase in list(_phases.values()):
+
+            if phase not in self.times:
+
+                continue
+
+            t = np.array(self.times[phase])
+            print('%-10s %6i %9.3f %9.3f %9.3f %9.3f' % (
+                phase, len(t), t.mean(), np.median(t), np.percentile(t, 95),
+                t.max()
+            ))
+
+        print('(times in ms)')
+
+
+class BenchWindow(MainWindow):
+
+    def __init__(self, args):
+        """A `MainWindow` that doesn't close, or ask for confirmation, when the
+        last experiment is over. Its experiment widgets are profiled, like
+        those of any `MainWindow` while profiling is enabled.
+
+        """
+        self.finished = False
+        super(BenchWindow, self).__init__(args)
+
+    def set_central_widget(self):
+
+        if self.exp_names:
+
+            super(BenchWindow, self).set_central_widget()
+
+        else:
+
+            self.finished = True
+
+    def closeEvent(self, event):
+
+        event.accept()
+
+
+def run(exp_name, trials=100, keys=('Left', 'Right'), rt=.05, iti=0.,
+        timeout=600):
+    """Run an experiment with a scripted participant.
+
+    Args:
+        exp_name (str): Name of the experiment.
+        trials (:obj:`int`, optional): Stop after this many trials. Defaults
+            to 100.
+        keys (:obj:`tuple`, optional): Names of the response keys (members of
+            `Qt.Key_*`), pressed in turn. Defaults to `('Left', 'Right')`.
+        rt (:obj:`float`, optional): Response time in seconds. Defaults to
+            0.05.
+        iti (:obj:`float`, optional): Inter-trial interval in seconds, to
+            replace the experiment's own. Defaults to 0.
+        timeout (:obj:`float`, optional): Give up after this many seconds.
+
+    Returns:
+        Recorder: The timings.
+
+    """
+    app = QApplication.instance() or QApplication([])
+    recorder = profiling.enable(tracer=Recorder())
+    args = get_parser().parse_args(['-s', 'BENCH', '-e', exp_name,
+                                    '--data_dir', tempfile.mkdtemp()])
+    key_codes = [getattr(Qt, 'Key_' + k) for k in keys]
+    t0 = perf_counter()
+    window = BenchWindow(args)
+    widget = window.centralWidget()
+    widget.iti = iti
+    pressed = 0
+    calls = 0
+
+    while not window.finished and recorder.count('trial') < trials and \
+            perf_counter() - t0 < timeout:
+
+        app.processEvents()
+
+        if window.centralWidget() is not widget:
+
+            widget = window.centralWidget()
+            widget.iti = iti
+
+        if widget.cont_button.isVisible():
+
+            widget.cont_button.click()
+
+        elif recorder.count('trial') > pressed and \
+                perf_counter_ns() - recorder.last['trial'] > rt * 1e9:
+
+            # respond once to each trial
+
+            key = key_codes[pressed % len(key_codes)]
+            pressed += 1
+            QApplication.sendEvent(widget, QKeyEvent(QEvent.KeyPress, key,
+                                                     Qt.NoModifier))
+
+        # repaint whenever the experiment has done something
+
+        if recorder.calls > calls:
+
+            with profiling.span('paint'):
+
+                window.repaint()
+
+            calls = recorder.calls
+
+    widget.data_obj.close()
+    window.close()
+    profiling.disable()
+
+    return recorder
+
+
+def main():
+
+    exp_name = argv[1] if len(argv) > 1 else 'rdm'
+    trials = int(argv[2]) if len(argv) > 2 else 100
+    keys = tuple(argv[3:]) if len(argv) > 3 else ('Left', 'Right')
+    t0 = perf_counter()
+    recorder = run(exp_name, trials, keys)
+
+    print('%s, %i trials in %.1f s, offscreen' % (
+        exp_name, recorder.count('trial'), perf_counter() - t0
+    ))
+    recorder.report()
+
+
+if __name__ == '__main__':
+
+    main()
@@ -20,9 +20,14 @@ experiments should use this script as a template.
 # loocius.stimuli and place them there. That way, they can be used by other
 # experiments in the future.
 
+from random import choice
 from loocius.tools.control import make_control_list
+from loocius.tools.dots import DotField
 from loocius.tools.instructions import read_instructions
 from loocius.tools.qt import ExpWidget
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QLabel
 
 
 class Experiment(ExpWidget):
@@ -31,6 +36,19 @@ class Experiment(ExpWidget):
     important thing in an experiment script.
 
     """
+    # the response keys and the direction of motion each one stands for
+
+    response_keys = {Qt.Key_Left: 180, Qt.Key_Right: 0}
+
+    # the fields saved for each trial and their types; declaring them is
+    # optional, but lets loocius store each trial as a small binary record
+    # instead of a dictionary (see loocius.tools.results.RecordTable)
+
+    trial_schema = {
+        'coherence': 'float32', 'ratio': ('int8', 2), 'block': 'int16',
+        'direction': 'int16', 'onset_ns': 'int64', 'response_ns': 'int64',
+        'rt': 'float32', 'rsp': 'int16', 'correct': 'bool', 'score': 'int32',
+    }
 
     def gen_control(self):
         """Generate a control list.
@@ -71,9 +89,50 @@ class Experiment(ExpWidget):
         initial instructions, etc.
 
         """
+        # experiment-specific settings; blocks last a fixed number of seconds,
+        # and the dots are redrawn at a fixed frame rate
+
+        self.block_dur = 99
+        self.frame_rate = 60
+        self.iti = 0.5
+        self.score = 0
+        self.block_details = None
+
+        # the dot field does all the heavy lifting; see loocius.tools.dots
+
+        self.field = DotField(1000, self.w, self.h)
+
+        # the dots are drawn into a label that fills the window, with the
+        # countdown timer and the scoreboard on top
+
+        self.display = QLabel(self)
+        self.display.resize(self.w, self.h)
+        self.display.hide()
+        self.clock_label = QLabel(self)
+        self.clock_label.setStyleSheet('color: white; font-size: 24px;')
+        self.clock_label.move(16, 8)
+        self.clock_label.hide()
+        self.score_label = QLabel(self)
+        self.score_label.setStyleSheet('color: white; font-size: 24px;')
+        self.score_label.move(self.w - 160, 8)
+        self.score_label.hide()
+
+        # a precise timer drives the animation, and two stopwatches time the
+        # blocks and the responses; both come from the widget's clock, so the
+        # experiment can also run in simulated time
+
+        self.frame_timer = self.clock.timer(self)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.frame)
+        self.block_time = self.clock.stopwatch()
+        self.trial_time = self.clock.stopwatch()
+
+        # the widget must have keyboard focus to receive key presses
+
+        self.setFocusPolicy(Qt.StrongFocus)
 
         intro_message = self.instructions_dic['intro']
-        _rmv = self.display_message(intro_message, self.block)
+        self.display_message(intro_message, self.block)
 
     def block(self):
         """Method for setting up a new block of trials.
@@ -83,122 +142,146 @@ class Experiment(ExpWidget):
         delineated. Hence there is no corresponding method in the base class.
 
         For this experiment, each new block starts with popping an item from
-        the control sequence.
+        the control sequence. Once the control sequence is empty, the
+        experiment is over.
 
         """
+        if not self.data_obj.control:
+
+            self.data_obj.exp_done = True
+            self.save()
+            self.parent().set_central_widget()
+
+            return
+
         trial_details = self.data_obj.control.pop(0)
         coherence, ratio = trial_details.values()
         difficulty = {.5: 'Easy', .25: 'Hard'}[coherence]
         penalty, reward = ratio
-        block_num = len(self.data_obj.results) + 1
+        results = self.data_obj.results
+        block_num = results[-1]['block'] + 1 if len(results) else 1
+        self.block_details = dict(trial_details, block=block_num)
+        self.score = 0
         message = self.instructions_dic['block']
         message = message.format(
             block_num=block_num, difficulty=difficulty, reward=reward,
             penalty=penalty
         )
-        self.display_message(message, self.trial)
+        self.display_message(message, self.start_block)
 
-    def trial(self):
-        """Initiate a new trial, saving the results of the previous trial (if
-        applicable).
+    def start_block(self):
+        """Start the block timer and the first trial of the block.
 
         """
         self.hide_message()
+        self.display.show()
+        self.clock_label.show()
+        self.score_label.setText('Score: %i' % self.score)
+        self.score_label.show()
+        self.setFocus()
+        self.block_time.start()
+        self.trial()
+
+    def trial(self):
+        """Initiate a new trial. The dots keep moving until the participant
+        responds (see `keyPressEvent`).
+
+        """
+        details = dict(self.block_details)
+        details['direction'] = choice([0, 180])
+        self.current_trial_details = details
+
+        self.field.coherence = details['coherence']
+        self.field.direction = details['direction']
+
+        # draw the first frame straight away; the response time is measured
+        # from the moment it has been painted
+
+        self.frame()
+
+        if not self.headless:
+
+            self.display.repaint()
+
+        self.input.mark_onset()
+        self.frame_timer.start(1000 // self.frame_rate)
+        self.trial_time.start()
+
+    def frame(self):
+        """Draw the next frame of the kinematogram and update the countdown
+        timer.
+
+        """
+        self.field.step(1. / self.frame_rate)
+
+        # without a display (e.g., for a simulated participant), the dots
+        # still move, but are not drawn
+
+        if not self.headless:
+
+            self.display.setPixmap(QPixmap.fromImage(self.field.render()))
+
+        remaining = self.block_dur - self.block_time.elapsed() // 1000
+        self.clock_label.setText('%i' % max(remaining, 0))
+        self.clock_label.adjustSize()
+
+    def signal(self, details):
+        """Evidence for rightward motion, for simulated participants.
+
+        """
+        sign = 1 if details['direction'] == 0 else -1
+
+        return sign * details['coherence']
+
+    def keyPressEvent(self, event):
+        """Record a response, then start the next trial or, if time is up, the
+        next block.
+
+        """
+        # a key held down from the last trial repeats; only a fresh press is
+        # a response
+
+        if event.isAutoRepeat():
+
+            return
+
+        keys = self.response_keys
+
+        if not self.frame_timer.isActive() or event.key() not in keys:
+
+            return super(Experiment, self).keyPressEvent(event)
+
+        self.frame_timer.stop()
+        self.display.clear()
+
+        # the response time comes from the time the key press was captured,
+        # not from when this handler got to run; see InputCapture
+
+        details = self.current_trial_details
+
+        if self.input.attach(details, keys) is None:
+
+            details['rt'] = self.trial_time.elapsed()
+
+        # score the response and save the trial
+
+        rsp = keys[event.key()]
+        correct = rsp == details['direction']
+        penalty, reward = details['ratio']
+        self.score += reward if correct else -penalty
+        self.score_label.setText('Score: %i' % self.score)
+        self.score_label.adjustSize()
+        details.update(rsp=rsp, correct=correct, score=self.score)
+        self.data_obj.results.append(details)
+        self.save()
+
+        if self.block_time.elapsed() < self.block_dur * 1000:
 
+            self.clock.single_shot(int(self.iti * 1000), self.trial)
 
-        # if self.current_trial_details is not None:
-        #
-        #     # called after the first trial, so save results
-        #
-        #     rt = self.trial_time.elapsed()
-        #     rsp = self.dial.value()
-        #     hue = self.current_trial_details['hue']
-        #     err = (rsp - hue, rsp + 360 - hue)[
-        #         (abs(rsp - hue), abs(rsp + 360 - hue)).index(
-        #             min(abs(rsp - hue), abs(rsp + 360 - hue)))]
-        #     accept = all([err < 40, 300 < rt < 5000])
-        #     self.current_trial_details['rt'] = rt
-        #     self.current_trial_details['rsp'] = rsp
-        #     self.current_trial_details['err'] = err
-        #     self.current_trial_details['accept'] = accept
-        #     self.data_obj.results.append(self.current_trial_details)
-        #
-        #     # if not acceptable trial, add back to control sequence
-        #
-        #     self.data_obj.control.append(self.current_trial_details)
-        #     shuffle(self.data_obj.control)
-        #
-        # # begin next trial
-        #
-        # self.current_trial_details = self.data_obj.control.pop(0)
-        # stim = self.current_trial_details['stim']
-        # dur = self.current_trial_details['dur']
-        #
-        # if self.current_trial_details['mode'] == 'random':
-        #
-        #     # random hue
-        #
-        #     hue = randint(0, 360)
-        #
-        # else:
-        #
-        #     # hue selected adaptively
-        #
-        #     chain = self.current_trial_details['chain']
-        #     results = [
-        #         t for t in self.data_obj.results if t['mode'] == 'telephone'
-        #             and t['stim'] == stim and t['chain'] == chain
-        #     ]
-        #
-        #     if len(results) > 0:
-        #
-        #         hue = results[-1]['hue']
-        #
-        #     else:
-        #
-        #         # no previous trial in this chain
-        #
-        #         hue = randint(0, 360)
-        #
-        # self.current_trial_details['hue'] = hue
-        #
-        # # load sample image
-        #
-        # src = pj(self.vis_stim_path, stim)
-        # ix = (stim, hue)
-        #
-        # if ix in self.pixmaps.keys():
-        #
-        #     sample_pixmap = self.pixmaps[ix]
-        #
-        # else:
-        #
-        #     sample_pixmap = colourise_hsv(src, hue)
-        #     self.pixmaps[(stim, hue)] = sample_pixmap
-        #
-        # # load masks
-        #
-        # left_mask_1 = square_mask(256, 32)
-        # left_mask_2 = square_mask(256, 32)
-        # right_mask = square_mask(256, 32)
-        #
-        # # reset the dial
-        #
-        # # reset the right side
-        #
-        # self.right.setPixmap(right_mask)
-        #
-        # # reset the left side
-        #
-        # self.left.setPixmap(left_mask_1)
-        #
-        # # show the sample image
-        #
-        # def flash_sample():
-        #
-        #     self.left.setPixmap(sample_pixmap)
-        #     QTimer.singleShot(dur * 1000,
-        #                       lambda: self.left.setPixmap(left_mask_2))
-        #
-        # QTimer.singleShot(self.iti * 1000, flash_sample)
+        else:
 
+            self.display.hide()
+            self.clock_label.hide()
+            self.score_label.hide()
+            self.block()
@@ -1,18 +1,62 @@
 """Run the programme.
 
+Command-line arguments and batch files are checked before Qt or any
+experiment is imported, so mistakes are reported straight away. Each
+experiment is only imported when its turn comes.
+
 """
+import logging
+from os.path import exists
 from sys import argv, exit
-from loocius.tools.qt import MainWindow
-from loocius.tools.paths import icon_path
-from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QApplication
+from loocius.tools.argparser import get_parser
+from loocius.tools.paths import find_experiments, icon_path
+
+
+def simulate(args):
+    """Run simulated participants and print a line for each.
+
+    """
+    from loocius.tools.simulate import simulate
+
+    for s in simulate(args.exp_names, args.simulate, args.model,
+                      processes=args.processes, max_trials=args.max_trials,
+                      data_dir=args.data_dir):
+
+        print('%(subj_id)s: %(trials)i trials, %(minutes).1f min simulated in '
+              '%(seconds).1f s' % s)
 
 
 def main():
 
+    parser = get_parser()
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+
+    try:
+
+        find_experiments(args.exp_names)
+
+    except (AssertionError, OSError) as e:
+
+        parser.error(str(e))
+
+    if args.bundle and not exists(args.bundle):
+
+        parser.error('no instruction bundle at %s' % args.bundle)
+
+    if args.simulate:
+
+        simulate(args)
+
+        return
+
+    from loocius.tools.qt import MainWindow
+    from PyQt5.QtGui import QIcon
+    from PyQt5.QtWidgets import QApplication
+
     app = QApplication(argv)
     app.setWindowIcon(QIcon(icon_path))
-    _ = MainWindow()
+    _ = MainWindow(args)
     exit(app.exec_())
 
 
@@ -11,19 +11,24 @@ their behavior to maximize the reward.
 import argparse
 import loocius
 import os
-import pickle
 import sys
 import pandas as pd
 import numpy as np
 from colour.models.rgb.deprecated import RGB_to_HSV, HSV_to_RGB
-from datetime import datetime
-from getpass import getuser
+from concurrent.futures import ThreadPoolExecutor
 from itertools import product
 from random import shuffle, randint
 from pkgutil import iter_modules
 from tqdm import tqdm
+from loocius.tools.atlas import get_atlas
+from loocius.tools.clock import MonotonicClock
+from loocius.tools.control import requeue
+from loocius.tools.data import Data
+from loocius.tools.qt import ExpWidget as LoociusExpWidget, \
+    PresentationScheduler
+from loocius.tools.visual import get_mask_pool
 from PIL import Image, ImageQt
-from PyQt5.QtCore import pyqtSignal, QTime, QTimer, QObject
+from PyQt5.QtCore import pyqtSignal, QObject
 from PyQt5.QtGui import QImage, QPixmap, QFont
 from PyQt5.QtWidgets import QApplication, QPushButton, QDial, QLabel, QMainWindow, QStatusBar, QWidget
 
@@ -193,79 +198,6 @@ def colourise_hsv(src, hue):
     return QPixmap.fromImage(QImage(ImageQt.ImageQt(new)))  # convert for Qt
 
 
-class Data:
-
-    def __init__(self, subj_id, exp_name, proj_id=None):
-        """Returns an instance of the `Data` object.
-
-        `Data` objects contain all the necessary details to run a given subject
-        in a given experiment and save the data. It allows any experiment to be
-        resumed if prematurely aborted and prevents a subject for completing
-        the same experiment twice.
-
-        Args:
-            subj_id (str): Subject's ID.
-            exp_name (str): Name of the experiment.
-            proj_id (:obj:`str`, optional): Project the data belongs to.
-                Defaults to `None`.
-
-        Returns:
-            Data: The Data object.
-
-        """
-        # set subject ID and experiment name
-
-        self.subj_id = subj_id
-        self.exp_name = exp_name
-
-        # set defaults
-
-        self.timestamp = datetime.now()
-        self.proj_id = proj_id
-        self.user_id = getuser()
-        self.exp_done = False
-        self.control = None
-        self.results = []
-        self.relpath = '%s_%s.dic' % (self.subj_id, self.exp_name)
-        self.abspath = os.path.join(data_path, self.relpath)
-
-        # make the dictionary that gets pickled when .save() is called
-
-        self.dic = locals()
-
-        # load pre-existing data, if any exist
-
-        self.load()
-
-    def load(self):
-        """Load pre-existing data if any exist.
-
-        """
-
-        if os.path.exists(self.abspath):
-
-            self.dic = pickle.load(open(self.abspath))
-
-            # sanity checks
-
-            assert self.subj_id == self.dic['subj_id'], 'wrong subject id'
-
-            assert self.exp_name == self.dic['exp_name'], 'wrong experiment'
-
-            # load important details into the namespace of this instance
-
-            self.exp_done = self.dic['exp_done']
-            self.control = self.dic['control']
-            self.results = self.dic['results']
-
-    def save(self):
-        """Save the data.
-
-        """
-
-        pickle.dump(self.dic, open(self.abspath, 'w'))
-
-
 class MainWindow(QMainWindow):
 
     def __init__(self):
@@ -332,14 +264,22 @@ class ExpWidget(QWidget):
         e_ = self.parent().exp_name
         self.data_obj = Data(s_, e_)
 
+        # trials are put back at positions drawn from a seed tied to the
+        # session, so a resumed session puts them back in the same places
+
+        self.seed = self.data_obj.relpath
+
         # set default values
 
         self.vis_stim_path = os.path.join(vis_stim_path, e_)
         self.window_size = (768, 521)
         self.iti = 2
         self.current_trial_details = None
-        self.exp_time = QTime()
-        self.trial_time = QTime()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = None
+        self.clock = MonotonicClock()
+        self.exp_time = self.clock.stopwatch()
+        self.trial_time = self.clock.stopwatch()
 
         # generate a control sequence if not found in data object
 
@@ -390,6 +330,13 @@ class ExpWidget(QWidget):
 
         pass
 
+    # stimuli are prepared ahead of each trial as in loocius' own ExpWidget
+
+    prepare = LoociusExpWidget.prepare
+    prefetch_key = LoociusExpWidget.prefetch_key
+    prefetch = LoociusExpWidget.prefetch
+    take_prepared = LoociusExpWidget.take_prepared
+
     def save(self):
 
         self.data_obj.save()
@@ -421,23 +368,54 @@ class ColourPriors(ExpWidget):
         """
         hue = self.sender().value()
         stim = self.current_trial_details['stim']
-        ix = (stim, hue)
-        if ix in self.pixmaps.keys():
+        pixmap = self.atlases[stim].pixmap(hue)
+        self.right.setPixmap(pixmap)
+        self.right.show()
 
-            pixmap = self.pixmaps[ix]
+    def prefetch_key(self, details):
+        """The hue of a telephone trial is the last hue of its chain.
 
-        else:
+        """
 
-            src = os.path.join(self.vis_stim_path, stim)
-            pixmap = colourise_hsv(src, hue)
-            self.pixmaps[(stim, hue)] = pixmap
+        if details['mode'] == 'telephone':
 
-        self.right.setPixmap(pixmap)
-        self.right.show()
+            last = self.data_obj.latest(mode='telephone', stim=details['stim'],
+                                        chain=details['chain'])
+
+            if last is not None:
+
+                return last['hue']
+
+        return None
+
+    def prepare(self, details, key):
+        """Choose the hue and make the sample and its mask as QImages.
+
+        """
+
+        # random hue, or the hue of the chain; the first trial in a chain has
+        # no hue yet
+
+        hue = randint(0, 360) if key is None else key
+
+        # the sample comes from the stimulus' atlas, which also serves the
+        # dial during the response
+
+        sample = self.atlases[details['stim']].qimage(hue)
+
+        return {'hue': hue, 'sample': sample,
+                'mask': get_mask_pool(256, 32).image()}
 
     def setup(self):
 
-        self.pixmaps = {}
+        self.presenter = PresentationScheduler(self)
+
+        # build or load the atlas of every stimulus now, rather than while the
+        # participant is turning the dial
+
+        stimuli = {d['stim'] for d in self.data_obj.control or ()}
+        self.atlases = {s: get_atlas(os.path.join(self.vis_stim_path, s))
+                        for s in stimuli}
 
         # draw the colour wheel
 
@@ -470,9 +448,9 @@ class ColourPriors(ExpWidget):
         self.button = QPushButton('Continue', self)
         self.button.setFont(QFont('', 24))
         self.button.resize(256, self.button.sizeHint().height())
-        self.button.move(384 - (self.button.size().width() / 2),
+        self.button.move(384 - (self.button.size().width() // 2),
                          256 - self.button.size().height())
-        self.button.clicked.connect(self.trial)
+        self.button.clicked.connect(self.respond)
 
         # now all elements are place, resize window
 
@@ -481,11 +459,11 @@ class ColourPriors(ExpWidget):
 
         # begin trials
 
-        self.trial()
+        self.respond()
 
-    def trial(self):
-        """Initiate a new trial, saving the results of the previous trial (if
-        applicable).
+    def respond(self):
+        """Save the results of the previous trial (if applicable), then start
+        preparing the next one during the inter-trial interval.
 
         """
 
@@ -504,86 +482,53 @@ class ColourPriors(ExpWidget):
             self.current_trial_details['rsp'] = rsp
             self.current_trial_details['err'] = err
             self.current_trial_details['accept'] = accept
+            self.current_trial_details['onsets'] = self.presenter.log
             self.data_obj.results.append(self.current_trial_details)
 
             # if not acceptable trial, add back to control sequence
 
-            self.data_obj.control.append(self.current_trial_details)
-            shuffle(self.data_obj.control)
-
-        # begin next trial
-
-        self.current_trial_details = self.data_obj.control.pop(0)
-        stim = self.current_trial_details['stim']
-        dur = self.current_trial_details['dur']
-
-        if self.current_trial_details['mode'] == 'random':
+            if not accept:
 
-            # random hue
-        
-            hue = randint(0, 360)
+                requeue(self.data_obj.control, self.current_trial_details,
+                        seed=self.seed)
 
-        else:
-
-            # hue selected adaptively
-
-            chain = self.current_trial_details['chain']
-            results = [
-                t for t in self.data_obj.results if t['mode'] == 'telephone' 
-                    and t['stim'] == stim and t['chain'] == chain
-            ]
-            
-            if len(results) > 0:
-                
-                hue = results[-1]['hue']
-            
-            else:
-                
-                # no previous trial in this chain
-
-                hue = randint(0, 360)
-
-        self.current_trial_details['hue'] = hue
-        
-        # load sample image
-
-        src = os.path.join(self.vis_stim_path, stim)
-        ix = (stim, hue)
-
-        if ix in self.pixmaps.keys():
-
-            sample_pixmap = self.pixmaps[ix]
-
-        else:
+        # the response is in, so the next trial can be prepared while the
+        # masks are shown
 
-            sample_pixmap = colourise_hsv(src, hue)
-            self.pixmaps[(stim, hue)] = sample_pixmap
-
-        # load masks
-
-        left_mask_1 = square_mask(256, 32)
-        left_mask_2 = square_mask(256, 32)
-        right_mask = square_mask(256, 32)
-
-        # reset the dial
-
-        # reset the right side
+        self.prefetch()
+        self.presenter.run(
+            [('iti', self.reset, self.presenter.frames(self.iti))],
+            on_done=self.trial
+        )
 
-        self.right.setPixmap(right_mask)
+    def reset(self):
+        """Put masks on both sides.
 
-        # reset the left side
+        """
+        masks = get_mask_pool(256, 32)
+        self.left.setPixmap(masks.pixmap())
+        self.right.setPixmap(masks.pixmap())
 
-        self.left.setPixmap(left_mask_1)
+    def trial(self):
+        """Initiate a new trial.
 
-        # show the sample image
+        """
 
-        def flash_sample():
+        self.current_trial_details = self.data_obj.control.pop(0)
+        prepared = self.take_prepared(self.current_trial_details)
+        self.current_trial_details['hue'] = prepared['hue']
+        dur = self.current_trial_details['dur']
+        sample_pixmap = QPixmap.fromImage(prepared['sample'])
+        mask_pixmap = QPixmap.fromImage(prepared['mask'])
 
-            self.left.setPixmap(sample_pixmap)
-            QTimer.singleShot(dur * 1000,
-                              lambda: self.left.setPixmap(left_mask_2))
+        # show the sample image, then mask it
 
-        QTimer.singleShot(self.iti * 1000, flash_sample)
+        timeline = [
+            ('sample', lambda: self.left.setPixmap(sample_pixmap),
+             self.presenter.frames(dur)),
+            ('mask', lambda: self.left.setPixmap(mask_pixmap), 0),
+        ]
+        self.presenter.run(timeline)
 
 
 def main():
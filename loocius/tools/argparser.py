@@ -34,5 +34,51 @@ def get_parser():
              'be the default, EN. There must be a set of instructions '
              'available for the given language and experiment.'
     )
+    parser.add_argument(
+        '--bundle', default=None, metavar='PATH',
+        help='Read the instructions from this bundle file (made with python '
+             '-m loocius.tools.instructions PATH) instead of the instructions '
+             'directory.'
+    )
+    parser.add_argument(
+        '--data_dir', default=None, metavar='PATH',
+        help='Directory to save sessions in. Defaults to the data directory '
+             'inside loocius.'
+    )
+    parser.add_argument(
+        '--server', default=None, metavar='ADDRESS',
+        help='Save sessions through the session server at this address (a '
+             'Unix socket path or host:port) instead of the local data '
+             'directory; see loocius.tools.server.'
+    )
+    parser.add_argument(
+        '--station', default=None,
+        help='Name of this testing station, for the session server. Defaults '
+             'to the host name.'
+    )
+    parser.add_argument(
+        '--profile', nargs='?', const=True, default=None, metavar='PATH',
+        help='Record how long the experiments spend in each of their methods, '
+             'and write a Chrome trace file to PATH when loocius closes. '
+             'Defaults to the profiles directory in the data directory.'
+    )
+    parser.add_argument(
+        '--simulate', type=int, default=0, metavar='N',
+        help='Instead of running the experiments for a participant, run them '
+             'for N simulated participants in simulated time.'
+    )
+    parser.add_argument(
+        '--model', default='ddm', choices=('random', 'psychometric', 'ddm'),
+        help='Response model of the simulated participants.'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help='Number of processes to run simulations in. Defaults to the '
+             'number of CPUs.'
+    )
+    parser.add_argument(
+        '--max_trials', type=int, default=None,
+        help='Stop each simulated session after this many trials.'
+    )
 
     return parser
@@ -0,0 +1,159 @@
+"""Precomputed colourised versions of visual stimuli.
+
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from loocius.tools.paths import cache_path
+from loocius.tools.profiling import traced
+from os import makedirs, replace
+from os.path import exists, join as pj
+
+
+_version = 2  # bump whenever the colourisation changes, to invalidate caches
+_atlases = {}
+
+
+def _colourise_all(rgba, hues, model, chunk=30):
+    """Yield colourised copies of an RGBA image, `chunk` hues at a time.
+
+    """
+    import numpy as np
+    from loocius.tools.colourise import set_hue
+
+    for start in range(0, hues, chunk):
+
+        n = min(chunk, hues - start)
+        out = np.empty((n,) + rgba.shape, dtype='uint8')
+        degrees = np.arange(start, start + n) * 360. / hues
+        out[..., :3] = set_hue(rgba[..., :3], degrees, model)
+        out[..., 3] = rgba[..., 3]
+
+        yield start, out
+
+
+class StimulusAtlas:
+
+    def __init__(self, src, hues=360, model='hsv', pixmaps=32):
+        """Returns an instance of the `StimulusAtlas` object.
+
+        An atlas holds every hue variant of a stimulus, as produced by
+        `colourise`, in a single uint8 array of shape (hues, height,
+        width, 4). The array is computed once, cached on disk under a hash of
+        the source file, and memory-mapped afterwards, so fetching a variant
+        costs a lookup rather than a colour conversion. Building an atlas takes
+        a while, so experiments should get theirs (see `get_atlas`) before the
+        trials start, e.g., in `setup` or `preload`.
+
+        Args:
+            src (str): Path to a stimulus. Stimuli should all be PNGs.
+            hues (:obj:`int`, optional): Number of hues. Defaults to 360.
+            model (:obj:`str`, optional): Colour model, `'hsv'` or `'lch'`.
+                Defaults to `'hsv'`.
+            pixmaps (:obj:`int`, optional): Number of recently used variants
+                to keep as QPixmaps. Defaults to 32.
+
+        Returns:
+            StimulusAtlas: The atlas.
+
+        """
+        import numpy as np
+
+        self.src = src
+        self.hues = hues
+        self.model = model
+
+        with open(src, 'rb') as f:
+
+            digest = sha1(f.read())
+
+        digest.update(('%i-%i-%s' % (_version, hues, model)).encode())
+        self.path = pj(cache_path, 'atlas-%s.npy' % digest.hexdigest())
+
+        if not exists(self.path):
+
+            self._build()
+
+        self.array = np.load(self.path, mmap_mode='r')
+        self.height, self.width = self.array.shape[1:3]
+        self.pixmaps = pixmaps
+        self._pixmaps = OrderedDict()
+
+    @traced('atlas.build')
+    def _build(self):
+        """Compute all variants and write them to the cache.
+
+        """
+        import numpy as np
+        from PIL import Image
+
+        rgba = np.array(Image.open(self.src).convert('RGBA'))
+        makedirs(cache_path, exist_ok=True)
+        tmp = self.path + '.tmp'
+        out = np.lib.format.open_memmap(
+            tmp, mode='w+', dtype='uint8', shape=(self.hues,) + rgba.shape
+        )
+
+        for start, chunk in _colourise_all(rgba, self.hues, self.model):
+
+            out[start:start + len(chunk)] = chunk
+
+        out.flush()
+        del out
+        replace(tmp, self.path)
+
+    def __getitem__(self, hue):
+
+        return self.array[hue % self.hues]
+
+    def qimage(self, hue):
+        """Return a variant as a QImage.
+
+        The QImage points straight at the memory-mapped array, so it is only
+        valid while the atlas exists. Atlases returned by `get_atlas` are kept
+        for the rest of the session.
+
+        """
+        from PyQt5.QtGui import QImage
+
+        a = self[hue]
+
+        return QImage(a.data, self.width, self.height, 4 * self.width,
+                      QImage.Format_RGBA8888)
+
+    def pixmap(self, hue):
+        """Return a variant as a QPixmap. Only the most recently used
+        QPixmaps are kept; the others are converted again from the array when
+        needed.
+
+        """
+        from PyQt5.QtGui import QPixmap
+
+        hue %= self.hues
+
+        if hue in self._pixmaps:
+
+            self._pixmaps.move_to_end(hue)
+
+        else:
+
+            self._pixmaps[hue] = QPixmap.fromImage(self.qimage(hue))
+
+            if len(self._pixmaps) > self.pixmaps:
+
+                self._pixmaps.popitem(last=False)
+
+        return self._pixmaps[hue]
+
+
+def get_atlas(src, hues=360, model='hsv'):
+    """Return the atlas for stimulus `src`, loading or building it once per
+    session.
+
+    """
+    key = (src, hues, model)
+
+    if key not in _atlases:
+
+        _atlases[key] = StimulusAtlas(src, hues, model)
+
+    return _atlases[key]
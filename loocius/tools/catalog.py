@@ -0,0 +1,269 @@
+"""Index of all sessions in the data directory.
+
+"""
+import logging
+import sqlite3
+from loocius.tools.paths import data_path
+from datetime import datetime
+from os import listdir, makedirs
+from os.path import exists, getmtime, join as pj
+from threading import Lock
+
+
+_fields = ('subj_id', 'exp_name', 'proj_id', 'user_id', 'timestamp',
+           'exp_done', 'n_trials')
+_catalogs = {}
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+
+    def __init__(self, data_dir=None):
+        """Returns an instance of the `Catalog` object.
+
+        A catalog is a small SQLite database in the data directory with one row
+        per session file. `Data` objects update it whenever they write a
+        checkpoint or are closed, and `rebuild` catches up with anything saved
+        since, so questions such as "which subjects have finished rdm?" can be
+        answered without opening any session files.
+
+        The connection is shared by every thread of the process (e.g., the
+        GUI thread and the thread that preloads experiments), and a lock makes
+        sure only one of them uses it at a time.
+
+        Args:
+            data_dir (:obj:`str`, optional): Directory of the sessions. The
+                database is `catalog.sqlite` in that directory. Defaults to
+                the data directory.
+
+        Returns:
+            Catalog: The Catalog object.
+
+        """
+        self.data_dir = data_dir if data_dir else data_path
+        self.path = pj(self.data_dir, 'catalog.sqlite')
+        makedirs(self.data_dir, exist_ok=True)
+
+        self._lock = Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'relpath TEXT PRIMARY KEY, subj_id TEXT, exp_name TEXT, '
+            'proj_id TEXT, user_id TEXT, timestamp TEXT, exp_done INTEGER, '
+            'n_trials INTEGER, mtime REAL)'
+        )
+
+        for f in ('subj_id', 'exp_name', 'proj_id'):
+
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS %s_ix ON sessions (%s)' % (f, f)
+            )
+
+        self.conn.commit()
+
+    def update(self, data_obj, mtime=None, commit=True):
+        """Add or refresh the entry for a session.
+
+        Args:
+            data_obj (Data): The session. Any object with the attributes of a
+                `Data` object, or a dictionary read from a session file, will
+                do.
+            mtime (:obj:`float`, optional): Modification time of the session
+                file. Defaults to now.
+            commit (:obj:`bool`, optional): Commit straight away. Defaults to
+                `True`.
+
+        """
+        if isinstance(data_obj, dict):
+
+            d = data_obj
+
+        else:
+
+            d = {f: getattr(data_obj, f) for f in _fields[:-1]}
+            d['results'] = data_obj.results
+            d['relpath'] = data_obj.relpath
+
+        timestamp = d.get('timestamp')
+
+        if isinstance(timestamp, datetime):
+
+            timestamp = timestamp.isoformat()
+
+        row = (d['relpath'], d['subj_id'], d['exp_name'], d.get('proj_id'),
+               d.get('user_id'), timestamp, int(bool(d.get('exp_done'))),
+               len(d.get('results') or ()),
+               datetime.now().timestamp() if mtime is None else mtime)
+
+        with self._lock:
+
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sessions VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)', row
+            )
+
+            if commit:
+
+                self.conn.commit()
+
+    def remove(self, relpath):
+        """Forget a session.
+
+        """
+        with self._lock:
+
+            self.conn.execute('DELETE FROM sessions WHERE relpath = ?',
+                              (relpath,))
+            self.conn.commit()
+
+    def query(self, **criteria):
+        """Find sessions.
+
+        Kwargs:
+            Any of `subj_id`, `exp_name`, `proj_id`, `user_id` or `exp_done`.
+                A list or tuple matches any of its items.
+
+        Returns:
+            list: One dictionary per session, including `relpath`.
+
+        """
+        clauses = []
+        params = []
+
+        for f, v in criteria.items():
+
+            assert f in _fields, '%s is not a catalog field' % f
+
+            if isinstance(v, (list, tuple, set)):
+
+                clauses.append('%s IN (%s)' % (f, ', '.join('?' * len(v))))
+                params.extend(v)
+
+            elif v is None:
+
+                clauses.append('%s IS NULL' % f)
+
+            else:
+
+                clauses.append('%s = ?' % f)
+                params.append(int(v) if f == 'exp_done' else v)
+
+        sql = 'SELECT relpath, %s FROM sessions' % ', '.join(_fields)
+
+        if clauses:
+
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        keys = ('relpath',) + _fields
+
+        with self._lock:
+
+            cursor = self.conn.execute(sql + ' ORDER BY relpath', params)
+            rows = [dict(zip(keys, r)) for r in cursor]
+
+        for row in rows:
+
+            row['exp_done'] = bool(row['exp_done'])
+
+        return rows
+
+    def subjects(self, exp_name, exp_done=True):
+        """Return the IDs of all subjects who have (or have not) finished an
+        experiment.
+
+        """
+        return [r['subj_id'] for r in self.query(exp_name=exp_name,
+                                                  exp_done=exp_done)]
+
+    def changes(self):
+        """Find the session files that changed since they were last indexed,
+        and forget sessions whose files are gone.
+
+        Returns:
+            list: `(relpath, mtime)` tuples, one per changed file, where
+                `mtime` is what `update` should record once it is indexed.
+
+        """
+        from loocius.tools.data import backup_path, journal_path
+
+        with self._lock:
+
+            known = {r: m for r, m in self.conn.execute(
+                'SELECT relpath, mtime FROM sessions'
+            )}
+
+        # a session whose checkpoint was interrupted may only survive as its
+        # backup
+
+        names = listdir(self.data_dir) if exists(self.data_dir) else []
+        files = {f[:-len('.bak')] if f.endswith('.bak') else f for f in names
+                 if f.endswith('.dic') or f.endswith('.dic.bak')}
+        changed = []
+
+        for relpath in sorted(files):
+
+            abspath = pj(self.data_dir, relpath)
+            jnl = journal_path(abspath)
+            mtime = max(getmtime(abspath if exists(abspath) else
+                                 backup_path(abspath)),
+                        getmtime(jnl) if exists(jnl) else 0)
+
+            if known.get(relpath, -1) < mtime:
+
+                changed.append((relpath, mtime))
+
+        with self._lock:
+
+            self.conn.executemany('DELETE FROM sessions WHERE relpath = ?',
+                                  [(r,) for r in set(known) - set(files)])
+            self.conn.commit()
+
+        return changed
+
+    def rebuild(self):
+        """Bring the catalog in line with the data directory, reading only
+        session files that changed since they were last indexed. Files that
+        cannot be read are logged and left as they were in the catalog.
+
+        """
+        from loocius.tools.data import read_session
+
+        # the files are read without holding the lock, so that sessions can
+        # still be saved meanwhile
+
+        for relpath, mtime in self.changes():
+
+            abspath = pj(self.data_dir, relpath)
+
+            try:
+
+                dic = read_session(abspath)
+
+            except (OSError, ValueError) as e:
+
+                logger.warning('skipping session %s: %s', abspath, e)
+
+                continue
+
+            dic['relpath'] = relpath
+            self.update(dic, mtime, commit=False)
+
+        with self._lock:
+
+            self.conn.commit()
+
+
+def get_catalog(data_dir=None):
+    """Return a shared `Catalog` for the sessions in `data_dir`, opening it if
+    necessary.
+
+    """
+    data_dir = data_dir if data_dir else data_path
+
+    if data_dir not in _catalogs:
+
+        _catalogs[data_dir] = Catalog(data_dir)
+
+    return _catalogs[data_dir]
@@ -0,0 +1,421 @@
+"""Clocks and timers for experiments.
+
+Experiments time things through the clock of their `ExpWidget`
+(`self.clock`) rather than creating `QTime` and `QTimer` objects themselves:
+
+    self.trial_time = self.clock.stopwatch()  # instead of QTime()
+    self.frame_timer = self.clock.timer(self)  # instead of QTimer(self)
+    self.clock.single_shot(500, self.trial)  # instead of QTimer.singleShot
+
+The objects returned have the same methods as their Qt counterparts, so the
+rest of the experiment is unchanged. Swapping the clock then changes how time
+passes: `MonotonicClock` (the default) and `QtClock` are real time, and
+`VirtualClock` is simulated time that jumps from one scheduled event to the
+next.
+
+"""
+from heapq import heappop, heappush
+from itertools import count
+from time import perf_counter_ns
+
+
+class MonotonicStopwatch:
+
+    def __init__(self):
+        """A stand-in for `QTime` that reads the monotonic nanosecond clock.
+
+        `QTime` counts whole milliseconds from the wall clock, so it jumps when
+        the system time is adjusted. This stopwatch cannot go backwards, and
+        `elapsed_ns()` gives the full resolution of the clock.
+
+        """
+        self.t0 = None
+
+    def start(self):
+
+        self.t0 = perf_counter_ns()
+
+    def restart(self):
+
+        elapsed = self.elapsed()
+        self.start()
+
+        return elapsed
+
+    def elapsed_ns(self):
+
+        return perf_counter_ns() - self.t0
+
+    def elapsed(self):
+        """Milliseconds since `start()`, as an integer, like `QTime`.
+
+        """
+        return self.elapsed_ns() // 1000000
+
+    def isValid(self):
+
+        return self.t0 is not None
+
+
+class MonotonicClock:
+    """Real time, read from the monotonic nanosecond clock, with precise
+    (millisecond-accurate) Qt timers.
+
+    """
+
+    def now_ns(self):
+        """Current time in nanoseconds.
+
+        """
+        return perf_counter_ns()
+
+    def now(self):
+        """Current time in milliseconds.
+
+        """
+        return perf_counter_ns() / 1e6
+
+    def wait_until(self, ns):
+        """Wait actively until the time is `ns`. Use this only for the last
+        millisecond or so before an onset.
+
+        """
+        while perf_counter_ns() < ns:
+
+            pass
+
+    def stopwatch(self):
+
+        return MonotonicStopwatch()
+
+    def timer(self, parent=None):
+        """Return a `QTimer` with precise timing.
+
+        """
+        from PyQt5.QtCore import Qt, QTimer
+
+        timer = QTimer(parent)
+        timer.setTimerType(Qt.PreciseTimer)
+
+        return timer
+
+    def single_shot(self, msec, func):
+        """Call `func` once after `msec` milliseconds.
+
+        """
+        from PyQt5.QtCore import Qt, QTimer
+
+        QTimer.singleShot(msec, Qt.PreciseTimer, func)
+
+
+class QtClock(MonotonicClock):
+    """Real time, using Qt's own (coarse) timers and millisecond `QTime`.
+
+    """
+
+    def stopwatch(self):
+        """Return a stopped `QTime`.
+
+        """
+        from PyQt5.QtCore import QTime
+
+        return QTime()
+
+    def timer(self, parent=None):
+        """Return a `QTimer`.
+
+        """
+        from PyQt5.QtCore import QTimer
+
+        return QTimer(parent)
+
+    def single_shot(self, msec, func):
+        """Call `func` once after `msec` milliseconds.
+
+        """
+        from PyQt5.QtCore import QTimer
+
+        QTimer.singleShot(msec, func)
+
+
+class Signal:
+
+    def __init__(self):
+        """A minimal stand-in for a Qt signal.
+
+        """
+        self.slots = []
+
+    def connect(self, func):
+
+        self.slots.append(func)
+
+    def disconnect(self, func=None):
+
+        if func is None:
+
+            self.slots = []
+
+        else:
+
+            self.slots.remove(func)
+
+    def emit(self):
+
+        for func in list(self.slots):
+
+            func()
+
+
+class VirtualStopwatch:
+
+    def __init__(self, clock):
+        """A stand-in for `QTime` that reads a `VirtualClock`.
+
+        """
+        self.clock = clock
+        self.t0 = None
+
+    def start(self):
+
+        self.t0 = self.clock.ns
+
+    def restart(self):
+
+        elapsed = self.elapsed()
+        self.start()
+
+        return elapsed
+
+    def elapsed_ns(self):
+
+        return self.clock.ns - self.t0
+
+    def elapsed(self):
+        """Milliseconds since `start()`, as an integer, like `QTime`.
+
+        """
+        return self.elapsed_ns() // 1000000
+
+    def isValid(self):
+
+        return self.t0 is not None
+
+
+class VirtualTimer:
+
+    def __init__(self, clock, parent=None):
+        """A stand-in for `QTimer` that is driven by a `VirtualClock`.
+
+        """
+        self.clock = clock
+        self.parent = parent
+        self.timeout = Signal()
+        self._interval = 0
+        self._single = False
+        self._active = False
+        self._generation = 0
+
+    def setTimerType(self, timer_type):
+
+        pass
+
+    def setSingleShot(self, single):
+
+        self._single = single
+
+    def isSingleShot(self):
+
+        return self._single
+
+    def setInterval(self, msec):
+
+        self._interval = msec
+
+    def interval(self):
+
+        return self._interval
+
+    def isActive(self):
+
+        return self._active
+
+    def start(self, msec=None):
+
+        if msec is not None:
+
+            self._interval = msec
+
+        self._active = True
+        self._generation += 1
+        self.clock.schedule(self.clock.ns + self._interval * 1000000, self)
+
+    def stop(self):
+
+        self._active = False
+        self._generation += 1
+
+    def _fire(self, due, horizon):
+        """Called by the clock when the timer is due.
+
+        """
+        if self._single:
+
+            self._active = False
+
+        else:
+
+            self._generation += 1
+            step = max(self._interval, 1) * 1000000
+
+            # like a real timer on a busy event loop, missed timeouts are
+            # coalesced into one
+
+            if self.clock.coalesce and due + step <= horizon:
+
+                due += (horizon - due) // step * step
+                self.clock.ns = due
+
+            self.clock.schedule(due + step, self)
+
+        self.timeout.emit()
+
+
+class VirtualClock:
+
+    def __init__(self, coalesce=True):
+        """Simulated time.
+
+        Time stands still until the clock is told to move on, and then it jumps
+        straight to the next scheduled event, so nothing ever waits. A session
+        that takes an hour in real time takes only as long as the code that
+        runs in it.
+
+        Args:
+            coalesce (:obj:`bool`, optional): When the clock moves on by more
+                than the interval of a repeating timer (e.g., an animation
+                frame timer), fire the timer once at the last tick instead of
+                at every tick, as a busy event loop would. Defaults to `True`.
+
+        """
+        self.ns = 0
+        self.coalesce = coalesce
+        self._queue = []
+        self._counter = count()
+
+    def now_ns(self):
+        """Current time in nanoseconds.
+
+        """
+        return self.ns
+
+    def now(self):
+        """Current time in milliseconds.
+
+        """
+        return self.ns / 1e6
+
+    def wait_until(self, ns):
+        """Move the time on to `ns` without running anything.
+
+        """
+        self.ns = max(self.ns, ns)
+
+    def stopwatch(self):
+
+        return VirtualStopwatch(self)
+
+    def timer(self, parent=None):
+
+        return VirtualTimer(self, parent)
+
+    def single_shot(self, msec, func):
+
+        heappush(self._queue, (self.ns + int(msec * 1e6), next(self._counter),
+                               func, None))
+
+    def schedule(self, due, timer):
+        """Schedule a timer to fire at `due` nanoseconds.
+
+        """
+        heappush(self._queue, (due, next(self._counter), timer,
+                               timer._generation))
+
+    def _next(self):
+        """Drop cancelled events and return the next live one, if any.
+
+        """
+        q = self._queue
+
+        while q:
+
+            due, _, target, generation = q[0]
+
+            if generation is None or target._active and \
+                    target._generation == generation:
+
+                return q[0]
+
+            heappop(q)
+
+    def pending(self):
+        """Time (ms) of the next scheduled event, or `None`.
+
+        """
+        event = self._next()
+
+        return None if event is None else event[0] / 1e6
+
+    def step(self, until=None):
+        """Jump to the next scheduled event and run it.
+
+        Args:
+            until (:obj:`float`, optional): Don't go beyond this time (ms).
+
+        Returns:
+            bool: Whether an event was run.
+
+        """
+        horizon = None if until is None else int(until * 1e6)
+        event = self._next()
+
+        if event is None or horizon is not None and event[0] > horizon:
+
+            return False
+
+        due, _, target, generation = heappop(self._queue)
+        self.ns = max(self.ns, due)
+
+        if generation is None:
+
+            target()
+
+        else:
+
+            nxt = self._next()
+            limit = horizon if horizon is not None else due
+
+            if nxt is not None:
+
+                limit = min(limit, nxt[0])
+
+            target._fire(self.ns, limit)
+
+        return True
+
+    def run_until(self, msec):
+        """Run every event scheduled up to `msec`, then set the time to
+        `msec`.
+
+        """
+        while self.step(msec):
+
+            pass
+
+        self.ns = max(self.ns, int(msec * 1e6))
+
+    def advance(self, msec):
+        """Move on by `msec` milliseconds, running events on the way.
+
+        """
+        self.run_until(self.now() + msec)
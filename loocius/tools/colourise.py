@@ -0,0 +1,196 @@
+"""Vectorised colour conversions for colourising stimuli.
+
+All functions take uint8 RGB arrays of shape (..., 3) and return uint8 arrays.
+They are batched over hues: giving N hues for an (H, W, 3) image returns an
+(N, H, W, 3) stack, so every hue variant of a stimulus can be made at once.
+
+"""
+import numpy as np
+from loocius.tools.profiling import traced
+
+
+# sRGB (D65) to CIE XYZ, and back
+
+_rgb_to_xyz = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype='float32')
+_xyz_to_rgb = np.linalg.inv(_rgb_to_xyz).astype('float32')
+_white = np.array([0.95047, 1., 1.08883], dtype='float32')
+
+
+def hsv_weights(hues):
+    """Return the weight of each RGB channel for the given hues.
+
+    In HSV, a pixel with maximum `mx` and minimum `mn` over its channels keeps
+    both when its hue is replaced; each new channel is `mn + (mx - mn) * w`,
+    where the weight `w` depends only on the hue.
+
+    Args:
+        hues (array_like): Hues in degrees.
+
+    Returns:
+        numpy.ndarray: Weights, shape (N, 3), float32.
+
+    """
+    h = (np.asarray(hues, dtype='float32').reshape(-1) % 360) / 60
+    i = np.floor(h).astype(int)
+    f = h - i
+    one = np.ones_like(f)
+    zero = np.zeros_like(f)
+    table = np.stack([
+        np.stack([one, f, zero], -1),
+        np.stack([1 - f, one, zero], -1),
+        np.stack([zero, one, f], -1),
+        np.stack([zero, 1 - f, one], -1),
+        np.stack([f, zero, one], -1),
+        np.stack([one, zero, 1 - f], -1),
+    ])
+
+    return table[i, np.arange(len(i))]
+
+
+@traced('colourise.hsv')
+def set_hue_hsv(rgb, hues):
+    """Replace the hue of every pixel in the HSV model (float32).
+
+    Args:
+        rgb (numpy.ndarray): Image, uint8, shape (..., 3).
+        hues (array_like): Hue or hues in degrees.
+
+    Returns:
+        numpy.ndarray: Images, uint8, shape (N, ..., 3).
+
+    """
+    rgb = np.asarray(rgb)
+    mx = rgb.max(-1).astype('float32')[np.newaxis, ..., np.newaxis]
+    mn = rgb.min(-1).astype('float32')[np.newaxis, ..., np.newaxis]
+    w = hsv_weights(hues).reshape((-1,) + (1,) * (rgb.ndim - 1) + (3,))
+    out = mn + (mx - mn) * w
+
+    return (out + 1e-3).astype('uint8')
+
+
+def hsv_lut(hues):
+    """Integer look-up table for `set_hue_hsv_lut`.
+
+    Returns:
+        numpy.ndarray: Table of `floor((mx - mn) * w)` for every hue, channel
+            and value of `mx - mn`, uint8, shape (N, 3, 256).
+
+    """
+    w = hsv_weights(hues)
+    c = np.arange(256, dtype='float32')
+
+    return (c * w[..., np.newaxis] + 1e-3).astype('uint8')
+
+
+@traced('colourise.hsv_lut')
+def set_hue_hsv_lut(rgb, hues, lut=None):
+    """Like `set_hue_hsv`, but in integer arithmetic using a look-up table.
+
+    Args:
+        rgb (numpy.ndarray): Image, uint8, shape (..., 3).
+        hues (array_like): Hue or hues in degrees.
+        lut (:obj:`numpy.ndarray`, optional): Table from `hsv_lut(hues)`, if
+            already made.
+
+    Returns:
+        numpy.ndarray: Images, uint8, shape (N, ..., 3).
+
+    """
+    rgb = np.asarray(rgb)
+    lut = hsv_lut(hues) if lut is None else lut
+    mx = rgb.max(-1)
+    mn = rgb.min(-1)
+
+    # index each hue's table with the chroma of every pixel
+
+    lut = np.ascontiguousarray(lut.transpose(0, 2, 1))
+    out = np.take(lut, mx - mn, axis=1)  # (N, ..., 3)
+    out += mn[np.newaxis, ..., np.newaxis]
+
+    return out
+
+
+def rgb_to_lab(rgb):
+    """Convert sRGB (uint8) to CIELAB (float32, D65 white point).
+
+    """
+    x = np.asarray(rgb, dtype='float32') / 255
+    x = np.where(x <= 0.04045, x / 12.92, ((x + 0.055) / 1.055) ** 2.4)
+    xyz = x @ _rgb_to_xyz.T / _white
+    f = np.where(xyz > 216 / 24389., np.cbrt(xyz),
+                 (24389 / 27. * xyz + 16) / 116)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+
+    return lab
+
+
+def lab_to_rgb(lab):
+    """Convert CIELAB (D65 white point) to sRGB (uint8). Colours outside the
+    sRGB gamut are clipped.
+
+    """
+    lab = np.asarray(lab, dtype='float32')
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], -1)
+    xyz = np.where(f ** 3 > 216 / 24389., f ** 3,
+                   (116 * f - 16) / (24389 / 27.)) * _white
+    x = np.clip(xyz @ _xyz_to_rgb.T, 0, 1)
+    x = np.where(x <= 0.0031308, 12.92 * x, 1.055 * x ** (1 / 2.4) - 0.055)
+
+    return (x * 255 + 0.5).astype('uint8')
+
+
+@traced('colourise.lch')
+def set_hue_lch(rgb, hues):
+    """Replace the hue of every pixel in CIELAB/LCh, keeping lightness and
+    chroma, so that variants differ in hue but not in perceived brightness.
+
+    Args:
+        rgb (numpy.ndarray): Image, uint8, shape (..., 3).
+        hues (array_like): Hue angle or angles in degrees.
+
+    Returns:
+        numpy.ndarray: Images, uint8, shape (N, ..., 3).
+
+    """
+    lab = rgb_to_lab(rgb)
+    c = np.hypot(lab[..., 1], lab[..., 2])[np.newaxis]
+    h = np.radians(np.asarray(hues, dtype='float32')).reshape(
+        (-1,) + (1,) * (lab.ndim - 1)
+    )
+    out = np.empty(h.shape[:1] + lab.shape, dtype='float32')
+    out[..., 0] = lab[..., 0]
+    out[..., 1] = c * np.cos(h)
+    out[..., 2] = c * np.sin(h)
+
+    return lab_to_rgb(out)
+
+
+def set_hue(rgb, hues, model='hsv'):
+    """Replace the hue of an image in the given colour model.
+
+    Args:
+        rgb (numpy.ndarray): Image, uint8, shape (..., 3).
+        hues (array_like): Hue or hues in degrees.
+        model (:obj:`str`, optional): `'hsv'` or `'lch'`. Defaults to `'hsv'`.
+
+    Returns:
+        numpy.ndarray: Images, uint8, shape (N, ..., 3).
+
+    """
+    if model == 'hsv':
+
+        return set_hue_hsv_lut(rgb, hues)
+
+    elif model == 'lch':
+
+        return set_hue_lch(rgb, hues)
+
+    raise ValueError('unknown colour model: %s' % model)
@@ -1,11 +1,13 @@
 """Generic control logic for experiments.
 
 """
+from array import array
+from heapq import heappop, heappush
 from itertools import product
-from random import shuffle
+from random import Random, randrange, shuffle
 
 
-def make_control_list(reps, shuffled, **kwargs):
+def make_control_list(reps, shuffled, *, lazy=False, seed=None, **kwargs):
     """Generate a control list.
 
     A control list is a list of dictionaries where each dictionary contains
@@ -14,16 +16,29 @@ def make_control_list(reps, shuffled, **kwargs):
     Args:
         reps (int): Number of repetitions per level of each condition.
         shuffled (bool): Should blocks be shuffled?
+        lazy (:obj:`bool`, optional): Return a `ControlSequence` instead of a
+            list. Recommended for long designs. Defaults to `False`.
+        seed (:obj:`int`, optional): Seed for the shuffle of a lazy sequence.
 
     Kwargs:
         Takes any keyword arguments where the keyword is the name of the
             factor and the argument is an iterable containing all levels of the
-            factor. (e.g., `condition=('one', 'two', 'three')`).
+            factor. (e.g., `condition=('one', 'two', 'three')`). `lazy` and
+            `seed` are reserved and cannot be used as factor names.
 
     Returns:
         list: Control list. Each item is a dictionary of trial details.
 
+    Raises:
+        TypeError: If `lazy` or `seed` is given levels of a factor.
+
     """
+    _check_reserved(lazy=lazy, seed=seed)
+
+    if lazy:
+
+        return ControlSequence(reps, shuffled, seed=seed, **kwargs)
+
     factors = kwargs.keys()
     levels = [[l for l in kwargs[f]] for f in factors]
     control = [{f: l for f, l in zip(factors, t)} for t in product(*levels)]
@@ -34,3 +49,462 @@ def make_control_list(reps, shuffled, **kwargs):
         shuffle(control)
 
     return control
+
+
+def _check_reserved(**options):
+    """Raise an error if an option looks like the levels of a factor, which
+    means a factor was given one of the reserved names.
+
+    """
+    for name, value in options.items():
+
+        if isinstance(value, (list, tuple, set, range)):
+
+            raise TypeError('%s is reserved and cannot be used as a factor '
+                            'name' % name)
+
+
+class ControlSequence:
+
+    def __init__(self, reps, shuffled, *, seed=None, **kwargs):
+        """A compact, lazily evaluated control list.
+
+        Behaves like the list returned by `make_control_list` as far as
+        experiments are concerned (`pop(0)`, `append`, `len`, peeking at
+        `[0]`), but stores only the factor levels, a seed and a position.
+        Trial `i` is cell `order[i] % n_cells` of the design, where `order` is
+        a permutation regenerated from the seed, and each cell decomposes into
+        one level index per factor. Trial dictionaries are created only when
+        trials are taken, and each one is a fresh object.
+
+        Trials appended (e.g., rejected trials) are kept in a small heap keyed
+        by their position in the sequence, so taking the next trial and
+        putting one back are both cheap however long the sequence is.
+
+        Args:
+            reps (int): Number of repetitions per level of each condition.
+            shuffled (bool): Should trials be shuffled?
+            seed (:obj:`int`, optional): Seed for the shuffle. Defaults to a
+                random seed, which is stored so that the order can be rebuilt.
+
+        Kwargs:
+            Factors and their levels, as for `make_control_list`.
+
+        """
+        _check_reserved(seed=seed)
+        self.factors = list(kwargs)
+        self.levels = [list(kwargs[f]) for f in self.factors]
+        self.reps = reps
+        self.shuffled = shuffled
+        self.seed = randrange(2 ** 32) if seed is None else seed
+        self.n_cells = 1
+
+        for l in self.levels:
+
+            self.n_cells *= len(l)
+
+        self.n = self.n_cells * reps
+        self.head = 0
+        self.tail = []
+        self.counter = 0
+        self.dirty = False
+        self._order = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_order'] = None
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+    @property
+    def order(self):
+        """Permutation of trial indices, rebuilt from the seed when needed.
+
+        """
+        if self._order is None:
+
+            order = array('l', range(self.n))
+
+            if self.shuffled:
+
+                Random(self.seed).shuffle(order)
+
+            self._order = order
+
+        return self._order
+
+    def make(self, cell):
+        """Create the trial dictionary for a cell of the design.
+
+        """
+        details = {}
+
+        for f, l in zip(reversed(self.factors), reversed(self.levels)):
+
+            cell, i = divmod(cell, len(l))
+            details[f] = l[i]
+
+        return {f: details[f] for f in self.factors}
+
+    def __len__(self):
+
+        return self.n - self.head + len(self.tail)
+
+    def _next_is_tail(self):
+
+        return self.tail and (self.head >= self.n or
+                              self.tail[0][0] < self.head)
+
+    def __getitem__(self, i):
+
+        if i != 0:
+
+            raise IndexError('only the next trial can be looked at')
+
+        if self._next_is_tail():
+
+            return self.tail[0][2]
+
+        if self.head >= self.n:
+
+            raise IndexError('control sequence is empty')
+
+        return self.make(self.order[self.head] % self.n_cells)
+
+    def __iter__(self):
+
+        tail = sorted(self.tail)
+        j = 0
+
+        for i in range(self.head, self.n):
+
+            while j < len(tail) and tail[j][0] < i:
+
+                yield tail[j][2]
+                j += 1
+
+            yield self.make(self.order[i] % self.n_cells)
+
+        for item in tail[j:]:
+
+            yield item[2]
+
+    def __repr__(self):
+
+        return 'ControlSequence(%i remaining of %i)' % (len(self), self.n)
+
+    def pop(self, i=0):
+        """Take the next trial.
+
+        """
+        if i != 0:
+
+            raise IndexError('trials can only be taken from the front')
+
+        self.dirty = True
+
+        if self._next_is_tail():
+
+            return heappop(self.tail)[2]
+
+        if self.head >= self.n:
+
+            raise IndexError('pop from empty control sequence')
+
+        self.head += 1
+
+        return self.make(self.order[self.head - 1] % self.n_cells)
+
+    def insert_at(self, position, details):
+        """Put a trial back so that it is taken once the sequence reaches
+        `position` (which may be fractional).
+
+        """
+        heappush(self.tail, (position, self.counter, details))
+        self.counter += 1
+        self.dirty = True
+
+    def append(self, details):
+        """Put a trial at the end of the sequence.
+
+        """
+        self.insert_at(self.n + self.counter, details)
+
+    def extend(self, items):
+
+        for details in items:
+
+            self.append(details)
+
+    def requeue(self, details, where='random', block_size=None):
+        """Put a trial back at a random future position or at the end of the
+        current block. This costs O(log n), however long the sequence is.
+
+        The random position is drawn from the sequence's seed and the number of
+        trials put back so far, so it is the same every time the session is
+        run (or resumed) in the same way.
+
+        Args:
+            details (dict): Trial details.
+            where (:obj:`str`, optional): `'random'` or `'block'`. Defaults to
+                `'random'`.
+            block_size (:obj:`int`, optional): Number of trials per block.
+                Required if `where` is `'block'`.
+
+        """
+        if where == 'random':
+
+            rng = Random('%i-%i' % (self.seed, self.counter))
+            position = self.head + rng.randrange(self.n - self.head + 1) - .5
+
+        elif where == 'block':
+
+            assert block_size, 'block_size is required'
+            position = (max(self.head - 1, 0) // block_size + 1) * \
+                block_size - .5
+
+        else:
+
+            raise ValueError('unknown position: %s' % where)
+
+        self.insert_at(position, details)
+
+    def take_delta(self):
+        """Return the state to journal, if anything has changed. The whole
+        sequence is only a few numbers plus any trials that were put back.
+
+        """
+        delta = ('state', self) if self.dirty else None
+        self.dirty = False
+
+        return delta
+
+
+def requeue(control, details, where='random', block_size=None,
+            max_requeues=None, seed=None):
+    """Put a rejected trial back into a control list without reshuffling it.
+
+    The trial is copied with its `requeues` field increased by one, so the
+    number of times it has been put back is recorded in the results. Control
+    sequences (see `ControlSequence.requeue`) do this in O(log n); plain lists
+    insert the trial at the chosen index, which is still far cheaper than
+    shuffling the whole list again.
+
+    Args:
+        control (list): Control list or `ControlSequence`, e.g.,
+            `data_obj.control`.
+        details (dict): Trial details.
+        where (:obj:`str`, optional): `'random'` (anywhere from the next trial
+            onwards) or `'block'` (end of the current block). Defaults to
+            `'random'`.
+        block_size (:obj:`int`, optional): Number of trials per block.
+            Required if `where` is `'block'`. Blocks of a plain list are
+            counted from its end.
+        max_requeues (:obj:`int`, optional): Maximum number of times a trial
+            may be put back. Defaults to no limit.
+        seed (:obj:`int` or :obj:`str`, optional): Seed for plain lists. Positions are drawn
+            from the seed and the length of the list, so they are the same
+            every time the session is run in the same way. Control sequences
+            use their own seed.
+
+    Returns:
+        bool: Whether the trial was put back.
+
+    """
+    count = details.get('requeues', 0)
+
+    if max_requeues is not None and count >= max_requeues:
+
+        return False
+
+    details = dict(details, requeues=count + 1)
+
+    if hasattr(control, 'requeue'):
+
+        control.requeue(details, where, block_size)
+
+        return True
+
+    if where == 'random':
+
+        n = len(control) + 1
+        i = randrange(n) if seed is None else \
+            Random('%s-%i' % (seed, n)).randrange(n)
+
+    elif where == 'block':
+
+        assert block_size, 'block_size is required'
+        i = len(control) % block_size
+
+    else:
+
+        raise ValueError('unknown position: %s' % where)
+
+    control.insert(i, details)
+
+    return True
+
+
+def _feasible(count, rest, max_run, run):
+    """Whether `count` items with one key can still be placed among `rest`
+    items with other keys, when the current run of that key is `run` long.
+
+    """
+    return count <= max_run * rest + max_run - run
+
+
+def constrained_shuffle(items, max_run, key=None, seed=None):
+    """Shuffle so that no more than `max_run` consecutive items share a key.
+
+    Rather than reshuffling until a valid order turns up, which takes very
+    long for long sequences, the order is built one position at a time. Each
+    position gets a randomly chosen remaining item (so keys are drawn in
+    proportion to how many of them are left), skipping keys that would make
+    the run too long or leave the remaining items impossible to place. This
+    never backtracks, so the whole shuffle takes linear time in the number of
+    items (times the number of distinct keys).
+
+    Args:
+        items (list): Items to shuffle, e.g., a control list.
+        max_run (int): Maximum number of consecutive items with the same key.
+        key (:obj:`function`, optional): Function of an item that returns its
+            key, e.g., `lambda t: t['direction']`. Defaults to the item.
+        seed (:obj:`int`, optional): Seed for the random number generator.
+
+    Returns:
+        list: The shuffled items.
+
+    Raises:
+        ValueError: If no valid order exists.
+
+    """
+    rng = Random(seed)
+    items = list(items)
+    key = key if key else (lambda x: x)
+    buckets = {}
+
+    for x in items:
+
+        buckets.setdefault(key(x), []).append(x)
+
+    for bucket in buckets.values():
+
+        rng.shuffle(bucket)
+
+    n = len(items)
+
+    if n and not all(_feasible(len(b), n - len(b), max_run, 0) for b in
+                     buckets.values()):
+
+        raise ValueError('no order satisfies max_run=%i' % max_run)
+
+    out = []
+    last = None
+    run = 0
+
+    for left in range(n, 0, -1):
+
+        # the two commonest keys are the only ones that can become impossible
+        # to place
+
+        counts = sorted(((len(b), k) for k, b in buckets.items() if b),
+                        key=lambda c: c[0], reverse=True)
+        allowed = []
+
+        for c, k in counts:
+
+            r = run + 1 if k == last else 1
+            other = next((o for o in counts[:2] if o[1] != k), None)
+
+            if r > max_run or not _feasible(c - 1, left - c, max_run, r) or \
+                    other and not _feasible(other[0], left - 1 - other[0],
+                                            max_run, 0):
+
+                continue
+
+            allowed.append((c, k))
+
+        if not allowed:
+
+            raise ValueError('could not complete the order at position %i' %
+                             (n - left))
+
+        # draw a key in proportion to its remaining items
+
+        x = rng.random() * sum(c for c, _ in allowed)
+
+        for c, k in allowed:
+
+            x -= c
+
+            if x < 0:
+
+                break
+
+        out.append(buckets[k].pop())
+        run = run + 1 if k == last else 1
+        last = k
+
+    return out
+
+
+def balanced_latin_square(n):
+    """Return a balanced Latin square (Williams design) for `n` conditions.
+
+    Each row is an order of the conditions `0..n-1`. Every condition appears
+    once in each position and, across rows, follows every other condition
+    equally often. For odd `n`, this needs `2n` rows.
+
+    Args:
+        n (int): Number of conditions.
+
+    Returns:
+        list: Rows of the square, each a list of condition indices.
+
+    """
+    first = []
+    lo, hi = 0, n - 1
+
+    for i in range(n):
+
+        if i % 2 == 0:
+
+            first.append(lo)
+            lo += 1
+
+        else:
+
+            first.append(hi)
+            hi -= 1
+
+    rows = [[(c + r) % n for c in first] for r in range(n)]
+
+    if n % 2:
+
+        rows += [row[::-1] for row in rows]
+
+    return rows
+
+
+def counterbalanced_order(conditions, subj_index):
+    """Return the order of conditions (e.g., blocks) for a subject, taken from
+    a balanced Latin square so that orders are counterbalanced across
+    subjects.
+
+    Args:
+        conditions (list): The conditions.
+        subj_index (int): Index of the subject (e.g., 0 for the first subject
+            in a project).
+
+    Returns:
+        list: The conditions in this subject's order.
+
+    """
+    rows = balanced_latin_square(len(conditions))
+
+    return [conditions[i] for i in rows[subj_index % len(rows)]]
@@ -1,16 +1,520 @@
 """Data management.
 
 """
+import logging
+from loocius.tools.catalog import get_catalog
 from loocius.tools.paths import data_path
-from os.path import exists, join as pj
+from loocius.tools.profiling import traced
+from loocius.tools.results import RecordTable, ResultsTable
+from io import BytesIO
+from mmap import ACCESS_READ, mmap as memory_map
+from os import O_RDONLY, close, fsync, link, makedirs, open as os_open, \
+    remove, replace, truncate
+from os.path import dirname, exists, getsize, join as pj
 from datetime import datetime
-from pickle import dump, load
+from pickle import dump, dumps, load, loads, HIGHEST_PROTOCOL, \
+    UnpicklingError
 from getpass import getuser
+from shutil import copyfile
+from struct import Struct, error
+from zlib import crc32
+
+
+logger = logging.getLogger(__name__)
+
+# session files start with a header: magic bytes, schema version, CRC-32 and
+# length of the rest of the file; files written before headers existed are a
+# bare pickle, and count as schema 1
+
+_magic = b'LOOCIUS\n'
+_schema = 3
+_header = Struct('<8sHIQ')
+
+# from schema 3, the header is followed by the number of out-of-band buffers
+# (e.g., the rows of a `RecordTable`) and the length of the pickle, the offset
+# and size of each buffer, the pickle, and the buffers themselves, each
+# aligned so that it can be memory-mapped
+
+_table = Struct('<IQ')
+_entry = Struct('<QQ')
+_align = 64
+
+
+def _dirtying(name):
+    """Wrap a list method so that calling it marks a `TrackedList` as dirty.
+
+    """
+    method = getattr(list, name)
+
+    def wrapped(self, *args, **kwargs):
+
+        self.dirty = True
+
+        return method(self, *args, **kwargs)
+
+    wrapped.__name__ = name
+
+    return wrapped
+
+
+class TrackedList(list):
+    """A list that remembers how it has changed since it was last journaled.
+
+    Experiments pop trials from control lists and append rejected trials back
+    onto them, so these operations are recorded as a compact delta. Anything
+    else (e.g., shuffling or item assignment) marks the list as dirty, in which
+    case it is journaled in full.
+
+    """
+
+    def __init__(self, *args):
+
+        super(TrackedList, self).__init__(*args)
+        self.ops = []
+        self.dirty = False
+
+    def pop(self, i=-1):
+
+        item = super(TrackedList, self).pop(i)
+        self.ops.append(('pop', i))
+
+        return item
+
+    def append(self, item):
+
+        super(TrackedList, self).append(item)
+        self.ops.append(('append', item))
+
+    def extend(self, items):
+
+        items = list(items)
+        super(TrackedList, self).extend(items)
+        self.ops.append(('extend', items))
+
+    def insert(self, i, item):
+
+        super(TrackedList, self).insert(i, item)
+        self.ops.append(('insert', i, item))
+
+    def __reduce__(self):
+
+        # pickle as a plain list so that pending changes are not saved
+
+        return list, (list(self),)
+
+    __setitem__ = _dirtying('__setitem__')
+    __delitem__ = _dirtying('__delitem__')
+    __iadd__ = _dirtying('__iadd__')
+    __imul__ = _dirtying('__imul__')
+    remove = _dirtying('remove')
+    sort = _dirtying('sort')
+    reverse = _dirtying('reverse')
+    clear = _dirtying('clear')
+
+    def take_delta(self):
+        """Return the changes since the last call and forget them.
+
+        Returns:
+            tuple: `('ops', [...])` if the changes can be replayed cheaply,
+                `('full', [...])` if the whole list should be rewritten, or
+                `None` if nothing has changed.
+
+        """
+        if self.dirty or len(self.ops) > len(self):
+
+            delta = ('full', list(self))
+
+        elif self.ops:
+
+            delta = ('ops', self.ops)
+
+        else:
+
+            delta = None
+
+        self.ops = []
+        self.dirty = False
+
+        return delta
+
+    def replay(self, delta):
+        """Apply a delta returned by `take_delta` without recording it.
+
+        """
+        kind, body = delta
+
+        if kind == 'full':
+
+            list.__init__(self, body)
+
+        else:
+
+            for op in body:
+
+                getattr(list, op[0])(self, *op[1:])
+
+
+class ResultIndex:
+
+    def __init__(self, fields):
+        """Latest result for every combination of values of some fields.
+
+        Adaptive procedures need the most recent trial of a particular kind,
+        e.g., the last trial of a given chain in serial reproduction. Instead
+        of scanning all results, the index remembers the last result for each
+        key and catches up with newly appended results when it is consulted,
+        so each lookup costs O(1) amortised, however long the session.
+
+        Args:
+            fields (tuple): Names of the fields that make up the key.
+
+        """
+        self.fields = tuple(fields)
+        self.latest = {}
+        self.n_seen = 0
+
+    def catch_up(self, results):
+        """Index any results appended since the last call.
+
+        """
+        if len(results) < self.n_seen:
+
+            # results were replaced; start again
+
+            self.latest = {}
+            self.n_seen = 0
+
+        for trial in results[self.n_seen:]:
+
+            self.latest[tuple(trial.get(f) for f in self.fields)] = trial
+
+        self.n_seen = len(results)
+
+
+def journal_path(abspath):
+    """Path of the journal belonging to the session file `abspath`.
+
+    """
+    return abspath[:-len('.dic')] + '.jnl'
+
+
+def backup_path(abspath):
+    """Path of the previous checkpoint of the session file `abspath`.
+
+    """
+    return abspath + '.bak'
+
+
+def session_exists(abspath):
+    """Whether there is a session at `abspath`, i.e., the session file or,
+    if a crash interrupted a checkpoint, its backup.
+
+    """
+    return exists(abspath) or exists(backup_path(abspath))
+
+
+def _fsync_dir(path):
+    """Make a rename in directory `path` durable, where the OS allows it.
+
+    """
+    try:
+
+        fd = os_open(path, O_RDONLY)
+
+    except OSError:
+
+        return
+
+    try:
+
+        fsync(fd)
+
+    except OSError:
+
+        pass
+
+    finally:
+
+        close(fd)
+
+
+def write_checkpoint(abspath, dic):
+    """Write a session file so that a crash at any moment leaves either the
+    old or the new version intact, never a mixture.
+
+    The session is pickled into a temporary file with a header holding the
+    schema version and a checksum, and forced to disk. The old file is then
+    linked (or, where links are not supported, copied) to the backup, and the
+    new file is renamed over it, so that the session file itself is never
+    missing. Large arrays (e.g., the rows of a
+    `RecordTable`) are written after the pickle as raw bytes.
+
+    Args:
+        abspath (str): Path to the `.dic` file.
+        dic (dict): The session.
+
+    """
+    buffers = []
+    payload = dumps(dic, HIGHEST_PROTOCOL, buffer_callback=buffers.append)
+    buffers = [b.raw() for b in buffers]
+    offset = _header.size + _table.size + _entry.size * len(buffers) + \
+        len(payload)
+    parts = [_table.pack(len(buffers), len(payload))]
+    blobs = []
+
+    for b in buffers:
+
+        pad = -offset % _align
+        parts.append(_entry.pack(offset + pad, b.nbytes))
+        blobs += [bytes(pad), b]
+        offset += pad + b.nbytes
+
+    parts += [payload] + blobs
+    checksum = 0
+
+    for part in parts:
+
+        checksum = crc32(part, checksum)
+
+    tmp = abspath + '.tmp'
+
+    with open(tmp, 'wb') as f:
+
+        f.write(_header.pack(_magic, _schema, checksum,
+                             offset - _header.size))
+
+        for part in parts:
+
+            f.write(part)
+
+        f.flush()
+        fsync(f.fileno())
+
+    if exists(abspath):
+
+        bak = backup_path(abspath)
+
+        if exists(bak + '.tmp'):
+
+            remove(bak + '.tmp')
+
+        try:
+
+            link(abspath, bak + '.tmp')
+
+        except OSError:
+
+            copyfile(abspath, bak + '.tmp')
+
+        replace(bak + '.tmp', bak)
+
+    replace(tmp, abspath)
+    _fsync_dir(dirname(abspath) or '.')
+
+
+def _migrate(dic, schema):
+    """Bring a session dictionary written with an older schema up to date.
+
+    """
+    if schema < 2:
+
+        # schema 1 had no checkpoint generations; its journals had no header
+
+        dic.setdefault('indexes', {})
+        dic.setdefault('generation', 0)
+
+    return dic
+
+
+def read_checkpoint(abspath, mmap=False):
+    """Read and validate a session file, without its journal.
+
+    Args:
+        abspath (str): Path to the `.dic` file.
+        mmap (:obj:`bool`, optional): Memory-map the file rather than reading
+            it, so that the rows of a `RecordTable` are only read from disk
+            when they are used. The checksum is not verified, since that would
+            mean reading the whole file. Defaults to `False`.
+
+    Returns:
+        dict: The session.
+
+    Raises:
+        ValueError: If the file is truncated, corrupt, or from a newer
+            version of loocius.
+
+    """
+    with open(abspath, 'rb') as f:
+
+        raw = memoryview(memory_map(f.fileno(), 0, access=ACCESS_READ) if
+                         mmap else f.read())
+
+    if raw[:len(_magic)] != _magic:
+
+        try:
+
+            return _migrate(loads(raw), 1)
+
+        except (EOFError, UnpicklingError, IndexError) as e:
+
+            raise ValueError('corrupt session file %s: %s' % (abspath, e))
+
+    if len(raw) < _header.size:
+
+        raise ValueError('truncated session file %s' % abspath)
+
+    _, schema, checksum, length = _header.unpack_from(raw)
+    body = raw[_header.size:]
+
+    if schema > _schema:
+
+        raise ValueError('%s was written with a newer schema (%i)' % (
+            abspath, schema))
+
+    if len(body) != length or not mmap and crc32(body) != checksum:
+
+        raise ValueError('corrupt session file %s' % abspath)
+
+    if schema < 3:
+
+        return _migrate(loads(body), schema)
+
+    try:
+
+        n, size = _table.unpack_from(body)
+        start = _table.size + _entry.size * n
+        buffers = [raw[o:o + b] for o, b in (_entry.unpack_from(
+            body, _table.size + _entry.size * i) for i in range(n))]
+
+        return _migrate(loads(body[start:start + size], buffers=buffers),
+                        schema)
+
+    except (EOFError, UnpicklingError, IndexError, error) as e:
+
+        raise ValueError('corrupt session file %s: %s' % (abspath, e))
+
+
+def replay_control(control, delta):
+    """Apply a journaled change to a control list, or replace it.
+
+    Args:
+        control (list): The control list, or `None`.
+        delta (tuple): The change, as returned by `TrackedList.take_delta`,
+            or `('state', control)` for other kinds of control sequence.
+
+    Returns:
+        list: The changed control list.
+
+    """
+    if delta[0] == 'state':
+
+        return delta[1]
+
+    if delta[0] == 'full' or control is None:
+
+        return TrackedList(delta[1])
+
+    if not isinstance(control, TrackedList):
+
+        control = TrackedList(control)
+
+    control.replay(delta)
+
+    return control
+
+
+def read_session(abspath, repair=False, mmap=False):
+    """Read a session file, replaying its journal if it has one.
+
+    If the session file is missing or fails validation (e.g., it was only
+    partly written before a crash), the previous checkpoint is read instead.
+    Journal records are only replayed on top of the checkpoint they were
+    written after.
+
+    Args:
+        abspath (str): Path to a `.dic` file.
+        repair (:obj:`bool`, optional): Cut off a journal record truncated by
+            a crash, or a journal that belongs to another checkpoint, so that
+            later appends are not written after it. Defaults to `False`.
+        mmap (:obj:`bool`, optional): Memory-map the session file (see
+            `read_checkpoint`). Defaults to `False`.
+
+    Returns:
+        dict: The pickled dictionary, with all journaled trials applied.
+
+    """
+    try:
+
+        dic = read_checkpoint(abspath, mmap)
+
+    except (OSError, ValueError):
+
+        if not exists(backup_path(abspath)):
+
+            raise
+
+        dic = read_checkpoint(backup_path(abspath), mmap)
+
+    path = journal_path(abspath)
+
+    if not exists(path):
+
+        return dic
+
+    # reading the whole journal at once is much faster than unpickling its
+    # records one by one from the file
+
+    with open(path, 'rb') as f:
+
+        buf = BytesIO(f.read())
+
+    good = 0
+    first = True
+
+    while True:
+
+        try:
+
+            kind, body = load(buf)
+
+        except (EOFError, UnpicklingError, ValueError, TypeError):
+
+            break
+
+        if first:
+
+            # journals start with the generation of their checkpoint, except
+            # schema-1 journals, which belong to generation 0
+
+            first = False
+            generation = body if kind == 'checkpoint' else 0
+
+            if generation != dic.get('generation'):
+
+                break
+
+        if kind == 'result':
+
+            dic['results'].append(body)
+
+        elif kind == 'control':
+
+            dic['control'] = replay_control(dic['control'], body)
+
+        good = buf.tell()
+
+    if repair and good < len(buf.getbuffer()):
+
+        truncate(path, good)
+
+    return dic
 
 
 class Data:
 
-    def __init__(self, subj_id, exp_name, proj_id=None):
+    def __init__(self, subj_id, exp_name, proj_id=None, journal=False,
+                 fsync_every=10, columnar=False, catalog=True, schema=None,
+                 data_dir=None):
         """Returns an instance of the `Data` object.
 
         `Data` objects contain all the necessary details to run a given subject
@@ -18,11 +522,35 @@ class Data:
         resumed if prematurely aborted and prevents a subject for completing
         the same experiment twice.
 
+        By default, every call to `.save()` writes a new checkpoint of the
+        whole session (see `write_checkpoint`), so a crash while saving never
+        destroys the previous one. In journaled mode, the session is
+        checkpointed only once; after that, each call appends the new results
+        and a delta of the control list to a journal file, so the cost of
+        saving does not grow with the number of completed trials. The journal
+        is replayed by `.load()` and folded back into a new checkpoint once the
+        experiment is done.
+
         Args:
             subj_id (str): Subject's ID.
             exp_name (str): Name of the experiment.
             proj_id (:obj:`str`, optional): Project the data belongs to.
                 Defaults to `None`.
+            journal (:obj:`bool`, optional): Use journaled mode. Defaults to
+                `False`.
+            fsync_every (:obj:`int`, optional): In journaled mode, force the
+                journal to disk after this many records. Defaults to 10.
+            columnar (:obj:`bool`, optional): Keep results in a
+                `ResultsTable` rather than a list of dictionaries. Defaults to
+                `False`.
+            catalog (:obj:`bool`, optional): Update the catalog of sessions in
+                the data directory on every checkpoint and when the session is
+                closed. Defaults to `True`.
+            schema (:obj:`dict`, optional): Fields of a trial and their types.
+                If given, results are kept in a `RecordTable` with this schema,
+                which takes precedence over `columnar`.
+            data_dir (:obj:`str`, optional): Directory the session is saved
+                in. Defaults to the data directory.
 
         Returns:
             Data: The Data object.
@@ -40,43 +568,571 @@ class Data:
         self.user_id = getuser()
         self.exp_done = False
         self.control = None
-        self.results = []
+        self.columnar = columnar
+        self.schema = schema
+        self.results = self._new_results()
+        self.indexes = {}
+        self.generation = 0
+        self.data_dir = data_dir if data_dir else data_path
         self.relpath = '%s_%s.dic' % (self.subj_id, self.exp_name)
-        self.abspath = pj(data_path, self.relpath)
+        self.abspath = pj(self.data_dir, self.relpath)
+        self.journal_path = journal_path(self.abspath)
 
-        # make the dictionary that gets pickled when .save() is called
+        # journaling state
 
-        self.dic = locals()
+        self.journal = journal
+        self.catalog = catalog
+        self.fsync_every = fsync_every
+        self._journal_file = None
+        self._unsynced = 0
+        self._n_journaled = 0
+        self._journaled_done = False
 
         # load pre-existing data, if any exist
 
         self.load()
 
+    @property
+    def control(self):
+
+        return self._control
+
+    @control.setter
+    def control(self, control):
+
+        # replaced control lists are always journaled in full
+
+        if isinstance(control, list) and not isinstance(control, TrackedList):
+
+            control = TrackedList(control)
+
+        if hasattr(control, 'dirty'):
+
+            control.dirty = True
+
+        self._control = control
+
+    @property
+    def dic(self):
+        """The dictionary that gets pickled when `.save()` is called.
+
+        """
+        return {
+            'subj_id': self.subj_id,
+            'exp_name': self.exp_name,
+            'timestamp': self.timestamp,
+            'proj_id': self.proj_id,
+            'user_id': self.user_id,
+            'exp_done': self.exp_done,
+            'control': self.control,
+            'results': self.results,
+            'indexes': self.indexes,
+            'generation': self.generation,
+        }
+
     def load(self):
         """Load pre-existing data if any exist.
 
         """
 
-        if exists(self.abspath):
+        if session_exists(self.abspath):
+
+            dic = read_session(self.abspath, repair=True)
+            self.restore(dic)
+            self.generation = dic.get('generation', 0)
+
+            # a journal left over from an interrupted session is folded into a
+            # new checkpoint, so that it is only replayed once; so is a session
+            # that only survives as its backup
+
+            if not exists(self.abspath) or exists(self.journal_path) and \
+                    getsize(self.journal_path):
+
+                self._write()
+
+    def restore(self, dic):
+        """Take the details of a session from a dictionary, e.g., one read by
+        `read_session` or sent by a testing station. Everything is assumed to
+        be on disk already.
+
+        """
+
+        # sanity checks
+
+        assert self.subj_id == dic['subj_id'], 'wrong subject id'
+
+        assert self.exp_name == dic['exp_name'], 'wrong experiment'
+
+        # load important details into the namespace of this instance
+
+        self.timestamp = dic.get('timestamp', self.timestamp)
+        self.proj_id = dic.get('proj_id', self.proj_id)
+        self.user_id = dic.get('user_id', self.user_id)
+        self.exp_done = dic['exp_done']
+        self.control = dic['control']
+        self.results = dic['results']
+        self.indexes = dic.get('indexes', {})
+
+        if self.schema is not None:
+
+            if not isinstance(self.results, RecordTable) or \
+                    self.results.schema != self.schema:
+
+                self.results = RecordTable(self.schema, self.results)
+
+        elif self.columnar and not isinstance(self.results, ResultsTable):
+
+            self.results = ResultsTable(self.results)
+
+        self._mark_journaled()
+
+    def _new_results(self):
+        """Return an empty container for results.
+
+        """
+        if self.schema is not None:
+
+            return RecordTable(self.schema)
+
+        return ResultsTable() if self.columnar else []
+
+    def latest(self, **key):
+        """Return the most recent result with the given field values.
+
+        For example, `latest(mode='telephone', stim='banana.png', chain=0)`
+        returns the last trial of that chain. An index over the given fields is
+        built on first use, saved with the session, and updated as results are
+        appended, so later lookups do not scan the results.
+
+        Kwargs:
+            Field names and the values they must have.
+
+        Returns:
+            dict: The result, or `None` if there is none.
+
+        """
+        fields = tuple(sorted(key))
+
+        if fields not in self.indexes:
+
+            self.indexes[fields] = ResultIndex(fields)
+
+        index = self.indexes[fields]
+        index.catch_up(self.results)
+
+        return index.latest.get(tuple(key[f] for f in fields))
+
+    def _mark_journaled(self):
+        """Record that everything currently in memory is on disk.
+
+        """
+        self._n_journaled = len(self.results)
+        self._journaled_done = self.exp_done
+
+        if hasattr(self.control, 'take_delta'):
+
+            self.control.take_delta()
+
+    @traced('data.checkpoint')
+    def _write(self):
+        """Write a new checkpoint of the whole session and discard the
+        journal.
+
+        """
+        self._close_journal()
+        makedirs(self.data_dir, exist_ok=True)
+
+        # the journal of the previous checkpoint no longer applies, even if a
+        # crash stops it from being removed below
+
+        self.generation += 1
+        write_checkpoint(self.abspath, self.dic)
 
-            self.dic = load(open(self.abspath))
+        if exists(self.journal_path):
 
-            # sanity checks
+            remove(self.journal_path)
 
-            assert self.subj_id == self.dic['subj_id'], 'wrong subject id'
+        self._mark_journaled()
+        self._update_catalog()
 
-            assert self.exp_name == self.dic['exp_name'], 'wrong experiment'
+    def _update_catalog(self):
 
-            # load important details into the namespace of this instance
+        if self.catalog:
 
-            self.exp_done = self.dic['exp_done']
-            self.control = self.dic['control']
-            self.results = self.dic['results']
+            get_catalog(self.data_dir).update(self)
+
+    def _append(self, kind, body):
+        """Append a single record to the journal.
+
+        """
+        if self._journal_file is None:
+
+            self._journal_file = open(self.journal_path, 'ab')
+
+            if not self._journal_file.tell():
+
+                dump(('checkpoint', self.generation), self._journal_file,
+                     HIGHEST_PROTOCOL)
+
+        dump((kind, body), self._journal_file, HIGHEST_PROTOCOL)
+        self._unsynced += 1
 
     def save(self):
         """Save the data.
 
         """
 
-        dump(self.dic, open(self.abspath, 'w'))
+        if not self.journal or not self._checkpointed() or \
+                len(self.results) < self._n_journaled or \
+                (self.exp_done and not self._journaled_done):
+
+            # full write: first save, non-journaled mode, results replaced, or
+            # experiment finished (folds the journal back into the main file)
+
+            self._write()
+
+        else:
+
+            self._append_new()
+
+    def _checkpointed(self):
+        """Whether the session has been checkpointed yet.
+
+        """
+        return session_exists(self.abspath)
+
+    def apply(self, records):
+        """Apply and journal records made by another `Data` object, e.g., on
+        a testing station (see `loocius.tools.server`).
+
+        Args:
+            records (list): `(kind, body)` tuples, as journaled.
+
+        """
+        if not self._checkpointed():
+
+            self._write()
+
+        for kind, body in records:
+
+            if kind == 'result':
+
+                self.results.append(body)
+
+            elif kind == 'control':
+
+                self._control = replay_control(self._control, body)
+
+            self._append(kind, body)
+
+        self._mark_journaled()
+
+        if self._journal_file is not None:
+
+            self._journal_file.flush()
+
+            if self._unsynced >= self.fsync_every:
+
+                self.sync()
+
+    @traced('data.journal')
+    def _append_new(self):
+        """Journal everything that changed since the last save.
+
+        """
+
+        for trial in self.results[self._n_journaled:]:
+
+            self._append('result', trial)
+
+        self._n_journaled = len(self.results)
+
+        if hasattr(self.control, 'take_delta'):
+
+            delta = self.control.take_delta()
+
+            if delta is not None:
+
+                self._append('control', delta)
+
+        if self._journal_file is not None:
+
+            self._journal_file.flush()
+
+            if self._unsynced >= self.fsync_every:
+
+                self.sync()
+
+    def sync(self):
+        """Force any journal records to disk.
+
+        """
+        if self._journal_file is not None:
+
+            self._journal_file.flush()
+            fsync(self._journal_file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        """Flush and close the journal, if open, and bring the catalog up to
+        date with what was journaled.
+
+        """
+        if self._journal_file is not None:
+
+            self._close_journal()
+            self._update_catalog()
+
+    def _close_journal(self):
+
+        if self._journal_file is not None:
+
+            self.sync()
+            self._journal_file.close()
+            self._journal_file = None
+
+
+_meta = ('subj_id', 'exp_name', 'proj_id', 'user_id', 'timestamp', 'exp_done')
+
+
+def _read_fields(args):
+    """Read one session and keep only the requested result fields. Runs in a
+    worker process, so it returns a compact `ResultsTable`.
+
+    """
+    abspath, fields = args
+    dic = read_session(abspath)
+    results = dic['results']
+
+    if isinstance(results, RecordTable):
+
+        results = results.to_table(fields)
+
+    elif fields is not None:
+
+        if isinstance(results, ResultsTable):
+
+            table = ResultsTable()
+            table.columns = {f: results.columns[f] for f in fields if f in
+                             results.columns}
+            table.strings = results.strings
+            table._n = len(results)
+            results = table
+
+        else:
+
+            results = [{f: r.get(f) for f in fields} for r in results]
+
+    if not isinstance(results, ResultsTable):
+
+        results = ResultsTable(results)
+
+    session = {k: dic.get(k) for k in _meta}
+    session['results'] = results
+
+    return session
+
+
+def _read_or_skip(abspath, read, *args):
+    """Return `read(*args)`, or `None` if the session file `abspath` could not
+    be read, which is logged.
+
+    """
+    try:
+
+        return read(*args)
+
+    except (OSError, ValueError) as e:
+
+        logger.warning('skipping session %s: %s', abspath, e)
+
+        return None
+
+
+def iter_sessions(exp_name=None, proj_id=None, exp_done=None, fields=None,
+                  processes=None, data_dir=None):
+    """Iterate over all sessions in the data directory.
+
+    Sessions are found via the catalog, so only the matching files are
+    opened. Files that changed since the catalog last indexed them have to be
+    read anyway: they are indexed from what the workers send back, and kept if
+    they match. Files are read in parallel by a pool of worker processes, but
+    only a few sessions are held in memory at a time. Files that cannot be
+    read are logged and skipped.
+
+    Args:
+        exp_name (:obj:`str` or :obj:`list`, optional): Only sessions of this
+            experiment or these experiments.
+        proj_id (:obj:`str` or :obj:`list`, optional): Only sessions of this
+            project or these projects.
+        exp_done (:obj:`bool`, optional): Only finished (`True`) or unfinished
+            (`False`) sessions.
+        fields (:obj:`list`, optional): Result fields to keep. Defaults to all.
+        processes (:obj:`int`, optional): Number of worker processes. Defaults
+            to the number of CPUs; 1 reads the files in this process.
+        data_dir (:obj:`str`, optional): Directory to look in. Defaults to the
+            data directory.
+
+    Yields:
+        dict: Session details, with the results as a `ResultsTable`.
+
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    from os import cpu_count
+
+    data_dir = data_dir if data_dir else data_path
+    catalog = get_catalog(data_dir)
+    criteria = {'exp_name': exp_name, 'proj_id': proj_id,
+                'exp_done': exp_done}
+    criteria = {k: v for k, v in criteria.items() if v is not None}
+
+    # changed files come with the modification time to index them under;
+    # the others were already matched by the catalog
+
+    changed = dict(catalog.changes())
+    relpaths = {r['relpath']: None for r in catalog.query(**criteria)}
+    relpaths.update(changed)
+    jobs = [(r, relpaths[r]) for r in sorted(relpaths)]
+    processes = processes if processes else cpu_count()
+
+    def finish(relpath, mtime, session):
+
+        if session is None or mtime is None:
+
+            return session
+
+        catalog.update(dict(session, relpath=relpath), mtime)
+
+        for f, v in criteria.items():
+
+            if session[f] not in (v if isinstance(v, (list, tuple, set))
+                                  else (v,)):
+
+                return None
+
+        return session
+
+    if processes == 1:
+
+        for relpath, mtime in jobs:
+
+            abspath = pj(data_dir, relpath)
+            session = finish(relpath, mtime, _read_or_skip(
+                abspath, _read_fields, (abspath, fields)))
+
+            if session is not None:
+
+                yield session
+
+        return
+
+    with ProcessPoolExecutor(processes) as pool:
+
+        pending = deque()
+
+        def finished(keep):
+
+            while len(pending) > keep:
+
+                relpath, mtime, future = pending.popleft()
+                session = finish(relpath, mtime, _read_or_skip(
+                    pj(data_dir, relpath), future.result))
+
+                if session is not None:
+
+                    yield session
+
+        for relpath, mtime in jobs:
+
+            job = (pj(data_dir, relpath), fields)
+            pending.append((relpath, mtime, pool.submit(_read_fields, job)))
+
+            yield from finished(2 * processes - 1)
+
+        yield from finished(0)
+
+
+def iter_rows(**kwargs):
+    """Iterate over the trials of all matching sessions, one dictionary per
+    trial, with the session details added to each. Takes the same arguments as
+    `iter_sessions`.
+
+    """
+    for session in iter_sessions(**kwargs):
+
+        meta = {k: session[k] for k in _meta}
+
+        for row in session['results']:
+
+            row.update(meta)
+
+            yield row
+
+
+def to_table(**kwargs):
+    """Collect the trials of all matching sessions into a single
+    `ResultsTable`, adding the session details as columns. Each session is
+    discarded once its columns have been appended. Takes the same arguments
+    as `iter_sessions`.
+
+    """
+    table = ResultsTable()
+
+    for session in iter_sessions(**kwargs):
+
+        table.append_table(session['results'], subj_id=session['subj_id'],
+                           exp_name=session['exp_name'],
+                           proj_id=session['proj_id'])
+
+    return table
+
+
+def to_dataframe(**kwargs):
+    """Like `to_table`, but returns a pandas DataFrame.
+
+    """
+    return to_table(**kwargs).to_dataframe()
+
+
+def to_csv(path, **kwargs):
+    """Stream the trials of all matching sessions into a CSV file without
+    holding them in memory. Takes the same arguments as `iter_sessions`.
+
+    The columns are `fields`, if given, followed by the session details.
+    Otherwise, they are every field recorded by any of the sessions, which
+    takes an extra pass over the files to find out; fields a trial did not
+    record are left empty.
+
+    Returns:
+        int: Number of trials written.
+
+    """
+    from csv import DictWriter
+
+    fields = kwargs.get('fields')
+
+    if fields is None:
+
+        names = {}
+
+        for session in iter_sessions(**kwargs):
+
+            names.update(dict.fromkeys(session['results'].columns))
+
+        fields = list(names)
+
+    n = 0
+
+    with open(path, 'w', newline='') as f:
+
+        columns = dict.fromkeys(list(fields) + list(_meta))
+        writer = DictWriter(f, list(columns), extrasaction='ignore')
+        writer.writeheader()
+
+        for row in iter_rows(**kwargs):
+
+            writer.writerow(row)
+            n += 1
 
+    return n
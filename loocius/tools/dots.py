@@ -0,0 +1,165 @@
+"""Random-dot kinematograms.
+
+"""
+import numpy as np
+from loocius.tools.profiling import traced
+
+
+class DotField:
+
+    def __init__(self, n, width, height, coherence=0.5, direction=0.,
+                 speed=120., lifetime=12, dot_size=3, resample=True,
+                 seed=None):
+        """Returns an instance of the `DotField` object.
+
+        A dot field is a random-dot kinematogram (RDK). On every frame, a
+        proportion of the dots (the coherence) moves in a common direction, and
+        the remaining (noise) dots each move in their own random direction.
+        Dots leaving the field wrap around to the opposite edge, and dots
+        reaching the end of their lifetime are replaced at a random position.
+
+        All dot properties are kept in flat NumPy arrays (one per property), so
+        each frame is updated with a handful of vectorised operations
+        regardless of the number of dots, and drawn into a single reusable
+        image buffer.
+
+        Args:
+            n (int): Number of dots.
+            width (int): Width of the field in pixels.
+            height (int): Height of the field in pixels.
+            coherence (:obj:`float`, optional): Proportion of coherent dots.
+                Defaults to 0.5.
+            direction (:obj:`float`, optional): Direction of coherent motion in
+                degrees; 0 is rightwards, 180 leftwards. Defaults to 0.
+            speed (:obj:`float`, optional): Dot speed in pixels per second.
+                Defaults to 120.
+            lifetime (:obj:`int`, optional): Dot lifetime in frames. Defaults
+                to 12.
+            dot_size (:obj:`int`, optional): Width/height of each dot in
+                pixels. Defaults to 3.
+            resample (:obj:`bool`, optional): Redraw which dots are coherent on
+                every frame, so that no single dot can be tracked. Defaults to
+                `True`.
+            seed (:obj:`int`, optional): Seed for the random number generator.
+
+        Returns:
+            DotField: The dot field.
+
+        """
+        self.n = n
+        self.width = width
+        self.height = height
+        self.coherence = coherence
+        self.direction = direction
+        self.speed = speed
+        self.lifetime = lifetime
+        self.dot_size = dot_size
+        self.resample = resample
+        self.foreground = 255
+        self.background = 0
+        self.rng = np.random.default_rng(seed)
+
+        # dot properties, one array each
+
+        self.x = np.empty(n, dtype='float32')
+        self.y = np.empty(n, dtype='float32')
+        self.life = np.empty(n, dtype='int16')
+        self.coherent = np.empty(n, dtype=bool)
+        self.noise_dx = np.empty(n, dtype='float32')
+        self.noise_dy = np.empty(n, dtype='float32')
+        self.respawn(np.arange(n))
+        self.life[:] = self.rng.integers(1, lifetime + 1, n)
+        self.assign()
+
+        # reusable frame buffer; rows are padded to 32 bits as Qt expects
+
+        self._stride = (width + 3) // 4 * 4
+        self.buffer = np.full((height, self._stride), self.background,
+                              dtype='uint8')
+        self._image = None
+        self._offsets = np.arange(dot_size)
+
+    def respawn(self, ix):
+        """Give the dots at indices `ix` a new position, a full lifetime and a
+        new noise direction.
+
+        """
+        k = len(ix)
+        self.x[ix] = self.rng.random(k, dtype='float32') * self.width
+        self.y[ix] = self.rng.random(k, dtype='float32') * self.height
+        self.life[ix] = self.lifetime
+        theta = self.rng.random(k, dtype='float32') * np.float32(2 * np.pi)
+        self.noise_dx[ix] = np.cos(theta)
+        self.noise_dy[ix] = np.sin(theta)
+
+    def assign(self):
+        """Draw which dots move coherently.
+
+        """
+        self.coherent[:] = self.rng.random(self.n) < self.coherence
+
+    @traced('dots.step')
+    def step(self, dt):
+        """Advance the field by one frame.
+
+        Args:
+            dt (float): Duration of the frame in seconds.
+
+        """
+        if self.resample:
+
+            self.assign()
+
+        theta = np.radians(self.direction)
+        d = np.float32(self.speed * dt)
+        dx = np.where(self.coherent, np.float32(np.cos(theta)), self.noise_dx)
+        dy = np.where(self.coherent, np.float32(-np.sin(theta)), self.noise_dy)
+        self.x += d * dx
+        self.y += d * dy
+
+        # wrap around the edges
+
+        np.mod(self.x, self.width, out=self.x)
+        np.mod(self.y, self.height, out=self.y)
+
+        # replace dots at the end of their lives
+
+        self.life -= 1
+        dead = np.flatnonzero(self.life <= 0)
+
+        if len(dead):
+
+            self.respawn(dead)
+
+    @traced('dots.render')
+    def render(self):
+        """Draw the current frame.
+
+        Returns:
+            QImage: An 8-bit greyscale image drawn on the field's buffer. It is
+                overwritten by the next call, so convert it (e.g., with
+                `QPixmap.fromImage`) or paint it before then.
+
+        """
+        buf = self.buffer
+        buf.fill(self.background)
+        xi = self.x.astype('intp')
+        yi = self.y.astype('intp')
+
+        for oy in self._offsets:
+
+            rows = np.minimum(yi + oy, self.height - 1)
+
+            for ox in self._offsets:
+
+                buf[rows, np.minimum(xi + ox, self.width - 1)] = \
+                    self.foreground
+
+        if self._image is None:
+
+            from PyQt5.QtGui import QImage
+
+            self._image = QImage(buf.data, self.width, self.height,
+                                 self._stride, QImage.Format_Grayscale8)
+
+        return self._image
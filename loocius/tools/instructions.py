@@ -1,31 +1,262 @@
 """Grabs written instructions.
 
 """
-from copy import copy
+import pickle
+from keyword import iskeyword
+from os import makedirs, replace, stat
+from os.path import dirname, isdir
+from string import Formatter
 from loocius.tools.paths import instructions_path, pj, listdir
 
 
-def read_instructions(exp_name, lang):
+_general = '__general__'
+_catalogs = {}
+
+
+class Template(str):
+    """An HTML instruction that compiles its `{field}` placeholders once.
+
+    A `Template` is a string, so it can be displayed or compared like one, but
+    its `.format()` method calls a function compiled from the template the
+    first time it is used, rather than parsing the template on every call.
+    Templates whose placeholders are not plain names (e.g., `{0}` or
+    `{a.b}`) are formatted by `str.format` as usual.
+
+    """
+
+    def __reduce__(self):
+
+        return Template, (str(self),)
+
+    def format(self, *args, **kwargs):
+
+        f = self.__dict__.get('_formatter', False)
+
+        if f is False:
+
+            f = self._formatter = self._compile()
+
+        if f is None or args:
+
+            return str.format(self, *args, **kwargs)
+
+        try:
+
+            return f(**kwargs)
+
+        except TypeError:
+
+            # let str.format raise the usual KeyError for a missing field
+
+            return str.format(self, **kwargs)
+
+    def _compile(self):
+        """Turn the template into an f-string function of its fields.
+
+        """
+        names = []
+
+        for _, name, spec, _ in Formatter().parse(self):
+
+            if name is None:
+
+                continue
+
+            if not name.isidentifier() or iskeyword(name) or \
+                    spec and '{' in spec:
+
+                return None
+
+            names.append(name)
+
+        # the catch-all for unused keyword arguments is named with more
+        # underscores than any field name has characters, so it can't clash
+
+        names = sorted(set(names))
+        rest = '_' * (max(map(len, names), default=0) + 1)
+        source = 'lambda %s: f%r' % (', '.join(names + ['**' + rest]),
+                                     str(self))
+
+        try:
+
+            return eval(source, {})
+
+        except SyntaxError:
+
+            return None
+
+
+def _read_dir(path, prefix=''):
+    """Read all HTML files in a directory into a dictionary of templates.
+
+    """
+    texts = {}
+
+    for f in listdir(path):
+
+        if f.endswith('.html'):
+
+            with open(pj(path, f), encoding='utf-8') as h:
+
+                texts[prefix % f[:-5] if prefix else f[:-5]] = \
+                    Template(h.read().rstrip())
+
+    return texts
+
+
+class InstructionCatalog:
+
+    def __init__(self, path=None, bundle=None):
+        """Returns an instance of the `InstructionCatalog` object.
+
+        A catalog holds the instructions of every experiment in every language,
+        read once and kept in memory, so widgets created later in a batch run
+        get theirs without touching the disk. Before serving the instructions
+        for an experiment, the catalog checks the modification times of the
+        directories involved and re-reads any that have changed.
+
+        A catalog can also be written to, and loaded from, a single bundle
+        file. A catalog loaded from a bundle is never re-read, which saves
+        listing and opening many small files on slow (e.g., network)
+        filesystems.
+
+        Args:
+            path (:obj:`str`, optional): Instructions directory. Defaults to
+                `loocius/instructions`.
+            bundle (:obj:`str`, optional): Path to a bundle file written by
+                `write_bundle`. If given, `path` is ignored.
+
+        Returns:
+            InstructionCatalog: The catalog.
+
+        """
+        self.path = path if path else instructions_path
+        self.frozen = bundle is not None
+        self.texts = {}
+        self.mtimes = {}
+
+        if self.frozen:
+
+            with open(bundle, 'rb') as f:
+
+                self.texts = pickle.load(f)
+
+        else:
+
+            self.load()
+
+    def load(self):
+        """Read every experiment and language.
+
+        """
+        for exp_name in listdir(self.path):
+
+            if not isdir(pj(self.path, exp_name)) or exp_name == '__pycache__':
+
+                continue
+
+            for lang in listdir(pj(self.path, exp_name)):
+
+                if isdir(pj(self.path, exp_name, lang)):
+
+                    self._load(exp_name, lang)
+
+    def _load(self, exp_name, lang):
+        """Read (or re-read) one experiment in one language.
+
+        """
+        path = pj(self.path, exp_name, lang)
+        mtime = stat(path).st_mtime_ns
+        prefix = '__%s__' if exp_name == _general else ''
+        self.texts[exp_name, lang] = _read_dir(path, prefix)
+        self.mtimes[exp_name, lang] = mtime
+
+    def _fresh(self, exp_name, lang):
+        """Return the instructions for one experiment and language, re-reading
+        them if their directory has changed.
+
+        """
+        key = (exp_name, lang)
+
+        if not self.frozen:
+
+            try:
+
+                mtime = stat(pj(self.path, exp_name, lang)).st_mtime_ns
+
+            except FileNotFoundError:
+
+                mtime = None
+
+            if mtime is not None and self.mtimes.get(key) != mtime:
+
+                self._load(exp_name, lang)
+
+        return self.texts[key]
+
+    def get(self, exp_name, lang):
+        """Return the instructions for an experiment in the given language,
+        together with the general instructions (keys such as `__continue__`).
+
+        Returns:
+            dict: Templates keyed by file name. The dictionary is new, so it can
+                be changed freely; the templates themselves are shared.
+
+        """
+        texts = dict(self._fresh(exp_name, lang))
+        texts.update(self._fresh(_general, lang))
+
+        return texts
+
+    def write_bundle(self, path):
+        """Write all instructions to a single bundle file. From the command
+        line: `python -m loocius.tools.instructions <path>`.
+
+        """
+        makedirs(dirname(path) or '.', exist_ok=True)
+
+        with open(path + '.tmp', 'wb') as f:
+
+            pickle.dump(self.texts, f, pickle.HIGHEST_PROTOCOL)
+
+        replace(path + '.tmp', path)
+
+
+def get_instruction_catalog(bundle=None):
+    """Return a shared `InstructionCatalog`, loading it if necessary.
+
+    """
+    if bundle not in _catalogs:
+
+        _catalogs[bundle] = InstructionCatalog(bundle=bundle)
+
+    return _catalogs[bundle]
+
+
+def read_instructions(exp_name, lang, bundle=None):
     """Grab all HTML-formatted instructions for a given experiment in the
     given language.
 
+    Instructions are served from a shared `InstructionCatalog`, so they are
+    only read from disk the first time (or after they have changed).
+
+    Args:
+        exp_name (str): Name of the experiment.
+        lang (str): Language, e.g., `'EN'`.
+        bundle (:obj:`str`, optional): Serve the instructions from this bundle
+            file instead of the instructions directory.
+
+    Returns:
+        dict: Templates keyed by file name. General instructions have keys of
+            the form `__name__`.
+
     """
 
-    path = pj(instructions_path, exp_name, lang)
-    html_files = [f for f in listdir(path) if '.html' in f]
-    keys = [f.replace('.html', '') for f in html_files]
-    paths = [pj(path, f) for f in html_files]
-    text = [open(p).read().rstrip() for p in paths]
-    a = {copy(k): copy(t) for k, t in zip(keys, text)}
+    return get_instruction_catalog(bundle).get(exp_name, lang)
+
 
-    path = pj(instructions_path, '__general__', lang)
-    html_files = [f for f in listdir(path) if '.html' in f]
-    keys = [f.replace('.html', '') for f in html_files]
-    keys = ['__%s__' % k for k in keys]
-    paths = [pj(path, f) for f in html_files]
-    text = [open(p).read().rstrip() for p in paths]
-    b = {copy(k): copy(t) for k, t in zip(keys, text)}
+if __name__ == '__main__':
 
-    a.update(b)
+    from sys import argv
 
-    return a
+    InstructionCatalog().write_bundle(argv[1])
@@ -2,9 +2,8 @@
 
 """
 import loocius
-from pkgutil import iter_modules
-from os import listdir
-from os.path import dirname, exists, join as pj
+from os import listdir, makedirs, replace
+from os.path import dirname, exists, getmtime, join as pj
 from importlib import import_module
 
 
@@ -14,16 +13,115 @@ stim_path = pj(loocius_path, 'stimuli')
 vis_stim_path = pj(stim_path, 'visual')
 aud_stim_path = pj(stim_path, 'audio')
 exp_path = pj(loocius_path, 'experiments')
-exp_list = [name for _, name, _ in iter_modules([exp_path])]
 instructions_path = pj(loocius_path, 'instructions')
+cache_path = pj(loocius_path, 'cache')
 icon_path = pj(vis_stim_path, 'icon', 'icon.png')
+registry_path = pj(cache_path, 'experiments.json')
+_registry = None
+
+
+def _describe(path):
+    """Return the title of an experiment (the first line of its docstring),
+    read from the source file without importing it.
+
+    """
+    import ast
+
+    with open(path, encoding='utf-8') as f:
+
+        doc = ast.get_docstring(ast.parse(f.read()))
+
+    return doc.splitlines()[0] if doc else ''
+
+
+def get_registry():
+    """Return metadata of all experiments as a dictionary of the form
+    `{name: {'title': title}}`.
+
+    The metadata are cached in a small registry file, which is rebuilt only
+    when the experiments directory has changed since it was written. Nothing
+    is imported, so checking experiment names on the command line is cheap.
+
+    """
+    global _registry
+
+    if _registry is not None:
+
+        return _registry['experiments']
+
+    import json
+
+    mtime = getmtime(exp_path)
+
+    if exists(registry_path):
+
+        with open(registry_path) as f:
+
+            registry = json.load(f)
+
+        if registry.get('mtime') == mtime:
+
+            _registry = registry
+
+            return registry['experiments']
+
+    # experiments are modules or packages in the experiments directory
+
+    sources = {}
+
+    for f in listdir(exp_path):
+
+        if f.startswith('_'):
+
+            continue
+
+        if f.endswith('.py'):
+
+            sources[f[:-3]] = pj(exp_path, f)
+
+        elif exists(pj(exp_path, f, '__init__.py')):
+
+            sources[f] = pj(exp_path, f, '__init__.py')
+
+    _registry = {
+        'mtime': mtime,
+        'experiments': {n: {'title': _describe(sources[n])} for n in
+                        sorted(sources)},
+    }
+
+    try:
+
+        makedirs(cache_path, exist_ok=True)
+
+        with open(registry_path + '.tmp', 'w') as f:
+
+            json.dump(_registry, f, indent=1)
+
+        replace(registry_path + '.tmp', registry_path)
+
+    except OSError:
+
+        pass  # read-only installation; the registry is rebuilt next time
+
+    return _registry['experiments']
+
+
+def __getattr__(name):
+
+    # `exp_list` used to be built when this module was imported
+
+    if name == 'exp_list':
+
+        return list(get_registry())
+
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 def is_experiment(s):
     """Returns True if `s` is an existing experiment.
 
     """
-    return s in exp_list
+    return s in get_registry()
 
 
 def find_experiments(s):
@@ -34,14 +132,16 @@ def find_experiments(s):
 
     if exists(s) is True:
 
-        exp_names = [i.rstrip() for i in open(s).readlines()]
+        with open(s) as f:
+
+            exp_names = [i.strip() for i in f if i.strip()]
 
     else:
 
         exp_names = s.split()
 
-    assert all(is_experiment(s) for s in
-               exp_names), 'one or more invalid experiment names'
+    invalid = [e for e in exp_names if not is_experiment(e)]
+    assert not invalid, 'invalid experiment names: %s' % ', '.join(invalid)
 
     return exp_names
 
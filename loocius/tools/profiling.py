@@ -0,0 +1,365 @@
+"""Profiling of experiments.
+
+When profiling is enabled (e.g., with the `--profile` option of `loocius.run`),
+the main methods of every experiment widget, and any other code wrapped in a
+`span` or decorated with `traced`, record how long they take. Spans are kept
+in a ring buffer and can be written to a Chrome trace file, which can be opened
+in `chrome://tracing`, Perfetto or speedscope:
+
+    with span('make stimuli'):
+        ...
+
+    @traced('dots.render')
+    def render(self):
+        ...
+
+Times are read from the monotonic nanosecond clock, even when the experiment
+runs in simulated time. When profiling is disabled, experiment widgets are not
+wrapped at all, and `span` and `traced` cost a single check.
+
+"""
+from itertools import count
+from os import makedirs
+from os.path import dirname
+from threading import enumerate as threads, get_ident
+from time import perf_counter_ns
+from types import FunctionType
+
+
+# `ExpWidget` methods that are always profiled, if the experiment has them;
+# public methods defined by the experiment itself are profiled too
+
+lifecycle = ('__init__', 'gen_control', 'setup', 'trial', 'display_message',
+             'hide_message', 'save', 'prepare', 'prefetch', 'take_prepared',
+             'keyPressEvent', 'mousePressEvent')
+
+_tracer = None
+
+
+class Tracer:
+
+    def __init__(self, size=65536):
+        """Returns an instance of the `Tracer` object.
+
+        A tracer keeps the last `size` spans in a ring buffer. Recording a span
+        takes no lock: each span claims a slot from a counter, whose increment
+        is atomic under the GIL, and stores a single tuple there.
+
+        Args:
+            size (:obj:`int`, optional): Number of spans to keep. Defaults to
+                65536.
+
+        Returns:
+            Tracer: The tracer.
+
+        """
+        self.size = size
+        self.t0 = perf_counter_ns()
+        self._buffer = [None] * size
+        self._counter = count()
+        self._n = 0
+
+    def record(self, name, t0, t1=None):
+        """Record a span.
+
+        Args:
+            name (str): Name of the span.
+            t0 (int): Start time, from `time.perf_counter_ns`.
+            t1 (:obj:`int`, optional): End time. Defaults to now.
+
+        """
+        if t1 is None:
+
+            t1 = perf_counter_ns()
+
+        i = next(self._counter)
+        self._buffer[i % self.size] = (name, get_ident(), t0, t1)
+        self._n = i + 1
+
+    def spans(self):
+        """Return the recorded spans, oldest first.
+
+        Returns:
+            list: `(name, thread, start, end)` tuples, times in ns.
+
+        """
+        n = self._n
+        i = n % self.size
+        spans = self._buffer[i:] + self._buffer[:i] if n > self.size else \
+            self._buffer[:n]
+
+        return sorted((s for s in spans if s is not None), key=lambda s: s[2])
+
+    @property
+    def dropped(self):
+        """Number of spans overwritten because the buffer was full.
+
+        """
+        return max(0, self._n - self.size)
+
+    def summary(self):
+        """Return the number of calls and the total time (ms) of every span.
+
+        """
+        totals = {}
+
+        for name, _, t0, t1 in self.spans():
+
+            n, total = totals.get(name, (0, 0.))
+            totals[name] = (n + 1, total + (t1 - t0) / 1e6)
+
+        return totals
+
+    def to_chrome(self, pid=1):
+        """Return the spans in the Chrome trace event format.
+
+        """
+        names = {t.ident: t.name for t in threads()}
+        events = []
+        tids = {}
+
+        for name, thread, t0, t1 in self.spans():
+
+            if thread not in tids:
+
+                tids[thread] = len(tids) + 1
+                events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                    'tid': tids[thread],
+                    'args': {'name': names.get(thread, 'thread %i' % thread)},
+                })
+
+            events.append({
+                'name': name, 'ph': 'X', 'pid': pid, 'tid': tids[thread],
+                'ts': (t0 - self.t0) / 1e3, 'dur': (t1 - t0) / 1e3,
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ns',
+                'otherData': {'dropped': self.dropped}}
+
+    def dump(self, path):
+        """Write the spans to a Chrome trace (JSON) file.
+
+        """
+        import json
+
+        makedirs(dirname(path) or '.', exist_ok=True)
+
+        with open(path, 'w') as f:
+
+            json.dump(self.to_chrome(), f)
+
+
+class _Span:
+
+    __slots__ = ('tracer', 'name', 't0')
+
+    def __init__(self, tracer, name):
+
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+
+        self.t0 = perf_counter_ns()
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.tracer.record(self.name, self.t0)
+
+
+class _NullSpan:
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        pass
+
+
+_null = _NullSpan()
+
+
+def enable(size=65536, tracer=None):
+    """Start profiling, with a new `Tracer`.
+
+    Args:
+        size (:obj:`int`, optional): Number of spans to keep. Defaults to
+            65536.
+        tracer (:obj:`Tracer`, optional): Use this tracer instead of a new one
+            (e.g., a subclass that does something with each span as it is
+            recorded).
+
+    Returns:
+        Tracer: The tracer.
+
+    """
+    global _tracer
+
+    _tracer = tracer if tracer is not None else Tracer(size)
+
+    return _tracer
+
+
+def disable():
+    """Stop profiling.
+
+    Returns:
+        Tracer: The tracer that was in use, if any.
+
+    """
+    global _tracer
+
+    tracer, _tracer = _tracer, None
+
+    return tracer
+
+
+def get_tracer():
+    """Return the `Tracer` in use, or `None` if profiling is disabled.
+
+    """
+    return _tracer
+
+
+def span(name):
+    """Return a context manager that records how long its block takes.
+
+    """
+    if _tracer is None:
+
+        return _null
+
+    return _Span(_tracer, name)
+
+
+def traced(name=None):
+    """Decorator that records how long each call of a function takes, when
+    profiling is enabled.
+
+    Args:
+        name (:obj:`str`, optional): Name of the spans. Defaults to the
+            qualified name of the function.
+
+    """
+
+    def decorate(func):
+
+        label = name if name else func.__qualname__
+
+        def wrapper(*args, **kwargs):
+
+            tracer = _tracer
+
+            if tracer is None:
+
+                return func(*args, **kwargs)
+
+            t0 = perf_counter_ns()
+
+            try:
+
+                return func(*args, **kwargs)
+
+            finally:
+
+                tracer.record(label, t0)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        wrapper.__doc__ = func.__doc__
+
+        return wrapper
+
+    return decorate
+
+
+def _wrap(method, label):
+    """Wrap a method so that its calls are recorded as spans.
+
+    """
+    from inspect import CO_VARARGS, CO_VARKEYWORDS
+
+    def call(self, *args, **kwargs):
+
+        tracer = _tracer
+
+        if tracer is None:
+
+            return method(self, *args, **kwargs)
+
+        t0 = perf_counter_ns()
+
+        try:
+
+            return method(self, *args, **kwargs)
+
+        finally:
+
+            tracer.record(label, t0)
+
+    def slot(self):
+
+        return call(self)
+
+    # methods without arguments are connected to signals such as
+    # `clicked(bool)`, and PyQt only drops the extra argument for slots that
+    # don't accept it
+
+    code = getattr(method, '__code__', None)
+    wrapper = slot if code and code.co_argcount == 1 and not \
+        code.co_flags & (CO_VARARGS | CO_VARKEYWORDS) else call
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+
+    return wrapper
+
+
+def instrument(cls, prefix=None, methods=None):
+    """Return a subclass of experiment widget `cls` whose methods record
+    spans.
+
+    Args:
+        cls (type): The `Experiment` class.
+        prefix (:obj:`str`, optional): Prefix of the span names, e.g., the
+            experiment's name. Defaults to the class name.
+        methods (:obj:`iterable`, optional): Names of the methods to profile.
+            Defaults to those in `lifecycle`, plus every public method that
+            the experiment defines itself.
+
+    Returns:
+        type: The subclass.
+
+    """
+    from loocius.tools.qt import ExpWidget
+
+    prefix = prefix if prefix else cls.__name__
+
+    if methods is None:
+
+        methods = set(lifecycle)
+
+        for klass in cls.__mro__:
+
+            if klass is ExpWidget:
+
+                break
+
+            methods.update(n for n, v in vars(klass).items() if not
+                           n.startswith('_') and isinstance(v, FunctionType))
+
+    wrapped = {}
+
+    for n in methods:
+
+        method = getattr(cls, n, None)
+
+        if isinstance(method, FunctionType):
+
+            wrapped[n] = _wrap(method, '%s.%s' % (prefix, n))
+
+    return type(cls.__name__, (cls,), wrapped)
@@ -1,20 +1,42 @@
 """General Qt elements.
 
 """
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from os.path import join as pj
+from loocius.tools import profiling
 from loocius.tools.data import Data
-from loocius.tools.paths import *
+from loocius.tools.paths import aud_stim_path, data_path, find_experiments, \
+    import_experiment, vis_stim_path
 from loocius.tools.argparser import get_parser
+from loocius.tools.clock import MonotonicClock
 from loocius.tools.instructions import read_instructions
-from PyQt5.QtCore import QTime
-from PyQt5.QtWidgets import *
+from PyQt5.QtCore import QEvent, QObject, Qt
+from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, \
+    QPushButton, QTextEdit, QWidget
+
+
+logger = logging.getLogger(__name__)
 
 
 class MainWindow(QMainWindow):
 
-    def __init__(self):
+    # when set, experiments skip drawing that only a person would look at
+    # (e.g., the frames of an animation); see `loocius.tools.simulate`
+
+    headless = False
+
+    def __init__(self, args=None, clock=None):
         """This is the very top-level instance for running an experiment or
-        experiments in loocius. Command-line arguments are read here.
+        experiments in loocius. Command-line arguments are read here, unless
+        they have already been parsed (e.g., by `loocius.run`).
+
+        Args:
+            args (:obj:`argparse.Namespace`, optional): Parsed arguments.
+            clock (:obj:`object`, optional): Clock used by the experiments
+                (see `loocius.tools.clock`). Defaults to a `MonotonicClock`,
+                i.e., real time with nanosecond resolution.
 
         """
 
@@ -22,11 +44,28 @@ class MainWindow(QMainWindow):
 
         # parse the command-line arguments
 
-        self.args = get_parser().parse_args()
+        self.args = args if args else get_parser().parse_args()
         self.subj_id = self.args.subj_id
-        self.exp_names = self.args.exp_names.split()
+        self.exp_names = find_experiments(self.args.exp_names)
         self.lang = self.args.lang
         self.proj_id = self.args.proj_id
+        self.data_dir = getattr(self.args, 'data_dir', None) or data_path
+        self.clock = clock if clock else MonotonicClock()
+        self.preloader = Preloader(self.subj_id, self.lang, self.args)
+
+        # profile the experiments if asked to; see `loocius.tools.profiling`
+
+        self.profile_path = getattr(self.args, 'profile', None)
+
+        if self.profile_path:
+
+            if self.profile_path is True:
+
+                stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+                self.profile_path = pj(self.data_dir, 'profiles',
+                                       '%s_%s.json' % (self.subj_id, stamp))
+
+            profiling.enable()
 
         # set default values, to be overwritten by specific experiments
 
@@ -53,9 +92,21 @@ class MainWindow(QMainWindow):
             # take an experiment from the experiment list
 
             self.exp_name = self.exp_names.pop(0)
-            widget = import_experiment(self.exp_name)
+            widget = self.preloader.experiment(self.exp_name)
+
+            if profiling.get_tracer() is not None:
+
+                widget = profiling.instrument(widget, self.exp_name)
+
             self.setCentralWidget(widget(self))
 
+            # get the next one ready while this one runs, unless it is the
+            # same experiment, whose data are still being written
+
+            if self.exp_names and self.exp_names[0] != self.exp_name:
+
+                self.preloader.preload(self.exp_names[0])
+
         else:
 
             # no more experiments
@@ -74,14 +125,175 @@ class MainWindow(QMainWindow):
 
         if reply == QMessageBox.Yes:
 
+            # make sure any journaled trials reach the disk
+
+            widget = self.centralWidget()
+
+            if isinstance(widget, ExpWidget):
+
+                widget.data_obj.close()
+
+            self.preloader.close()
+            self.dump_profile()
             event.accept()
         else:
 
             event.ignore()
 
+    def dump_profile(self):
+        """Write the profile, if profiling, and stop profiling.
+
+        """
+        tracer = profiling.disable() if self.profile_path else None
+
+        if tracer is not None:
+
+            tracer.dump(self.profile_path)
+            logger.info('profile written to %s', self.profile_path)
+
+
+class Preloader:
+
+    def __init__(self, subj_id, lang, args=None):
+        """Loads experiments in the background.
+
+        Constructing an experiment widget means importing the experiment,
+        reading its instructions, opening its data object, and loading its
+        stimuli, which can take long enough to leave the participant looking
+        at a frozen window between the experiments of a batch. A preloader
+        does all of this, except the parts that must happen on the GUI thread,
+        on a worker thread while the previous experiment is running, so that
+        the next one can start straight away.
+
+        Args:
+            subj_id (str): Subject ID.
+            lang (str): Language.
+            args (:obj:`argparse.Namespace`, optional): Command-line
+                arguments, for the project ID, the instruction bundle, the
+                data directory and the session server options.
+
+        """
+        self.subj_id = subj_id
+        self.lang = lang
+        self.args = args
+        self.futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def load(self, exp_name):
+        """Load everything an experiment needs before its widget is created.
+
+        Returns:
+            dict: The `Experiment` class (`cls`), the instructions
+                (`instructions`), the data object (`data_obj`), and whatever
+                the class's `preload` method returned (`preloaded`).
+
+        """
+        with profiling.span('preload %s' % exp_name):
+
+            return self._load(exp_name)
+
+    def _load(self, exp_name):
+
+        cls = import_experiment(exp_name)
+        server = getattr(self.args, 'server', None)
+        proj_id = getattr(self.args, 'proj_id', None) or None
+
+        # trials are journaled so that saving after each trial stays cheap,
+        # and sent to the session server if there is one
+
+        if server:
+
+            from loocius.tools.server import RemoteData
+
+            data_obj = RemoteData(self.subj_id, exp_name, server,
+                                  self.args.station, proj_id,
+                                  schema=cls.trial_schema)
+
+        else:
+
+            data_obj = Data(self.subj_id, exp_name, proj_id, journal=True,
+                            schema=cls.trial_schema,
+                            data_dir=getattr(self.args, 'data_dir', None))
+
+        return {
+            'cls': cls,
+            'instructions': read_instructions(
+                exp_name, self.lang, getattr(self.args, 'bundle', None)
+            ),
+            'data_obj': data_obj,
+            'preloaded': cls.preload(data_obj),
+        }
+
+    def preload(self, exp_name):
+        """Start loading an experiment in the background, unless it is
+        already being loaded.
+
+        """
+        if exp_name not in self.futures:
+
+            self.futures[exp_name] = self._executor.submit(self.load, exp_name)
+
+    def experiment(self, exp_name):
+        """Return the `Experiment` class of an experiment.
+
+        """
+        future = self.futures.get(exp_name)
+
+        if future is None:
+
+            return import_experiment(exp_name)
+
+        return future.result()['cls']
+
+    def take(self, exp_name):
+        """Return what was loaded for an experiment, waiting for it if
+        necessary, or load it now if it was never preloaded. Each preloaded
+        experiment can only be taken once.
+
+        """
+        future = self.futures.pop(exp_name, None)
+
+        if future is None:
+
+            return self.load(exp_name)
+
+        return future.result()
+
+    def close(self):
+        """Close the data objects of experiments that were preloaded but never
+        started (e.g., releasing their locks on a session server).
+
+        """
+        for future in self.futures.values():
+
+            if not future.cancel():
+
+                try:
+
+                    future.result()['data_obj'].close()
+
+                except Exception:
+
+                    # a preload that failed has nothing to close
+
+                    pass
+
+        self.futures = {}
+        self._executor.shutdown(wait=False)
+
 
 class ExpWidget(QWidget):
 
+    # keys a participant responds with, mapped to what they mean; simulated
+    # participants (see `loocius.tools.simulate`) press these, in this order
+
+    response_keys = {}
+
+    # fields of a trial and their types; experiments that declare them get
+    # their results stored as compact binary records (see `RecordTable`)
+
+    trial_schema = None
+
     def __init__(self, parent=None):
         """Base class for experiment widgets.
 
@@ -100,17 +312,18 @@ class ExpWidget(QWidget):
 
         # get some details from MainWindow
 
-        s_ = self.parent().subj_id
         e_ = self.parent().exp_name
-        l_ = self.parent().lang
-
-        # get a dictionary of written instructions
+        self.headless = self.parent().headless
 
-        self.instructions_dic = read_instructions(e_, l_)
+        # get a dictionary of written instructions and a data object, and
+        # anything returned by `preload`; these were usually loaded in the
+        # background while the previous experiment was running (see
+        # `Preloader`)
 
-        # open a data object
-
-        self.data_obj = Data(s_, e_)
+        resources = self.parent().preloader.take(e_)
+        self.instructions_dic = resources['instructions']
+        self.data_obj = resources['data_obj']
+        self.preloaded = resources['preloaded']
 
         # set default values
 
@@ -122,9 +335,21 @@ class ExpWidget(QWidget):
         self.iti = 2
         self.current_trial_details = None
 
-        # set up a timer
+        # stimuli for the next trial are prepared on a worker thread
+
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = None
 
-        self.exp_time = QTime()
+        # set up a timer; all timing goes through the clock, so that
+        # experiments can also run in simulated time
+
+        self.clock = self.parent().clock
+        self.exp_time = self.clock.stopwatch()
+
+        # key presses and clicks are timestamped as soon as they arrive, before
+        # any handler runs; see `InputCapture`
+
+        self.input = InputCapture(self, self.clock)
 
         # generate a control sequence, if not found in data object
 
@@ -151,6 +376,24 @@ class ExpWidget(QWidget):
         self.exp_time.start()
         self.show()
 
+    @classmethod
+    def preload(cls, data_obj):
+        """Override this method to load stimuli before the experiment starts.
+
+        In a batch, this is called on a worker thread while the previous
+        experiment is still running, so it must not create widgets or
+        QPixmaps (QImages are fine).
+
+        Args:
+            data_obj (Data): The experiment's data object.
+
+        Returns:
+            Whatever the experiment needs; available as `self.preloaded`.
+
+        """
+
+        return None
+
     def resize_window(self, resize_main_window=True):
         """Resize the current widget and optionally also the main window.
 
@@ -182,6 +425,98 @@ class ExpWidget(QWidget):
 
         raise Exception('Trial method not overridden.')
 
+    def signal(self, details):
+        """Override this method to let simulated participants respond to the
+        stimulus rather than at random.
+
+        Args:
+            details (dict): Details of the current trial.
+
+        Returns:
+            float: Signed strength of the evidence for the second response key
+                over the first (e.g., the coherence of the dots, negative for
+                leftward motion), or `None` if there is none.
+
+        """
+
+        return None
+
+    def prepare(self, details, key):
+        """Override this method to have stimuli prepared ahead of time.
+
+        Called with the details of an upcoming trial, on a worker thread while
+        the current trial is still running. It should compute everything the
+        trial needs (e.g., QImages, but not QPixmaps or widgets, which belong
+        to the GUI thread) and return it. It should not read the data object,
+        which the GUI thread may be changing; anything it needs from there
+        belongs in `prefetch_key`.
+
+        Args:
+            details (dict): Trial details from the control list.
+            key: What `prefetch_key` returned for the trial.
+
+        Returns:
+            Whatever the trial needs; passed back by `take_prepared`.
+
+        """
+
+        return None
+
+    def prefetch_key(self, details):
+        """Override this method for adaptive trials.
+
+        Returns everything that `prepare` depends on besides `details`, e.g.,
+        the current state of an adaptive staircase. The key is computed when
+        the trial is prefetched and again when it starts; if the two differ,
+        because the response to the current trial changed the state, the
+        prefetched stimuli are discarded and prepared again.
+
+        """
+
+        return None
+
+    def prefetch(self):
+        """Start preparing the next trial in the control list. Call this once
+        the response to the current trial has been saved (e.g., before the
+        inter-trial interval), so that the key is already up to date.
+
+        """
+        control = self.data_obj.control
+
+        if not control:
+
+            self._prefetched = None
+
+            return
+
+        details = dict(control[0])
+        key = self.prefetch_key(details)
+        future = self._prefetcher.submit(self.prepare, dict(details), key)
+        self._prefetched = (details, key, future)
+
+    def take_prepared(self, details):
+        """Return the prepared stimuli for the trial that is starting,
+        preparing them now if they were not prefetched or are out of date.
+
+        Args:
+            details (dict): Trial details, as popped from the control list.
+
+        """
+        prefetched, self._prefetched = self._prefetched, None
+        key = self.prefetch_key(details)
+
+        if prefetched is not None:
+
+            old_details, old_key, future = prefetched
+
+            if old_details == details and old_key == key:
+
+                return future.result()
+
+            future.cancel()
+
+        return self.prepare(details, key)
+
     def save(self):
 
         self.data_obj.save()
@@ -206,12 +541,24 @@ class ExpWidget(QWidget):
         self.message_area.insertHtml(content)
         self.message_area.setReadOnly(True)
         self.message_area.resize(self.w, self.h)
+        self.message_area.show()
+
+        # forget whatever the button was connected to last time
+
+        try:
+
+            self.cont_button.clicked.disconnect()
+
+        except TypeError:
+
+            pass
 
         self.cont_button.resize(self.cont_button.sizeHint())
         x = self.w // 2 - self.cont_button.size().width() // 2
         y = self.h - self.cont_button.size().height()
         self.cont_button.move(x, y)
         self.cont_button.clicked.connect(func)
+        self.cont_button.show()
         self.cont_button.setFocus()
 
     def hide_message(self):
@@ -222,6 +569,320 @@ class ExpWidget(QWidget):
         self.cont_button.hide()
 
 
+class InputCapture(QObject):
+
+    # kinds of event recorded, and their codes in the buffer
+
+    kinds = {
+        QEvent.KeyPress: 1, QEvent.KeyRelease: 2,
+        QEvent.MouseButtonPress: 3, QEvent.MouseButtonRelease: 4,
+    }
+
+    def __init__(self, parent, clock=None, size=1024):
+        """Timestamps key and mouse events as they arrive.
+
+        An `InputCapture` is an event filter on the whole application, so it
+        sees every key press, key release and mouse click before any widget
+        handles it. It reads the clock there and then (with nanosecond
+        resolution, unless the clock is virtual) and stores the time,
+        together with the event's own timestamp from the window system (in
+        milliseconds), in a ring buffer of the most recent `size` events.
+        Response times are then measured from the stimulus onset (see
+        `mark_onset`) to the time the response was captured, so they don't
+        depend on how long the handler took to run or what else the GUI
+        thread was doing.
+
+        Args:
+            parent (QObject): Owner, usually the experiment widget. Capture
+                stops when it is deleted.
+            clock (:obj:`object`, optional): Clock to read. Defaults to the
+                parent's clock.
+            size (:obj:`int`, optional): Number of events kept. Defaults to
+                1024.
+
+        """
+        import numpy as np
+
+        super(InputCapture, self).__init__(parent)
+        self.clock = clock if clock else getattr(parent, 'clock', None) or \
+            MonotonicClock()
+        self.buffer = np.zeros(size, dtype=[
+            ('t_ns', 'int64'), ('event_ms', 'int64'), ('kind', 'int8'),
+            ('code', 'int32'), ('repeat', 'bool'),
+        ])
+        self.n = 0
+        self.onset_ns = None
+        self._last = None
+        QApplication.instance().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+
+        kind = self.kinds.get(event.type())
+
+        if kind is None:
+
+            return False
+
+        t = self.clock.now_ns()
+
+        # an event is seen once for every object it is delivered to: events
+        # from the window system are recorded when they reach the window, and
+        # events sent by the programme (e.g., by a simulated participant) when
+        # they first reach a widget
+
+        if event.spontaneous():
+
+            if not obj.isWindowType():
+
+                return False
+
+        elif event is self._last:
+
+            return False
+
+        else:
+
+            self._last = event
+
+        if kind < 3:
+
+            code, repeat = event.key(), event.isAutoRepeat()
+
+        else:
+
+            code, repeat = int(event.button()), False
+
+        self.buffer[self.n % len(self.buffer)] = (t, event.timestamp(), kind,
+                                                  code, repeat)
+        self.n += 1
+
+        return False
+
+    def stop(self):
+        """Stop capturing events.
+
+        """
+        QApplication.instance().removeEventFilter(self)
+
+    def mark_onset(self, t_ns=None):
+        """Record the onset of the stimulus that the next response is to.
+
+        Call this once the stimulus has been drawn (e.g., after `repaint()`).
+
+        Args:
+            t_ns (:obj:`int`, optional): Onset in nanoseconds on the clock,
+                e.g., from `PresentationScheduler.log`. Defaults to now.
+
+        """
+        self.onset_ns = self.clock.now_ns() if t_ns is None else t_ns
+
+    def events(self, since=None):
+        """Return the captured events, oldest first.
+
+        Args:
+            since (:obj:`int`, optional): Only events at or after this time
+                (ns). Defaults to the last onset, if any.
+
+        Returns:
+            numpy.ndarray: Structured array with fields `t_ns`, `event_ms`,
+                `kind` (1: key press, 2: key release, 3: mouse press, 4: mouse
+                release), `code` (key or button) and `repeat`.
+
+        """
+        import numpy as np
+
+        size = len(self.buffer)
+        i = self.n % size
+        events = self.buffer[:self.n] if self.n <= size else \
+            np.concatenate([self.buffer[i:], self.buffer[:i]])
+        since = self.onset_ns if since is None else since
+
+        if since is not None:
+
+            events = events[events['t_ns'] >= since]
+
+        return events
+
+    def response(self, codes=None):
+        """Return the first key press or click since the onset.
+
+        Args:
+            codes (:obj:`iterable`, optional): Keys (`Qt.Key_*`) or mouse
+                buttons to consider. Defaults to any. Auto-repeats are always
+                ignored.
 
+        Returns:
+            dict: `code`, `t_ns` and `rt` (ms since the onset, as a float), or
+                `None` if there has been no response yet.
 
+        """
+        import numpy as np
+
+        events = self.events()
+        events = events[((events['kind'] == 1) | (events['kind'] == 3)) &
+                        ~events['repeat']]
+
+        if codes is not None:
+
+            events = events[np.isin(events['code'], list(codes))]
+
+        if not len(events) or self.onset_ns is None:
+
+            return None
+
+        e = events[0]
+
+        return {'code': int(e['code']), 't_ns': int(e['t_ns']),
+                'rt': (int(e['t_ns']) - self.onset_ns) / 1e6}
+
+    def attach(self, details, codes=None):
+        """Add the stimulus onset and the captured response to a trial record.
+
+        Sets `onset_ns`, `response_ns` and `rt` (in ms, as a float), if there
+        was a response.
+
+        Args:
+            details (dict): Trial details.
+            codes (:obj:`iterable`, optional): As for `response`.
+
+        Returns:
+            dict: The response, as from `response`.
+
+        """
+        r = self.response(codes)
+        details['onset_ns'] = self.onset_ns
+
+        if r is not None:
+
+            details['response_ns'] = r['t_ns']
+            details['rt'] = r['rt']
+
+        return r
+
+
+class PresentationScheduler(QObject):
+
+    def __init__(self, parent, frame_rate=None, spin=1.):
+        """Runs timelines of stimulus events with frame-level timing.
+
+        A timeline is a list of `(label, func, frames)` tuples: `func` is
+        called to change what is on screen (e.g., to show a mask) and the
+        change lasts for `frames` frames, after which the next event starts.
+        Onsets are computed up front from a single start time on the parent's
+        clock (a monotonic nanosecond clock, unless the experiment is running
+        in simulated time), so errors do not accumulate along the timeline as
+        they do with chained `QTimer.singleShot` calls. Each event is launched
+        by a precise timer that fires slightly early and then waits out the
+        last `spin` milliseconds on the clock.
+
+        The intended and actual onset of every event is logged. The actual
+        onset is read after `func` has returned and the parent widget has been
+        repainted, i.e., once the new image has been handed to the window
+        system.
+
+        Args:
+            parent (QWidget): Widget on which the stimuli are drawn.
+            frame_rate (:obj:`float`, optional): Refresh rate of the screen in
+                Hz. Defaults to the rate reported by the primary screen.
+            spin (:obj:`float`, optional): Milliseconds to wait actively before
+                each onset. Defaults to 1.
+
+        """
+        super(PresentationScheduler, self).__init__(parent)
+
+        if frame_rate is None:
+
+            screen = QApplication.primaryScreen()
+            frame_rate = screen.refreshRate() if screen else 60.
+
+        self.frame_rate = frame_rate if frame_rate > 0 else 60.
+        self.frame_ns = int(round(1e9 / self.frame_rate))
+        self.spin_ns = int(spin * 1e6)
+        self.log = []
+        self._events = []
+        self.clock = getattr(parent, 'clock', None) or MonotonicClock()
+        self._timer = self.clock.timer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._fire)
+
+    def frames(self, seconds):
+        """Convert a duration in seconds to a whole number of frames.
+
+        """
+        return int(round(seconds * self.frame_rate))
+
+    def run(self, timeline, delay=0, on_done=None):
+        """Start a timeline.
+
+        Args:
+            timeline (list): `(label, func, frames)` tuples.
+            delay (:obj:`float`, optional): Seconds until the first event.
+                Defaults to 0.
+            on_done (:obj:`function`, optional): Called when the last event
+                has lasted its number of frames.
+
+        """
+        self.stop()
+        self.log = []
+        onset = self.clock.now_ns() + int(delay * 1e9)
+        events = []
+
+        for label, func, frames in timeline:
+
+            events.append((onset, label, func))
+            onset += frames * self.frame_ns
+
+        events.append((onset, None, on_done))
+        self._events = events
+        self._schedule()
+
+    def stop(self):
+        """Cancel the rest of the current timeline.
+
+        """
+        self._timer.stop()
+        self._events = []
+
+    def _schedule(self):
+
+        if self._events:
+
+            wait = self._events[0][0] - self.clock.now_ns() - self.spin_ns
+            self._timer.start(max(0, wait // 1000000))
+
+    def _fire(self):
+
+        intended, label, func = self._events.pop(0)
+
+        self.clock.wait_until(intended)
+
+        if label is None:
+
+            self._events = []
+
+            if func is not None:
+
+                func()
+
+            return
+
+        func()
+
+        if not getattr(self.parent(), 'headless', False):
+
+            self.parent().repaint()
+
+        actual = self.clock.now_ns()
+        self.log.append({'label': label, 'intended': intended,
+                         'actual': actual,
+                         'error': (actual - intended) / 1e6})
+        self._schedule()
+
+    def timing_errors(self):
+        """Return the onset errors of the last timeline in milliseconds, by
+        event label.
+
+        """
+        return {e['label']: e['error'] for e in self.log}
 
@@ -0,0 +1,804 @@
+"""Columnar storage for trial results.
+
+"""
+from array import array
+from numbers import Integral, Real
+
+
+_typecodes = {bool: 'b', int: 'q', float: 'd'}
+_dtypes = {'b': 'bool', 'q': 'int64', 'd': 'float64'}
+
+# how `RecordTable` fields are converted into `ResultsTable` columns
+
+_encodings = {
+    's': ('i', 'int%i' % (array('i').itemsize * 8)), 'b': ('b', 'int8'),
+    'i': ('q', 'int64'), 'u': ('q', 'int64'), 'f': ('d', 'float64'),
+}
+
+
+class Column:
+
+    def __init__(self, kind, n_missing=0):
+        """A single field of a `ResultsTable`.
+
+        Args:
+            kind (str): One of `'b'` (bool), `'q'` (int), `'d'` (float), `'s'`
+                (string, stored as codes into the table's string table), or
+                `'o'` (anything else, stored in a list).
+            n_missing (:obj:`int`, optional): Number of rows before this column
+                was created. Defaults to 0.
+
+        """
+        self.kind = kind
+
+        if kind == 'o':
+
+            self.values = [None] * n_missing
+
+        elif kind == 's':
+
+            self.values = array('i', [-1] * n_missing)
+
+        else:
+
+            assert n_missing == 0, 'only object columns can be backfilled'
+            self.values = array(kind)
+
+    def to_object(self, strings):
+        """Convert to an object column, e.g., when a value of a different type
+        or a missing value turns up.
+
+        """
+        if self.kind == 's':
+
+            self.values = [None if c < 0 else strings[c] for c in self.values]
+
+        elif self.kind == 'b':
+
+            self.values = [bool(v) for v in self.values]
+
+        else:
+
+            self.values = self.values.tolist()
+
+        self.kind = 'o'
+
+
+class ResultsTable:
+
+    def __init__(self, rows=()):
+        """Returns a `ResultsTable`.
+
+        A drop-in replacement for the list of dictionaries in `Data.results`
+        that stores each field in its own typed array. Strings (e.g., `stim`,
+        `mode`, or `condition`) are stored once in a shared string table and
+        referred to by integer codes. Experiments append and read trials as
+        dictionaries exactly as before; analysis code can instead take the
+        columns as NumPy arrays or a DataFrame without copying them.
+
+        Notes:
+            Values are copied on `.append()`, so changing a dictionary after it
+                has been appended does not change the table.
+            Fields missing from a trial are read back as `None`.
+
+        Args:
+            rows (:obj:`iterable`, optional): Trial dictionaries to start with.
+
+        Returns:
+            ResultsTable: The table.
+
+        """
+        self.columns = {}
+        self.strings = []
+        self._codes = {}
+        self._n = 0
+        self.extend(rows)
+
+    def __len__(self):
+
+        return self._n
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+
+            return [self._row(j) for j in range(*i.indices(self._n))]
+
+        if i < 0:
+
+            i += self._n
+
+        if not 0 <= i < self._n:
+
+            raise IndexError('row index out of range')
+
+        return self._row(i)
+
+    def __iter__(self):
+
+        return (self._row(i) for i in range(self._n))
+
+    def __eq__(self, other):
+
+        if isinstance(other, (list, ResultsTable)):
+
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+
+        return NotImplemented
+
+    def __repr__(self):
+
+        return 'ResultsTable(%i rows, fields=%s)' % (
+            self._n, list(self.columns)
+        )
+
+    def __getstate__(self):
+
+        return {
+            'columns': {f: (c.kind, c.values) for f, c in
+                        self.columns.items()},
+            'strings': self.strings,
+            'n': self._n,
+        }
+
+    def __setstate__(self, state):
+
+        self.columns = {}
+
+        for f, (kind, values) in state['columns'].items():
+
+            c = Column.__new__(Column)
+            c.kind, c.values = kind, values
+            self.columns[f] = c
+
+        self.strings = state['strings']
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+        self._n = state['n']
+
+    def _intern(self, s):
+        """Return the code for string `s`, adding it to the table if necessary.
+
+        """
+        code = self._codes.get(s)
+
+        if code is None:
+
+            code = self._codes[s] = len(self.strings)
+            self.strings.append(s)
+
+        return code
+
+    def _row(self, i):
+        """Rebuild the dictionary for row `i`.
+
+        """
+        row = {}
+
+        for f, c in self.columns.items():
+
+            v = c.values[i]
+
+            if c.kind == 's':
+
+                v = None if v < 0 else self.strings[v]
+
+            elif c.kind == 'b':
+
+                v = bool(v)
+
+            row[f] = v
+
+        return row
+
+    def _new_column(self, v):
+        """Make a column whose type suits the value `v`.
+
+        """
+        if self._n:
+
+            # earlier rows did not have this field
+
+            return Column('s' if isinstance(v, str) else 'o', self._n)
+
+        if isinstance(v, str):
+
+            return Column('s')
+
+        return Column(_typecodes.get(type(v), 'o'))
+
+    def append(self, trial):
+        """Append a trial.
+
+        Args:
+            trial (dict): Trial details and results.
+
+        """
+        for f, v in trial.items():
+
+            if f not in self.columns:
+
+                self.columns[f] = self._new_column(v)
+
+        for f, c in self.columns.items():
+
+            v = trial.get(f)
+            kind = c.kind
+
+            if kind == 'o':
+
+                c.values.append(v)
+
+            elif kind == 's' and (v is None or isinstance(v, str)):
+
+                c.values.append(-1 if v is None else self._intern(v))
+
+            elif kind == 'b' and type(v) is bool or \
+                    kind == 'q' and type(v) is int or \
+                    kind == 'd' and type(v) in (int, float):
+
+                c.values.append(v)
+
+            elif type(v) is float and kind == 'q':
+
+                # promote integer column to float
+
+                c.values = array('d', c.values)
+                c.kind = 'd'
+                c.values.append(v)
+
+            else:
+
+                c.to_object(self.strings)
+                c.values.append(v)
+
+        self._n += 1
+
+    def extend(self, trials):
+        """Append several trials.
+
+        """
+        for trial in trials:
+
+            self.append(trial)
+
+    def column(self, field):
+        """Return a field as a NumPy array. String fields are integer codes.
+
+        Typed columns are returned as views onto the underlying buffers, so no
+        data are copied. Don't append to the table while holding a view.
+
+        Args:
+            field (str): Name of the field.
+
+        Returns:
+            numpy.ndarray: Values of the field.
+
+        """
+        import numpy as np
+
+        c = self.columns[field]
+
+        if c.kind == 'o':
+
+            # filled element by element, so that values which are sequences
+            # themselves (e.g., tuples) stay one value each
+
+            a = np.empty(len(c.values), dtype=object)
+
+            for i, v in enumerate(c.values):
+
+                a[i] = v
+
+            return a
+
+        if c.kind == 's':
+
+            return np.frombuffer(c.values, dtype='int%i' % (
+                c.values.itemsize * 8))
+
+        return np.frombuffer(c.values, dtype=_dtypes[c.kind])
+
+    def to_numpy(self):
+        """Return all fields as a dictionary of NumPy arrays. String fields are
+        returned as integer codes into `self.strings`.
+
+        """
+        return {f: self.column(f) for f in self.columns}
+
+    def to_dataframe(self):
+        """Return the table as a pandas DataFrame. String fields become
+        categoricals whose categories are the table's string table.
+
+        """
+        import pandas as pd
+
+        data = {}
+
+        for f, c in self.columns.items():
+
+            if c.kind == 's':
+
+                data[f] = pd.Categorical.from_codes(
+                    self.column(f), categories=self.strings
+                )
+
+            else:
+
+                data[f] = self.column(f)
+
+        return pd.DataFrame(data, copy=False)
+
+    @classmethod
+    def concat(cls, tables, **constants):
+        """Concatenate several tables into one without rebuilding dictionaries.
+
+        Args:
+            tables (iterable): `ResultsTable` objects or lists of dictionaries.
+
+        Kwargs:
+            Fields to add to every row of each table, given as iterables with
+                one value per table (e.g., `subj_id=['a', 'b']`).
+
+        Returns:
+            ResultsTable: The combined table.
+
+        """
+        out = cls()
+        constants = {f: iter(v) for f, v in constants.items()}
+
+        for table in tables:
+
+            extra = {f: next(v) for f, v in constants.items()}
+            out.append_table(table, **extra)
+
+        return out
+
+    def append_table(self, table, **extra):
+        """Append all rows of another table.
+
+        Args:
+            table (ResultsTable): The table, or a list of dictionaries.
+
+        Kwargs:
+            Fields to add to every appended row, with their (constant) values.
+
+        """
+        if not isinstance(table, ResultsTable):
+
+            table = ResultsTable(table)
+
+        n = len(table)
+        fields = list(table.columns) + [f for f in extra if f not in
+                                        table.columns]
+
+        for f in fields:
+
+            if f not in self.columns:
+
+                if f in table.columns:
+
+                    kind = table.columns[f].kind
+
+                else:
+
+                    kind = 's' if isinstance(extra[f], str) else 'o'
+
+                kind = kind if not self._n or kind in 'so' else 'o'
+                self.columns[f] = Column(kind, self._n if kind in 'so' else 0)
+
+        for f, c in self.columns.items():
+
+            src = table.columns.get(f)
+
+            if src is None:
+
+                v = extra.get(f)
+
+                if c.kind == 's' and (v is None or isinstance(v, str)):
+
+                    c.values.extend(array('i', [-1 if v is None else
+                                                self._intern(v)]) * n)
+
+                else:
+
+                    if c.kind != 'o':
+
+                        c.to_object(self.strings)
+
+                    c.values.extend([v] * n)
+
+            elif src.kind == c.kind == 's':
+
+                remap = [self._intern(s) for s in table.strings]
+                c.values.extend(array('i', [-1 if v < 0 else remap[v] for v
+                                            in src.values]))
+
+            elif src.kind == c.kind and c.kind != 'o':
+
+                c.values.extend(src.values)
+
+            else:
+
+                if c.kind != 'o':
+
+                    c.to_object(self.strings)
+
+                c.values.extend(r[f] for r in table)
+
+        self._n += n
+
+    def write(self, path):
+        """Write the table to a columnar file for analysis. The format is taken
+        from the file extension: `.parquet`, `.feather` or `.csv`.
+
+        """
+        df = self.to_dataframe()
+
+        if path.endswith('.parquet'):
+
+            df.to_parquet(path)
+
+        elif path.endswith('.feather'):
+
+            df.to_feather(path)
+
+        else:
+
+            df.to_csv(path, index=False)
+
+
+class RecordTable:
+
+    def __init__(self, schema, rows=()):
+        """Returns a `RecordTable`.
+
+        Like `ResultsTable`, a drop-in replacement for the list of dictionaries
+        in `Data.results`, but for experiments that declare their fields in
+        advance (see `ExpWidget.trial_schema`). Each trial is stored as one
+        fixed-width row of a NumPy structured array, and strings are stored
+        once in a string table and referred to by integer codes, so no field
+        name is stored more than once. Session files keep the array as raw
+        bytes, which makes them several times smaller than pickled
+        dictionaries and lets analysis code memory-map them (see
+        `loocius.tools.data.read_session`).
+
+        Notes:
+            Values are converted to the declared type, so e.g. a float stored
+                in a `'float32'` field is read back rounded to single
+                precision.
+            Values that don't fit their field (e.g., `None`, a float in an
+                integer field, or a number out of range), and fields that are
+                not in the schema, are kept in `self.extras`, so nothing is
+                lost.
+            Fields missing from a trial are read back as `None`.
+
+        Args:
+            schema (dict): Field names and their types. A type is a NumPy
+                dtype (e.g., `'int16'`, `'float32'`, `'bool'`), `'str'` for
+                strings, or a tuple such as `('int16', 2)` for a tuple of fixed
+                length.
+            rows (:obj:`iterable`, optional): Trial dictionaries to start with.
+
+        Returns:
+            RecordTable: The table.
+
+        """
+        import numpy as np
+
+        self.schema = dict(schema)
+        self.strings = []
+        self.extras = {}
+        self._codes = {}
+        self._n = 0
+        self._layout()
+        self._array = np.zeros(0, self.dtype)
+        self.extend(rows)
+
+    def _layout(self):
+        """Work out the dtype of the rows and how each field is encoded.
+
+        """
+        import numpy as np
+
+        spec = []
+        self._fields = {}
+
+        for f, t in self.schema.items():
+
+            if t == 'str':
+
+                spec.append((f, 'int32'))
+                self._fields[f] = ('s', None)
+
+                continue
+
+            dt = np.dtype(t[0] if isinstance(t, tuple) else t)
+
+            if dt.kind not in 'biuf':
+
+                raise ValueError('unsupported type %r for field %s' % (t, f))
+
+            info = np.iinfo(dt) if dt.kind in 'iu' else None
+
+            # tuple fields are checked element by element, like scalar fields
+            # of the same type
+
+            if isinstance(t, tuple):
+
+                spec.append((f, dt, t[1]))
+                self._fields[f] = ('a', (t[1], dt.kind, info))
+
+            else:
+
+                spec.append((f, dt))
+                self._fields[f] = (dt.kind, info)
+
+        self.dtype = np.dtype(spec)
+        self._strs = [f for f, (k, _) in self._fields.items() if k == 's']
+        self._subs = [f for f, (k, _) in self._fields.items() if k == 'a']
+
+    def __len__(self):
+
+        return self._n
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+
+            return [self._row(j) for j in range(*i.indices(self._n))]
+
+        if i < 0:
+
+            i += self._n
+
+        if not 0 <= i < self._n:
+
+            raise IndexError('row index out of range')
+
+        return self._row(i)
+
+    def __iter__(self):
+
+        return (self._row(i) for i in range(self._n))
+
+    def __eq__(self, other):
+
+        if isinstance(other, (list, ResultsTable, RecordTable)):
+
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+
+        return NotImplemented
+
+    def __repr__(self):
+
+        return 'RecordTable(%i rows, fields=%s)' % (self._n, list(self.schema))
+
+    def __getstate__(self):
+
+        # the rows are pickled as a single array, which is written to session
+        # files out of band (see `write_checkpoint`)
+
+        return {
+            'schema': self.schema,
+            'records': self.records,
+            'strings': self.strings,
+            'extras': self.extras,
+        }
+
+    def __setstate__(self, state):
+
+        self.schema = state['schema']
+        self._layout()
+        self.strings = state['strings']
+        self.extras = state['extras']
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+        self._array = state['records']
+        self._n = len(self._array)
+
+    @property
+    def records(self):
+        """The rows as a structured array (a view, not a copy). String fields
+        are integer codes into `self.strings`, or -1 if missing.
+
+        """
+        return self._array[:self._n]
+
+    def _intern(self, s):
+        """Return the code for string `s`, adding it to the table if necessary.
+
+        """
+        code = self._codes.get(s)
+
+        if code is None:
+
+            code = self._codes[s] = len(self.strings)
+            self.strings.append(s)
+
+        return code
+
+    def _encode(self, kind, info, v):
+        """Return `v` as it is stored in a field, or `None` if it doesn't fit.
+
+        """
+        if kind == 's':
+
+            return self._intern(v) if isinstance(v, str) else None
+
+        if kind == 'b':
+
+            return v if isinstance(v, bool) else None
+
+        if kind == 'a':
+
+            n, kind, info = info
+
+            return v if isinstance(v, tuple) and len(v) == n and all(
+                self._encode(kind, info, x) is not None for x in v) else None
+
+        if isinstance(v, bool) or not isinstance(v, Real):
+
+            return None
+
+        if kind == 'f':
+
+            return v
+
+        if not isinstance(v, Integral) or not info.min <= v <= info.max:
+
+            return None
+
+        return v
+
+    def _row(self, i):
+        """Rebuild the dictionary for row `i`.
+
+        """
+        row = dict(zip(self.schema, self._array[i].tolist()))
+
+        for f in self._strs:
+
+            c = row[f]
+            row[f] = None if c < 0 else self.strings[c]
+
+        for f in self._subs:
+
+            row[f] = tuple(row[f].tolist())
+
+        extra = self.extras.get(i)
+
+        if extra:
+
+            row.update(extra)
+
+        return row
+
+    def _grow(self):
+        """Make room for more rows. Also copies rows that are read-only, e.g.,
+        because they were loaded from a file.
+
+        """
+        import numpy as np
+
+        array = np.zeros(max(16, 2 * self._n), self.dtype)
+        array[:self._n] = self._array[:self._n]
+        self._array = array
+
+    def append(self, trial):
+        """Append a trial.
+
+        Args:
+            trial (dict): Trial details and results.
+
+        """
+        i = self._n
+
+        if i == len(self._array) or not self._array.flags.writeable:
+
+            self._grow()
+
+        values = []
+        extra = {}
+
+        for f, (kind, info) in self._fields.items():
+
+            v = trial.get(f)
+            code = self._encode(kind, info, v)
+
+            if code is None:
+
+                code = -1 if kind == 's' else 0
+
+                if v is not None or kind != 's':
+
+                    extra[f] = v
+
+            values.append(code)
+
+        for f, v in trial.items():
+
+            if f not in self._fields:
+
+                extra[f] = v
+
+        self._array[i] = tuple(values)
+
+        if extra:
+
+            self.extras[i] = extra
+
+        self._n += 1
+
+    def extend(self, trials):
+        """Append several trials.
+
+        """
+        for trial in trials:
+
+            self.append(trial)
+
+    def column(self, field):
+        """Return a field as a NumPy array (a view, not a copy). String fields
+        are integer codes. Values kept in `self.extras` are not included.
+
+        """
+        return self.records[field]
+
+    def to_numpy(self):
+        """Return all fields as a dictionary of NumPy arrays. String fields are
+        returned as integer codes into `self.strings`.
+
+        """
+        return {f: self.column(f) for f in self.schema}
+
+    def to_table(self, fields=None):
+        """Convert to a `ResultsTable`, column by column where possible.
+
+        Args:
+            fields (:obj:`list`, optional): Fields to keep. Defaults to all.
+
+        Returns:
+            ResultsTable: The table.
+
+        """
+        fields = list(self.schema) if fields is None else fields
+
+        if any(f not in self.schema for f in fields) or any(
+                f in e for e in self.extras.values() for f in fields):
+
+            return ResultsTable({f: r.get(f) for f in fields} for r in self)
+
+        table = ResultsTable()
+        table.strings = list(self.strings)
+        table._codes = dict(self._codes)
+        table._n = self._n
+
+        for f in fields:
+
+            kind = self._fields[f][0]
+            values = self.column(f)
+
+            if kind == 'a':
+
+                c = Column('o')
+                c.values = [tuple(v) for v in values.tolist()]
+
+            else:
+
+                code, dtype = _encodings[kind]
+                c = Column(code)
+                c.values.frombytes(values.astype(dtype).tobytes())
+
+            table.columns[f] = c
+
+        return table
+
+    def to_dataframe(self):
+        """Return the table as a pandas DataFrame. See
+        `ResultsTable.to_dataframe`.
+
+        """
+        return self.to_table().to_dataframe()
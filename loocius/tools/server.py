@@ -0,0 +1,587 @@
+"""Session server for many testing stations.
+
+By default, every station saves its sessions into its own data directory. With
+a session server, stations instead send their sessions to one process, which
+saves them into a single data directory and makes sure that no subject runs
+the same experiment on two stations at once.
+
+Start the server on the machine that holds the data:
+
+    python -m loocius.tools.server [address] [data directory]
+
+and point the stations at it:
+
+    python -m loocius.run -s S01 -e rdm --server [address] --station booth1
+
+An address is either the path of a Unix socket (the default, `server.sock` in
+the data directory) or `host:port` for TCP. The server accepts pickled
+messages, so it must only be reachable by trusted stations: keep TCP servers
+on the loopback interface or a private network.
+
+"""
+import socket
+import socketserver
+from os import makedirs, remove
+from os.path import exists, join as pj
+from struct import Struct
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from loocius.tools.data import Data, session_exists
+from loocius.tools.paths import data_path
+
+
+_length = Struct('<I')
+_clients = {}
+
+
+def default_address(data_dir=None):
+    """Address of the server if none is given.
+
+    """
+    if hasattr(socket, 'AF_UNIX'):
+
+        return pj(data_dir if data_dir else data_path, 'server.sock')
+
+    return '127.0.0.1:5151'
+
+
+def _parse(address):
+    """Return the socket family and address for an address string.
+
+    """
+    host, sep, port = address.rpartition(':')
+
+    if sep and port.isdigit() and '/' not in address and '\\' not in address:
+
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+    return socket.AF_UNIX, address
+
+
+def send_message(sock, obj):
+    """Send a pickled object, preceded by its length.
+
+    """
+    payload = dumps(obj, HIGHEST_PROTOCOL)
+    sock.sendall(_length.pack(len(payload)) + payload)
+
+
+def recv_message(f):
+    """Receive an object sent by `send_message`.
+
+    Args:
+        f (file): The socket, opened as a binary file.
+
+    Returns:
+        object: The object, or `None` if the connection was closed.
+
+    """
+    head = f.read(_length.size)
+
+    if len(head) < _length.size:
+
+        return None
+
+    n, = _length.unpack(head)
+    payload = f.read(n)
+
+    if len(payload) < n:
+
+        return None
+
+    return loads(payload)
+
+
+class Session:
+
+    def __init__(self, data_obj, station):
+        """A session locked by a station.
+
+        """
+        self.data_obj = data_obj
+        self.station = station
+        self.lock = Lock()
+        self.expires = None
+
+
+class SessionServer:
+
+    def __init__(self, lease=600., data_dir=None):
+        """Returns an instance of the `SessionServer` object.
+
+        The server keeps a journaled `Data` object for each session that is
+        currently locked by a station. Stations send checkpoints of their
+        sessions and batches of journal records, which are saved exactly as if
+        the experiment were running on the server, so the data directory looks
+        the same as always.
+
+        A station locks a subject and experiment when it opens the session.
+        Another station asking for the same lock is refused until the lock is
+        released, or until it has not been used for `lease` seconds (e.g.,
+        because the station crashed). The station that holds the lock can
+        always take it again.
+
+        Args:
+            lease (:obj:`float`, optional): Seconds after which an unused lock
+                expires. Defaults to 600.
+            data_dir (:obj:`str`, optional): Directory to save sessions in.
+                Defaults to the data directory.
+
+        Returns:
+            SessionServer: The server.
+
+        """
+        self.lease = lease
+        self.data_dir = data_dir if data_dir else data_path
+        self.sessions = {}
+        self.locks = {}
+        self._lock = Lock()
+
+    def handle(self, request):
+        """Carry out one request.
+
+        Args:
+            request (tuple): Name of the operation, and its arguments.
+
+        Returns:
+            tuple: `('ok', result)` or `('error', message)`.
+
+        """
+        op, args = request[0], request[1:]
+
+        try:
+
+            if op not in ('ping', 'lock', 'checkpoint', 'append', 'release'):
+
+                raise ValueError('unknown operation %r' % op)
+
+            return 'ok', getattr(self, op)(*args)
+
+        except Exception as e:
+
+            return 'error', '%s: %s' % (type(e).__name__, e)
+
+    def ping(self):
+
+        return 'pong'
+
+    def lock(self, subj_id, exp_name, station, proj_id=None, schema=None):
+        """Lock a session for a station and open it.
+
+        Returns:
+            tuple: A token for the other operations, and the session as a
+                dictionary, or `None` if it is new.
+
+        """
+        key = (subj_id, exp_name)
+
+        with self._lock:
+
+            token = self.locks.get(key)
+            session = self.sessions.get(token)
+
+            if session is not None:
+
+                if session.station != station and \
+                        monotonic() < session.expires:
+
+                    raise RuntimeError('%s is already running %s on station '
+                                       '%s' % (subj_id, exp_name,
+                                               session.station))
+
+                self._close(token)
+
+            data_obj = Data(subj_id, exp_name, proj_id, journal=True,
+                            schema=schema, data_dir=self.data_dir)
+            token = uuid4().hex
+            session = self.sessions[token] = Session(data_obj, station)
+            session.expires = monotonic() + self.lease
+            self.locks[key] = token
+
+        return token, data_obj.dic if session_exists(data_obj.abspath) \
+            else None
+
+    def _session(self, token):
+        """Return a locked session and renew its lease.
+
+        """
+        session = self.sessions.get(token)
+
+        if session is None:
+
+            raise RuntimeError('the session is no longer locked')
+
+        session.expires = monotonic() + self.lease
+
+        return session
+
+    def checkpoint(self, token, dic):
+        """Replace a session with a full copy sent by its station.
+
+        """
+        session = self._session(token)
+
+        with session.lock:
+
+            session.data_obj.restore(dic)
+            session.data_obj._write()
+
+    def append(self, token, records):
+        """Journal a batch of records sent by a station.
+
+        """
+        session = self._session(token)
+
+        with session.lock:
+
+            session.data_obj.apply(records)
+
+    def release(self, token):
+        """Close a session and release its lock.
+
+        """
+        with self._lock:
+
+            self._close(token)
+
+    def _close(self, token):
+
+        session = self.sessions.pop(token, None)
+
+        if session is not None:
+
+            with session.lock:
+
+                session.data_obj.close()
+
+            key = (session.data_obj.subj_id, session.data_obj.exp_name)
+
+            if self.locks.get(key) == token:
+
+                del self.locks[key]
+
+    def close(self):
+        """Close all sessions.
+
+        """
+        with self._lock:
+
+            for token in list(self.sessions):
+
+                self._close(token)
+
+    def make_server(self, address=None):
+        """Return a `socketserver` server, with one thread per connection,
+        that passes requests on to this object. Call its `serve_forever()`
+        method to run it.
+
+        """
+        family, address = _parse(address if address else
+                                 default_address(self.data_dir))
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+
+                while True:
+
+                    request = recv_message(self.rfile)
+
+                    if request is None:
+
+                        break
+
+                    send_message(self.request, owner.handle(request))
+
+        if family == socket.AF_INET:
+
+            server = socketserver.ThreadingTCPServer(address, Handler, False)
+            server.allow_reuse_address = True
+
+        else:
+
+            if exists(address):
+
+                remove(address)
+
+            server = socketserver.ThreadingUnixStreamServer(address, Handler,
+                                                            False)
+
+        server.daemon_threads = True
+        server.server_bind()
+        server.server_activate()
+
+        return server
+
+
+class SessionClient:
+
+    def __init__(self, address):
+        """Returns an instance of the `SessionClient` object.
+
+        A client keeps a pool of open connections to a server, so that
+        requests don't pay for connecting, and several threads (or `Data`
+        objects) can make requests at the same time.
+
+        Args:
+            address (str): Address of the server.
+
+        Returns:
+            SessionClient: The client.
+
+        """
+        self.family, self.address = _parse(address)
+        self._pool = []
+        self._lock = Lock()
+
+    def _connect(self):
+
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+
+        if self.family == socket.AF_INET:
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        sock.connect(self.address)
+
+        return sock, sock.makefile('rb')
+
+    def call(self, op, *args):
+        """Make a request and wait for the answer.
+
+        Returns:
+            object: The result of the operation.
+
+        Raises:
+            RuntimeError: If the server refused the request.
+
+        """
+        with self._lock:
+
+            conn = self._pool.pop() if self._pool else None
+
+        for attempt in range(2):
+
+            try:
+
+                if conn is None:
+
+                    conn = self._connect()
+
+                send_message(conn[0], (op,) + args)
+                response = recv_message(conn[1])
+
+                if response is None:
+
+                    raise ConnectionError('connection closed by the server')
+
+                break
+
+            except OSError:
+
+                # a pooled connection may have gone stale; try a fresh one
+                # once
+
+                self._discard(conn)
+                conn = None
+
+                if attempt:
+
+                    raise
+
+        with self._lock:
+
+            self._pool.append(conn)
+
+        status, result = response
+
+        if status != 'ok':
+
+            raise RuntimeError(result)
+
+        return result
+
+    def _discard(self, conn):
+
+        if conn is not None:
+
+            conn[1].close()
+            conn[0].close()
+
+    def close(self):
+        """Close all pooled connections.
+
+        """
+        with self._lock:
+
+            for conn in self._pool:
+
+                self._discard(conn)
+
+            self._pool = []
+
+
+def get_client(address):
+    """Return a shared `SessionClient` for `address`.
+
+    """
+    if address not in _clients:
+
+        _clients[address] = SessionClient(address)
+
+    return _clients[address]
+
+
+class RemoteData(Data):
+
+    def __init__(self, subj_id, exp_name, address=None, station=None,
+                 proj_id=None, batch_size=10, max_delay=5., schema=None):
+        """A `Data` object whose session is saved by a `SessionServer`.
+
+        The session is locked on the server when the object is created, so
+        creating it fails if another station is running the same subject in
+        the same experiment. Saving works like a journaled `Data` object,
+        except that journal records are collected and sent in batches, which
+        are sent when they are `batch_size` long, or at the first save
+        `max_delay` seconds after the oldest record in the batch was made.
+        Checkpoints (e.g., when the experiment is done) are always sent
+        straight away. Nothing is saved locally.
+
+        Args:
+            subj_id (str): Subject's ID.
+            exp_name (str): Name of the experiment.
+            address (:obj:`str`, optional): Address of the server. Defaults to
+                `default_address()`.
+            station (:obj:`str`, optional): Name of this station. Defaults to
+                the host name.
+            proj_id (:obj:`str`, optional): Project the data belong to.
+            batch_size (:obj:`int`, optional): Records per batch. Defaults to
+                10.
+            max_delay (:obj:`float`, optional): Seconds a record may wait for
+                its batch. Defaults to 5.
+            schema (:obj:`dict`, optional): As for `Data`.
+
+        Returns:
+            RemoteData: The data object.
+
+        """
+        self.client = get_client(address if address else default_address())
+        self.station = station if station else socket.gethostname()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.token = None
+        self._batch = []
+        self._batch_t0 = None
+        self._has_checkpoint = False
+        super(RemoteData, self).__init__(subj_id, exp_name, proj_id,
+                                         journal=True, catalog=False,
+                                         schema=schema)
+
+    def load(self):
+        """Lock the session on the server, and load it if it exists.
+
+        """
+        self.token, dic = self.client.call('lock', self.subj_id,
+                                           self.exp_name, self.station,
+                                           self.proj_id, self.schema)
+
+        if dic is not None:
+
+            self.restore(dic)
+            self._has_checkpoint = True
+
+    def _checkpointed(self):
+
+        return self._has_checkpoint
+
+    def _write(self):
+        """Send a full copy of the session, which replaces any pending
+        batch.
+
+        """
+        self._batch = []
+        self._batch_t0 = None
+        self.client.call('checkpoint', self.token, self.dic)
+        self._has_checkpoint = True
+        self._mark_journaled()
+
+        if self.exp_done:
+
+            self.release()
+
+    def _append(self, kind, body):
+
+        if not self._batch:
+
+            self._batch_t0 = monotonic()
+
+        self._batch.append((kind, body))
+
+    def _append_new(self):
+
+        super(RemoteData, self)._append_new()
+
+        if len(self._batch) >= self.batch_size or self._batch and \
+                monotonic() - self._batch_t0 >= self.max_delay:
+
+            self.sync()
+
+    def sync(self):
+        """Send any pending records.
+
+        """
+        if self._batch and self.token is not None:
+
+            self.client.call('append', self.token, self._batch)
+            self._batch = []
+            self._batch_t0 = None
+
+    def release(self):
+        """Release the lock on the server. Nothing can be saved afterwards.
+
+        """
+        if self.token is not None:
+
+            self.client.call('release', self.token)
+            self.token = None
+
+    def close(self):
+        """Send any pending records and release the lock.
+
+        """
+        self.sync()
+        self.release()
+
+
+def main():
+
+    from sys import argv
+
+    data_dir = argv[2] if len(argv) > 2 else data_path
+    makedirs(data_dir, exist_ok=True)
+
+    address = argv[1] if len(argv) > 1 else default_address(data_dir)
+    server = SessionServer(data_dir=data_dir)
+    sockserver = server.make_server(address)
+    print('serving sessions in %s at %s' % (data_dir, address))
+
+    try:
+
+        sockserver.serve_forever()
+
+    except KeyboardInterrupt:
+
+        pass
+
+    finally:
+
+        sockserver.server_close()
+        server.close()
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,308 @@
+"""Simulated participants.
+
+A simulated participant runs real experiments, in a real `MainWindow`, but on
+Qt's offscreen platform and in simulated time (see `VirtualClock`): instead
+of waiting for timers, the clock jumps to the next scheduled event, and
+instead of a person, a response model chooses a key and a response time for
+every trial. Sessions are saved exactly as usual, so simulations can be used
+to load-test storage and to check adaptive procedures. The window is
+headless: experiments skip drawing that only a person would look at.
+
+From the command line, e.g.:
+
+    python -m loocius.run -e rdm --simulate 100 --model ddm
+
+"""
+import os
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from os.path import join as pj
+from time import perf_counter
+from loocius.tools.argparser import get_parser
+from loocius.tools.clock import VirtualClock
+from loocius.tools.paths import data_path
+
+
+# run without a display, unless told otherwise; this must happen before Qt is
+# imported
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication
+from loocius.tools.qt import MainWindow
+
+
+class RandomModel:
+
+    def __init__(self, rt=.6, rt_sd=.2, min_rt=.15):
+        """Responds at random.
+
+        Args:
+            rt (:obj:`float`, optional): Mean response time in seconds.
+            rt_sd (:obj:`float`, optional): Standard deviation of response
+                times.
+            min_rt (:obj:`float`, optional): Shortest response time.
+
+        """
+        self.rt = rt
+        self.rt_sd = rt_sd
+        self.min_rt = min_rt
+
+    def response_time(self, rng):
+
+        return max(self.min_rt, rng.normal(self.rt, self.rt_sd))
+
+    def __call__(self, signal, n_keys, rng):
+        """Choose a response.
+
+        Args:
+            signal (float): Evidence for the second key over the first, or
+                `None`.
+            n_keys (int): Number of response keys.
+            rng (numpy.random.Generator): Random number generator.
+
+        Returns:
+            tuple: Index of the key, and the response time in seconds.
+
+        """
+        return int(rng.integers(n_keys)), self.response_time(rng)
+
+
+class PsychometricModel(RandomModel):
+
+    def __init__(self, slope=10., bias=0., lapse=.02, **kwargs):
+        """Chooses the second of two keys with a probability that is a
+        logistic function of the signal, with lapses.
+
+        Args:
+            slope (:obj:`float`, optional): Slope of the logistic function.
+            bias (:obj:`float`, optional): Signal at which both keys are
+                equally likely.
+            lapse (:obj:`float`, optional): Proportion of random responses.
+
+        Kwargs:
+            Response-time parameters, as for `RandomModel`.
+
+        """
+        super(PsychometricModel, self).__init__(**kwargs)
+        self.slope = slope
+        self.bias = bias
+        self.lapse = lapse
+
+    def __call__(self, signal, n_keys, rng):
+
+        if signal is None or n_keys != 2 or rng.random() < self.lapse:
+
+            return super(PsychometricModel, self).__call__(signal, n_keys, rng)
+
+        p = 1 / (1 + np.exp(-self.slope * (signal - self.bias)))
+
+        return int(rng.random() < p), self.response_time(rng)
+
+
+class DiffusionModel(RandomModel):
+
+    def __init__(self, drift=4., bound=1.2, non_decision=.3, noise=1.,
+                 dt=.001, **kwargs):
+        """A drift-diffusion model: evidence accumulates from zero, with a drift
+        proportional to the signal plus Gaussian noise, until it reaches
+        `bound / 2` (second key) or `-bound / 2` (first key).
+
+        Args:
+            drift (:obj:`float`, optional): Drift rate per unit of signal.
+            bound (:obj:`float`, optional): Separation of the bounds.
+            non_decision (:obj:`float`, optional): Non-decision time in
+                seconds.
+            noise (:obj:`float`, optional): Standard deviation of the noise
+                per square-root second.
+            dt (:obj:`float`, optional): Time step in seconds.
+
+        Kwargs:
+            Response-time parameters used when there is no signal, as for
+                `RandomModel`.
+
+        """
+        super(DiffusionModel, self).__init__(**kwargs)
+        self.drift = drift
+        self.bound = bound
+        self.non_decision = non_decision
+        self.noise = noise
+        self.dt = dt
+
+    def __call__(self, signal, n_keys, rng):
+
+        if signal is None or n_keys != 2:
+
+            return super(DiffusionModel, self).__call__(signal, n_keys, rng)
+
+        # simulate the walk in chunks of steps until it leaves the bounds
+
+        a = self.bound / 2
+        mu = self.drift * signal * self.dt
+        sd = self.noise * np.sqrt(self.dt)
+        x = 0.
+        t = 0
+
+        while True:
+
+            walk = x + np.cumsum(rng.normal(mu, sd, 512))
+            out = np.flatnonzero(np.abs(walk) >= a)
+
+            if len(out):
+
+                i = out[0]
+
+                return int(walk[i] > 0), self.non_decision + (t + i + 1) * \
+                    self.dt
+
+            x = walk[-1]
+            t += 512
+
+
+models = {
+    'random': RandomModel,
+    'psychometric': PsychometricModel,
+    'ddm': DiffusionModel,
+}
+
+
+class SimulatedWindow(MainWindow):
+
+    headless = True
+
+    def __init__(self, args, clock):
+        """A headless `MainWindow` that doesn't close, or ask for confirmation,
+        when the last experiment is over.
+
+        """
+        self.finished = False
+        super(SimulatedWindow, self).__init__(args, clock)
+
+        # nobody is watching, so nothing needs painting
+
+        self.setUpdatesEnabled(False)
+
+    def set_central_widget(self):
+
+        if self.exp_names:
+
+            super(SimulatedWindow, self).set_central_widget()
+
+        else:
+
+            self.finished = True
+
+    def closeEvent(self, event):
+
+        event.accept()
+
+
+def simulate_subject(exp_names, subj_id, model='ddm', model_args=None,
+                     max_trials=None, seed=None, data_dir=None, lang='EN',
+                     proj_id=''):
+    """Run a whole session with a simulated participant.
+
+    Args:
+        exp_names (str): Experiments, as for the `-e` option.
+        subj_id (str): Subject ID.
+        model (:obj:`str`, optional): Response model, one of `models`.
+            Defaults to `'ddm'`.
+        model_args (:obj:`dict`, optional): Parameters of the model.
+        max_trials (:obj:`int`, optional): Stop after this many trials.
+        seed (:obj:`int`, optional): Seed for the model and the experiment.
+        data_dir (:obj:`str`, optional): Where to save the session. Defaults
+            to `simulated` in the data directory.
+        lang (:obj:`str`, optional): Language. Defaults to `'EN'`.
+        proj_id (:obj:`str`, optional): Project ID.
+
+    Returns:
+        dict: Summary of the session.
+
+    """
+    t0 = perf_counter()
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    respond = models[model](**(model_args or {}))
+    app = QApplication.instance() or QApplication([])
+    clock = VirtualClock()
+    args = get_parser().parse_args([
+        '-s', subj_id, '-e', exp_names, '-l', lang, '-p', proj_id,
+        '--data_dir', data_dir if data_dir else pj(data_path, 'simulated')
+    ])
+    window = SimulatedWindow(args, clock)
+    trials = 0
+    last = None
+
+    while not window.finished and (max_trials is None or trials < max_trials):
+
+        widget = window.centralWidget()
+        details = widget.current_trial_details
+
+        if widget.cont_button.isVisible():
+
+            widget.cont_button.click()
+
+        elif details is not None and details is not last:
+
+            # a new trial has started, so respond to it
+
+            last = details
+            keys = list(widget.response_keys)
+            i, rt = respond(widget.signal(details), len(keys), rng)
+            clock.advance(rt * 1000)
+            QApplication.sendEvent(widget, QKeyEvent(QEvent.KeyPress, keys[i],
+                                                     Qt.NoModifier))
+            trials += 1
+            app.processEvents()
+
+        elif not clock.step():
+
+            break
+
+    widget = window.centralWidget()
+
+    if widget is not None:
+
+        widget.data_obj.close()
+
+    return {
+        'subj_id': subj_id, 'trials': trials, 'finished': window.finished,
+        'minutes': clock.now() / 60000, 'seconds': perf_counter() - t0,
+    }
+
+
+def simulate(exp_names, n_subjects, model='ddm', model_args=None,
+             processes=None, max_trials=None, seed=0, data_dir=None,
+             prefix='SIM'):
+    """Run many simulated participants in parallel processes.
+
+    Args:
+        exp_names (str): Experiments, as for the `-e` option.
+        n_subjects (int): Number of participants.
+        processes (:obj:`int`, optional): Number of processes. Defaults to
+            the number of CPUs.
+        seed (:obj:`int`, optional): Base seed; participant `i` gets `seed +
+            i`. Defaults to 0.
+        prefix (:obj:`str`, optional): Subject IDs are `prefix` followed by
+            a number. Defaults to `'SIM'`.
+
+    Kwargs:
+        Everything else is as for `simulate_subject`.
+
+    Yields:
+        dict: Summary of each session, as they finish.
+
+    """
+    with ProcessPoolExecutor(processes, mp_context=get_context('spawn')) as ex:
+
+        futures = [ex.submit(simulate_subject, exp_names, '%s%04i' % (
+            prefix, i), model, model_args, max_trials, seed + i, data_dir)
+                   for i in range(n_subjects)]
+
+        for future in as_completed(futures):
+
+            yield future.result()
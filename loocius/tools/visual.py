@@ -1,6 +1,57 @@
 """General tools for creating visual stimuli.
 
 """
+from collections import deque
+from threading import Event, Lock, Thread
+from loocius.tools.profiling import span
+
+
+_mask_pools = {}
+
+
+def mask_array(shape, tile, rng=None):
+    """Create the pixels of a randomly-coloured square mask.
+
+    One random colour is drawn per tile and broadcast over the tile's pixels,
+    so the full-size image is written only once.
+
+    Args:
+        shape (int): Width/height of the mask in pixels.
+        tile (int): Width/height of square tiles of solid colour.
+        rng (:obj:`numpy.random.Generator`, optional): Random number
+            generator. Defaults to a new, unseeded one.
+
+    Returns:
+        numpy.ndarray: RGB image, uint8, shape (shape, shape, 3).
+
+    """
+    import numpy as np
+
+    assert shape % tile == 0, '%i not a divisor of %i' % (tile, shape)
+
+    rng = np.random.default_rng() if rng is None else rng
+    reps = shape // tile
+    rgb = rng.integers(0, 256, (reps, 1, reps, 1, 3), dtype='uint8')
+    rgb = np.broadcast_to(rgb, (reps, tile, reps, tile, 3))
+
+    return rgb.reshape(shape, shape, 3)
+
+
+def mask_image(shape, tile, rng=None):
+    """Create a randomly-coloured square mask as a QImage.
+
+    The QImage is built directly on the NumPy buffer, which is kept alive as
+    its `ndarray` attribute. QImages, unlike QPixmaps, can be made outside the
+    GUI thread.
+
+    """
+    from PyQt5.QtGui import QImage
+
+    rgb = mask_array(shape, tile, rng)
+    image = QImage(rgb.data, shape, shape, 3 * shape, QImage.Format_RGB888)
+    image.ndarray = rgb
+
+    return image
 
 
 def square_mask(shape, tile):
@@ -16,29 +67,139 @@ def square_mask(shape, tile):
     Notes:
         Creating images takes non-zero time. To ensure accurate timing, make
             sure to send an event once successfully blitted to the screen.
+        Masks needed right before a timed presentation should come from a
+            `MaskPool` instead (see `get_mask_pool`).
 
     """
-    import numpy as np
-    from PIL import Image, ImageQt
-    from PyQt5.QtGui import QImage, QPixmap
+    from PyQt5.QtGui import QPixmap
 
-    assert shape % tile == 0, '%i not a divisor of %i' % (tile, shape)
+    return QPixmap.fromImage(mask_image(shape, tile))
 
-    reps = int(shape / tile)
-    rgb = np.random.random_integers(0, 255 + 1, (reps, reps, 3))
-    rgb = np.repeat(rgb, tile, axis=0)
-    rgb = np.repeat(rgb, tile, axis=1)
-    new = Image.fromarray((rgb * 255).astype('uint8'), 'RGB')
 
-    return QPixmap.fromImage(QImage(ImageQt.ImageQt(new)))
+class MaskPool:
 
+    def __init__(self, shape, tile, size=16, seed=None):
+        """Returns an instance of the `MaskPool` object.
 
-def colourise_hsv(src, hue):
-    """Colourise a source image using the HSV model.
+        A mask pool keeps a ring buffer of ready-made masks, refilled by a
+        background thread, so that taking a mask right before a timed
+        presentation costs next to nothing. If the pool has run dry, a mask is
+        made on the spot; `hits` and `misses` count how often each happened.
+
+        Args:
+            shape (int): Width/height of the masks in pixels.
+            tile (int): Width/height of square tiles of solid colour.
+            size (:obj:`int`, optional): Number of masks to keep ready.
+                Defaults to 16.
+            seed (:obj:`int`, optional): Seed for the random colours.
+
+        Returns:
+            MaskPool: The pool.
+
+        """
+        import numpy as np
+
+        self.shape = shape
+        self.tile = tile
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = Lock()
+        self._pool = deque(maxlen=size)
+        self._wanted = Event()
+        self._stopped = False
+        self._thread = Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _make(self):
+
+        with self._lock:
+
+            return mask_image(self.shape, self.tile, self._rng)
+
+    def _fill(self):
+        """Keep the pool topped up until stopped.
+
+        """
+        while not self._stopped:
+
+            with span('masks.refill'):
+
+                while len(self._pool) < self.size and not self._stopped:
+
+                    self._pool.append(self._make())
+
+            self._wanted.wait()
+            self._wanted.clear()
+
+    def image(self):
+        """Take a mask as a QImage.
+
+        """
+        try:
+
+            image = self._pool.popleft()
+            self.hits += 1
+
+        except IndexError:
+
+            image = self._make()
+            self.misses += 1
+
+        self._wanted.set()
+
+        return image
+
+    def pixmap(self):
+        """Take a mask as a QPixmap. Call from the GUI thread only.
+
+        """
+        from PyQt5.QtGui import QPixmap
+
+        return QPixmap.fromImage(self.image())
+
+    def stats(self):
+        """Return the pool counters.
+
+        Returns:
+            dict: `hits`, `misses`, and `ready` (masks currently in the pool).
+
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'ready': len(self._pool)}
+
+    def stop(self):
+        """Stop the background thread.
+
+        """
+        self._stopped = True
+        self._wanted.set()
+        self._thread.join()
+
+
+def get_mask_pool(shape, tile):
+    """Return a shared `MaskPool` for masks of the given size, starting it if
+    necessary.
+
+    """
+    key = (shape, tile)
+
+    if key not in _mask_pools:
+
+        _mask_pools[key] = MaskPool(shape, tile)
+
+    return _mask_pools[key]
+
+
+def colourise(src, hue, model='hsv'):
+    """Colourise a source image.
 
     Args:
         src (str): Path to a stimulus. Stimuli should all be PNGs.
         hue (int): Colour of the image (0-359).
+        model (:obj:`str`, optional): Colour model in which the hue is
+            replaced, `'hsv'` or `'lch'` (CIELAB). Defaults to `'hsv'`.
 
     Returns:
         QPixmap: A QPixmap widget.
@@ -46,50 +207,42 @@ def colourise_hsv(src, hue):
     Notes:
         Creating images takes non-zero time. To ensure accurate timing, make
             sure to send an event once successfully blitted to the screen.
-        `PIL` documentation is misleading; it can't convert to/from HSV. We
-            therefore use the third-party package  `colour-science`. This
-            package seems to have some very nice features that we might use in
-            the future, so it is a requirement.
-        HSV is not a suitable model for psychophysical experiments. CIELAB is a
-            better choice, but the function for CIELAB-based colourisation is
-            likely to me much more complex and is currently not implemented.
+        HSV is not a suitable model for psychophysical experiments, because
+            hues differ in brightness. In CIELAB, lightness and chroma are kept
+            and only the hue angle is replaced.
+        When many hues of the same stimulus are needed (e.g., while the
+            participant turns a dial), use `loocius.tools.atlas.get_atlas`,
+            which computes every hue once and caches them on disk.
 
     """
     import numpy as np
-    from PIL import Image, ImageQt
+    from PIL import Image
     from PyQt5.QtGui import QImage, QPixmap
-    from colour.models.rgb.deprecated import RGB_to_HSV, HSV_to_RGB
-
-    # load the image using PIL
+    from loocius.tools.colourise import set_hue
 
-    orig = Image.open(src)
-    data = np.array(orig)
+    # load the image using PIL; images without transparency get an opaque
+    # alpha channel
 
-    # is there an alpha channel?
+    rgba = np.array(Image.open(src).convert('RGBA'))
 
-    if data.shape[-1] == 4:
-
-        isalpha = True
-        rgb = data[..., : -1] / 255.
-        alpha = orig.split()[-1]  # save this for later
+    # change hue
 
-    else:
-        isalpha = False
-        rgb = data / 255.
+    rgba[..., :3] = set_hue(rgba[..., :3], hue, model)[0]
+    h, w = rgba.shape[:2]
+    image = QImage(rgba.data, w, h, 4 * w, QImage.Format_RGBA8888)
 
-    # convert to HSV
+    return QPixmap.fromImage(image)  # copies the data for Qt
 
-    hsv = RGB_to_HSV(rgb)
-    hue = hue / 360.  # colour-science normalises all values
 
-    # change hue
+def colourise_hsv(src, hue):
+    """Colourise a source image using the HSV model. See `colourise`.
 
-    hsv[..., [0]] = hue
-    rgb = HSV_to_RGB(hsv)
-    new = Image.fromarray((rgb * 255).astype('uint8'), 'RGB')
+    """
+    return colourise(src, hue, 'hsv')
 
-    if isalpha is True:
 
-        new.putalpha(alpha)  # reinstate transparency
+def colourise_lch(src, hue):
+    """Colourise a source image using the CIELAB/LCh model. See `colourise`.
 
-    return QPixmap.fromImage(QImage(ImageQt.ImageQt(new)))  # convert for Qt
+    """
+    return colourise(src, hue, 'lch')
@@ -0,0 +1,144 @@
+"""Tests of session checkpoints and journals in loocius.tools.data.
+
+"""
+import pytest
+from loocius.tools.control import make_control_list, requeue
+from loocius.tools.data import Data, backup_path, journal_path, \
+    read_checkpoint, read_session, write_checkpoint
+from os.path import getsize
+
+
+def session(tmp_path, **kwargs):
+
+    return Data('T01', 'test', journal=True, catalog=False,
+                data_dir=str(tmp_path), **kwargs)
+
+
+def run_trials(data, n):
+    """Take `n` trials from the control list, record them and save after
+    each, as an experiment would.
+
+    """
+    for i in range(n):
+
+        details = dict(data.control.pop(0))
+        details['rsp'] = i
+        data.results.append(details)
+        data.save()
+
+
+def test_checkpoint_round_trip(tmp_path):
+
+    path = str(tmp_path / 'T01_test.dic')
+    dic = {'subj_id': 'T01', 'results': [{'rt': 512.5, 'ratio': (0, 1)}],
+           'control': [{'coherence': .1}], 'generation': 1}
+    write_checkpoint(path, dic)
+
+    assert read_checkpoint(path) == dic
+    assert read_checkpoint(path, mmap=True) == dic
+
+
+def test_corrupt_checkpoint_falls_back_to_backup(tmp_path):
+
+    path = str(tmp_path / 'T01_test.dic')
+    old = {'results': [1], 'control': None, 'generation': 1}
+    write_checkpoint(path, old)
+    write_checkpoint(path, {'results': [1, 2], 'control': None,
+                            'generation': 2})
+
+    # a byte flipped in the body fails the checksum
+
+    with open(path, 'r+b') as f:
+
+        f.seek(getsize(path) - 1)
+        last = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([last[0] ^ 0xff]))
+
+    with pytest.raises(ValueError):
+
+        read_checkpoint(path)
+
+    assert read_checkpoint(backup_path(path)) == old
+    assert read_session(path) == old
+
+
+def test_truncated_journal_tail_is_ignored_and_repaired(tmp_path):
+
+    data = session(tmp_path)
+    data.control = make_control_list(5, False, coherence=[.1, .2])
+    data.save()
+    run_trials(data, 3)
+    jnl = journal_path(data.abspath)
+    good = getsize(jnl)
+    run_trials(data, 1)
+    data.close()
+
+    # a crash in the middle of the last trial's record
+
+    with open(jnl, 'r+b') as f:
+
+        f.truncate(good + 5)
+
+    dic = read_session(data.abspath)
+
+    assert [r['rsp'] for r in dic['results']] == [0, 1, 2]
+    assert len(dic['control']) == 7
+
+    read_session(data.abspath, repair=True)
+
+    assert getsize(jnl) == good
+
+    # the session carries on from the last good record
+
+    resumed = session(tmp_path)
+    run_trials(resumed, 2)
+    resumed.close()
+
+    assert [r['rsp'] for r in read_session(data.abspath)['results']] == \
+        [0, 1, 2, 0, 1]
+
+
+def test_resume_list_control(tmp_path):
+
+    data = session(tmp_path)
+    data.control = make_control_list(3, True, coherence=[.1, .2, .4])
+    data.save()
+    run_trials(data, 4)
+    requeue(data.control, data.results[-1], seed=data.relpath)
+    data.save()
+    remaining = list(data.control)
+    data.close()
+
+    resumed = session(tmp_path)
+
+    assert list(resumed.control) == remaining
+    assert [r['rsp'] for r in resumed.results] == [0, 1, 2, 3]
+
+    run_trials(resumed, len(remaining))
+
+    assert not resumed.control
+
+
+def test_resume_lazy_control(tmp_path):
+
+    data = session(tmp_path)
+    data.control = make_control_list(50, True, lazy=True, seed=7,
+                                     coherence=[.1, .2], ratio=[(0, 1), (1, 1)])
+    data.save()
+    run_trials(data, 10)
+    requeue(data.control, data.results[3])
+    data.save()
+    remaining = list(data.control)
+    data.close()
+
+    resumed = session(tmp_path)
+
+    assert type(resumed.control) is type(data.control)
+    assert list(resumed.control) == remaining
+    assert len(resumed.results) == 10
+
+    run_trials(resumed, len(remaining))
+
+    assert len(resumed.control) == 0
+    assert len(resumed.results) == 10 + len(remaining)
@@ -0,0 +1,41 @@
+"""Tests of loocius.tools.results.
+
+"""
+import pytest
+from loocius.tools.results import RecordTable, ResultsTable
+
+
+def test_tuple_column_to_dataframe():
+
+    pytest.importorskip('pandas')
+    table = ResultsTable([{'ratio': (0, 1)}, {'ratio': (1, 1)}])
+    df = table.to_dataframe()
+
+    assert list(df['ratio']) == [(0, 1), (1, 1)]
+
+
+def test_rdm_session_to_dataframe(tmp_path):
+
+    pytest.importorskip('pandas')
+    pytest.importorskip('PyQt5')
+
+    from loocius.tools import data
+    from loocius.tools.simulate import simulate_subject
+
+    summary = simulate_subject('rdm', 'T01', max_trials=20, seed=1,
+                               data_dir=str(tmp_path))
+    df = data.to_dataframe(data_dir=str(tmp_path), processes=1)
+
+    assert len(df) == summary['trials'] == 20
+    assert set(df['ratio']) <= {(0, 1), (1, 1)}
+    assert (df['subj_id'] == 'T01').all()
+
+
+def test_tuple_elements_that_dont_fit_go_to_extras():
+
+    table = RecordTable({'ratio': ('int8', 2)})
+    table.extend([{'ratio': (0, 1)}, {'ratio': (1.7, 2)},
+                  {'ratio': (300, 1)}])
+
+    assert [r['ratio'] for r in table] == [(0, 1), (1.7, 2), (300, 1)]
+    assert sorted(table.extras) == [1, 2]